@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.replicas.PrimaryAfterWriteMiddleware',
 ]
 
 ROOT_URLCONF = 'itemo_IMS.urls'
@@ -83,6 +87,67 @@ DATABASES = {
     }
 }
 
+# SQLite connection profiles. "default" is SQLite as it comes: a rollback journal,
+# so with several gunicorn workers a writer waits out every reader and concurrent
+# posts fail with "database is locked". "production" switches the file to WAL
+# (readers and one writer run side by side), waits up to busy_timeout for the
+# write lock instead of failing, and starts transactions with BEGIN IMMEDIATE so
+# an atomic block that reads before it writes cannot deadlock on the lock upgrade.
+# Choose one with the ITEMO_DB_PROFILE environment variable; "manage.py
+# benchmark_concurrency" measures them against each other.
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'     # WAL stays consistent; only the last commits can be lost on power failure
+            'PRAGMA busy_timeout=20000;'     # milliseconds
+            'PRAGMA mmap_size=268435456;'    # 256 MiB of the file read through the page cache
+            'PRAGMA cache_size=-65536;'      # 64 MiB per connection (negative means KiB)
+        ),
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+DB_PROFILE = os.environ.get('ITEMO_DB_PROFILE', 'default')
+if DB_PROFILE not in SQLITE_PROFILES:
+    raise ImproperlyConfigured(
+        f"Unknown ITEMO_DB_PROFILE {DB_PROFILE!r}; choose from {', '.join(SQLITE_PROFILES)}."
+    )
+DATABASES['default']['OPTIONS'] = SQLITE_PROFILES[DB_PROFILE]
+
+# Read replica for the dashboard, lists, exports and reports (see store/replicas.py).
+# Locally ITEMO_REPLICA_DB names a second SQLite file, which
+# "manage.py sync_replica --every 5" keeps copying db.sqlite3 onto.
+if os.environ.get('ITEMO_REPLICA_DB'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['ITEMO_REPLICA_DB'],
+        'OPTIONS': {'init_command': 'PRAGMA query_only=ON'},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+
+
+# Cache
+# "shared" lives in the database so every process (web and run_mpesa_worker)
+# sees the same entries. Create its table once with "manage.py createcachetable".
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'store_shared_cache',
+    },
+    'store': {     # rendered page pieces; on disk so every process sees the same generations
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'store',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -148,13 +213,38 @@ MPESA_EXPRESS_SHORTCODE = "174379"
 MPESA_SHORTCODE_TYPE = "paybill"
 MPESA_PASSKEY = "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"
 #
-MPESA_CALLBACK_URL = "https://api.darajambili.com/express-payment"
-#MPESA_CALLBACK_URL = "https://example.com/store/mpesa/callback/" # can be ngrok URL later, beware of security issues when using ngrok
+# store/mpesa/callback/ is served by store.views.mpesa_callback; set the public URL (e.g. ngrok) in the environment
+MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', 'http://localhost:8000/store/mpesa/callback/')
+# Shared secret added to the callback URL as ?token=...; callbacks without it are refused (so all are, while it is empty)
+MPESA_CALLBACK_TOKEN = os.environ.get('MPESA_CALLBACK_TOKEN', '')
 
 # These two are mainly for B2C, but django_daraja wants them defined
 MPESA_INITIATOR_USERNAME = "testapi"           # from test credentials
 MPESA_INITIATOR_SECURITY_CREDENTIAL = "Safaricom123!!"  # or the one given
 B2C_SHORTCODE = '174379'
 
+# STK pushes are sent by "manage.py run_mpesa_worker", not inside the request
+MPESA_API_BASE_URL = None          # None uses the Daraja URL for MPESA_ENVIRONMENT; point it at a stub for local testing
+MPESA_REQUEST_TIMEOUT = 10         # seconds per Daraja HTTP call
+MPESA_PUSH_MAX_ATTEMPTS = 3        # network failures are retried with backoff, then the payment is marked FAILED
+MPESA_PUSH_RETRY_DELAY = 5         # seconds before the first retry, doubled each time
+MPESA_WORKER_CONCURRENCY = 4       # pushes in flight at once per worker (also the HTTP connection pool size)
+MPESA_CACHE_ALIAS = "shared"       # cache holding the OAuth token and latency histograms, seen by every process
+MPESA_TOKEN_REFRESH_MARGIN = 60    # drop the cached token this many seconds before Daraja expires it
+MPESA_BREAKER_THRESHOLD = 5        # consecutive Daraja failures before calls stop for a while
+MPESA_BREAKER_RESET_AFTER = 30     # seconds before one trial call is let through again
+
+
+
 
+# ========= Store performance settings =========
 
+STORE_COUNTER_TABLE = False   # set True to read dashboard counters from StoreCounter (run "manage.py rebuild_counters" after turning it on)
+STORE_PAGE_SIZE = 50          # rows per page on the store list views
+STORE_MAX_PAGE_SIZE = 200     # upper limit for ?page_size=
+STORE_CACHE_ALIAS = "store"   # cache for list/dashboard fragments and cached responses (see store/caching.py)
+STORE_CACHE_TIMEOUT = 3600    # seconds; writes retire entries sooner through generation keys
+STORE_REPLICA_ALIAS = "replica"   # database the @read_replica views read from, when DATABASES has it
+STORE_REPLICA_STICKY_SECONDS = 10   # after a POST, that browser reads from default for this long
+STORE_SNAPSHOT_LAG = 300      # seconds; stock snapshots are taken this far in the past, longer than any write transaction
+STORE_ADMIN_EXACT_COUNT_LIMIT = 10000   # admin changelists estimate unfiltered totals above this many rows
@@ -0,0 +1,56 @@
+// Search box for <select data-autocomplete-url> (store.forms.AutocompleteSelect).
+// The server only renders the chosen option; matching options are fetched
+// from the JSON endpoint as the user types.
+(function () {
+    "use strict";
+
+    function setup(select) {
+        var input = document.createElement("input");
+        input.type = "search";
+        input.className = "form-control form-control-sm mb-1";
+        input.placeholder = "Type to search...";
+        input.setAttribute("aria-label", "Search " + (select.name || "options"));
+        select.parentNode.insertBefore(input, select);
+
+        var timer = null;
+        var latest = 0;
+
+        function fill(results) {
+            var chosen = select.options[select.selectedIndex];
+            var keep = chosen && chosen.value ? chosen : null;
+            var empty = select.options[0] && !select.options[0].value ? select.options[0] : null;
+
+            select.innerHTML = "";
+            if (empty) select.appendChild(empty);
+            if (keep) select.appendChild(keep);
+            results.forEach(function (result) {
+                if (keep && String(result.id) === keep.value) return;
+                select.appendChild(new Option(result.text, result.id));
+            });
+        }
+
+        function load() {
+            var request = ++latest;
+            var url = new URL(select.dataset.autocompleteUrl, window.location.href);
+            url.searchParams.set("q", input.value);
+            fetch(url, { headers: { Accept: "application/json" }, credentials: "same-origin" })
+                .then(function (response) { return response.ok ? response.json() : { results: [] }; })
+                .then(function (data) {
+                    if (request === latest) fill(data.results);   // ignore answers to older keystrokes
+                });
+        }
+
+        input.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(load, 200);
+        });
+        input.addEventListener("focus", function once() {
+            input.removeEventListener("focus", once);
+            load();
+        });
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        document.querySelectorAll("select[data-autocomplete-url]").forEach(setup);
+    });
+})();
@@ -1,43 +1,107 @@
-from django.contrib import admin
-from .models import Item, Supplier, Client, SupplierOrder, StockIssue, PaymentRecord
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+from .counters import estimated_count
+from .stock import receive_orders, save_order
+from .models import Item, Supplier, Client, SupplierOrder, StockIssue, PaymentRecord, MpesaCallback
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts an unfiltered changelist from the end of the primary key index
+    instead of COUNT(*) over the whole table, once the table is big enough
+    for the difference to matter. Filtered and searched lists count exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate > getattr(settings, "STORE_ADMIN_EXACT_COUNT_LIMIT", 10000):
+                return estimate
+        return super().count
+
+
+class StoreModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False     #saves a second COUNT(*) of the whole table on filtered lists
 
 
 @admin.register(Item)
-class ItemAdmin(admin.ModelAdmin):
-    list_display = ("name", "category", "quantity", "status", "reorder_level")
+class ItemAdmin(StoreModelAdmin):
+    list_display = ("name", "category", "quantity", "total_value", "status", "reorder_level")
     list_filter = ("status", "category")
     search_fields = ("name", "category")
+    date_hierarchy = "date_added"      #item_date_added_idx
 
 
 @admin.register(Supplier)
-class SupplierAdmin(admin.ModelAdmin):
+class SupplierAdmin(StoreModelAdmin):
     list_display = ("name", "contact_person", "phone", "is_active")
     list_filter = ("is_active",)
     search_fields = ("name", "contact_person", "phone", "email")
 
 
 @admin.register(Client)
-class ClientAdmin(admin.ModelAdmin):
+class ClientAdmin(StoreModelAdmin):
     list_display = ("name", "contact_person", "phone")
     search_fields = ("name", "contact_person", "phone", "email")
 
 
 @admin.register(SupplierOrder)
-class SupplierOrderAdmin(admin.ModelAdmin):
-    list_display = ("id", "supplier", "item", "quantity_ordered", "status", "ordered_at")
-    list_filter = ("status", "supplier")
+class SupplierOrderAdmin(StoreModelAdmin):
+    list_display = ("id", "supplier", "item", "quantity_ordered", "total_cost", "status", "ordered_at")
+    list_select_related = ("supplier", "item")
+    list_filter = ("status",)      #a supplier filter would list every supplier on each page; search by supplier name instead
     search_fields = ("supplier__name", "item__name")
+    autocomplete_fields = ("supplier", "item")
+    date_hierarchy = "ordered_at"      #order_ordered_at_idx
+    actions = ["receive_selected"]
+
+    def get_queryset(self, request):
+        # str(order) shows the supplier, so the payment form's order autocomplete
+        # needs the join too. The changelist skips list_select_related once the
+        # queryset has a select_related, hence both fields here.
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None and obj.status == "RECEIVED":
+            return ("status", "item", "quantity_ordered")     #received is final; save_order() refuses these changes
+        return ()
+
+    def save_model(self, request, obj, form, change):
+        save_order(obj)      #receiving here adds the stock, as the order form does
+
+    @admin.action(description="Receive selected pending orders")
+    def receive_selected(self, request, queryset):
+        received = receive_orders(list(queryset.values_list("pk", flat=True)))
+        self.message_user(request, f"{received} orders received and stock updated.", messages.SUCCESS)
 
 
 @admin.register(StockIssue)
-class StockIssueAdmin(admin.ModelAdmin):
+class StockIssueAdmin(StoreModelAdmin):
     list_display = ("id", "item", "client", "quantity", "issue_date")
-    list_filter = ("issue_date",)
+    list_select_related = ("item", "client")
     search_fields = ("item__name", "client__name", "issued_by")
+    autocomplete_fields = ("item", "client")
+    date_hierarchy = "issue_date"      #issue_date_idx
 
 
 @admin.register(PaymentRecord)
-class PaymentRecordAdmin(admin.ModelAdmin):
+class PaymentRecordAdmin(StoreModelAdmin):
     list_display = ("id", "method", "amount", "status", "created_at")
     list_filter = ("method", "status")
     search_fields = ("reference", "phone_number")
+    autocomplete_fields = ("order",)
+    date_hierarchy = "created_at"      #payment_created_at_idx
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(StoreModelAdmin):
+    list_display = ("checkout_request_id", "success", "reference", "received_at")
+    list_filter = ("success",)
+    search_fields = ("checkout_request_id", "reference")
+    date_hierarchy = "received_at"
@@ -0,0 +1,577 @@
+"""
+Load benchmark for the pages in store/urls.py.
+
+seed() fills a database with a store.synthetic dataset of the given sizes.
+run() then sends each route `requests` times from `concurrency` threads,
+every thread with its own logged-in test Client and database connection,
+and records per request the latency and the number of queries. The read
+routes run first and the writes after them, so the reads are timed against
+a settled cache. Each route gets one warm-up request first.
+
+Peak memory is measured in a second, sequential pass with tracemalloc
+running, because tracing every allocation would distort the latencies.
+
+The M-Pesa route queues a payment as it does in production. Afterwards the
+queued pushes are sent by dispatch.run_worker() to StubDaraja, a local
+stand-in for Safaricom, so the worker path is timed without a real network.
+
+Deletes are benchmarked by their confirmation page only, so a run leaves
+the sample rows in place.
+
+The benchmark command runs all of this in a throwaway database and writes
+the report as JSON; compare() sets two reports side by side.
+
+run_concurrency() is the writers' benchmark behind benchmark_concurrency:
+processes posting stock issues and payments at once while other processes
+load the dashboard and the item list, the traffic that several gunicorn
+workers put on one SQLite file. sqlite_profile() runs it under each connection
+profile in settings.SQLITE_PROFILES.
+"""
+
+import json
+import logging
+import math
+import multiprocessing
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import mpesa, synthetic
+from .dispatch import run_worker
+from .management.commands.replay_mpesa_callbacks import stk_callback
+from .models import Client, Item, PaymentDispatch, PaymentRecord, StockIssue, Supplier, SupplierOrder
+
+try:
+    import resource
+except ImportError:     #not on Windows
+    resource = None
+
+BENCH_USER = "bench"
+SIZES = {
+    "items": 2000,
+    "suppliers": 100,
+    "clients": 500,
+    "orders": 2000,
+    "issues": 20000,
+    "payments": 2000,
+}
+SAMPLE_SIZE = 50        #rows per model that the routes with a <pk> cycle through
+SEARCH_QUERY = "cement"
+PERCENTILES = (50, 95, 99)
+CONCURRENT_WRITES = ("issue_create POST", "payment_create POST")    #both redirect on success
+CONCURRENT_READS = ("dashboard", "item_list")
+COMPARED = [    #(label, path into a route's result)
+    ("p50 ms", ("latency_ms", "p50")),
+    ("p95 ms", ("latency_ms", "p95")),
+    ("p99 ms", ("latency_ms", "p99")),
+    ("queries", ("queries", "mean")),
+    ("peak KiB", ("peak_memory_kib",)),
+]
+
+
+# Dataset
+
+def seed(sizes, seed=0, workers=1):
+    """
+    Add a synthetic dataset of `sizes` (keys as in SIZES) with
+    store.synthetic: the same rows for the same seed, with Zipf-skewed item
+    popularity, and the counters, search index and rollups rebuilt. Returns
+    the number of rows of each kind now in the database.
+    """
+    synthetic.generate(sizes, seed=seed, workers=workers)
+    return dataset_sizes()
+
+
+def dataset_sizes():
+    return {
+        "items": Item.objects.count(),
+        "suppliers": Supplier.objects.count(),
+        "clients": Client.objects.count(),
+        "orders": SupplierOrder.objects.count(),
+        "issues": StockIssue.objects.count(),
+        "payments": PaymentRecord.objects.count(),
+    }
+
+
+def sample_ids(seed=0):
+    """Up to SAMPLE_SIZE primary keys of each model, for the routes that take one."""
+    rng = random.Random(seed)
+
+    def pick(queryset):
+        ids = list(queryset.order_by().values_list("pk", flat=True))
+        return rng.sample(ids, min(len(ids), SAMPLE_SIZE))
+
+    return {
+        "item": pick(Item.objects.all()),
+        "stocked_item": pick(Item.objects.filter(quantity__gt=0)),    #issuing from an empty item is a form error, not a 302
+        "supplier": pick(Supplier.objects.all()),
+        "client": pick(Client.objects.all()),
+        "order": pick(SupplierOrder.objects.all()),
+        "pending_order": pick(SupplierOrder.objects.filter(status="PENDING")),
+        "issue": pick(StockIssue.objects.all()),
+    }
+
+
+@contextmanager
+def benchmark_database(path=None):
+    """
+    Run the block against a new database instead of the configured one, and
+    with the store cache in a temporary directory, so neither sees the
+    other's rows or cached pages. For SQLite, `path` names the database file;
+    it is kept afterwards and reused, migrated, by the next run. Without it
+    the database is dropped at the end.
+    """
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    old_test_name = test_settings.get("NAME")
+    with tempfile.TemporaryDirectory() as tmp:
+        if connection.vendor == "sqlite":
+            test_settings["NAME"] = str(path or f"{tmp}/benchmark.sqlite3")
+        old_name = connection.settings_dict["NAME"]
+        alias = getattr(settings, "STORE_CACHE_ALIAS", "default")
+        store = {**settings.CACHES[alias], "LOCATION": f"{tmp}/store-cache"}
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=path is not None)
+        try:
+            with override_settings(CACHES={**settings.CACHES, alias: store}):
+                yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=path is not None)
+            test_settings["NAME"] = old_test_name
+
+
+# Routes
+
+class Route:
+    """One benchmarked request: a URL name, the arguments it is reversed with and what is sent."""
+
+    def __init__(self, label, url_name, method="GET", args=None, params=None, data=None, content_type=None, expect=200):
+        self.label = label
+        self.url_name = url_name
+        self.method = method
+        self.args = args                  #n -> URL arguments, for routes that take a pk
+        self.params = params or {}
+        self.data = data                  #n -> POST body; called per request so uploads are fresh
+        self.content_type = content_type
+        self.expect = expect
+
+    def path(self, n=0):
+        return reverse(self.url_name, args=self.args(n) if self.args else None)
+
+    def send(self, client, n):
+        if self.method == "GET":
+            return client.get(self.path(n), self.params)
+        path = f"{self.path(n)}?{urlencode(self.params)}" if self.params else self.path(n)
+        body = self.data(n) if self.data else {}
+        if self.content_type:
+            return client.post(path, body, content_type=self.content_type)
+        return client.post(path, body)
+
+
+def routes(sample):
+    """Every route in store/urls.py, reads first. Routes that need a row of a kind the sample lacks are left out."""
+
+    def cycle(kind):
+        ids = sample[kind]
+        return lambda n: [ids[n % len(ids)]]
+
+    def first(kind):
+        return sample[kind][0] if sample[kind] else ""
+
+    def import_file(n):
+        rows = "".join(f"Bench import {n} {row},Building,{row + 1},10.00,5\n" for row in range(5))
+        return {"file": SimpleUploadedFile("items.csv", ("name,category,quantity,unit_price,reorder_level\n" + rows).encode())}
+
+    reads = [
+        Route("main_menu", "store:main_menu"),
+        Route("dashboard", "store:dashboard"),
+        Route("dashboard?search", "store:dashboard", params={"search": SEARCH_QUERY}),
+        Route("search_api", "store:search_api", params={"q": SEARCH_QUERY}),
+        Route("autocomplete", "store:autocomplete", args=lambda n: ["item"], params={"q": SEARCH_QUERY[:3]}),
+        Route("cache_stats", "store:cache_stats"),
+        Route("valuation_report", "store:valuation_report"),
+        Route("consumption_report", "store:consumption_report", params={"period": "MONTH", "by": "item"}),
+        Route("consumption_report?category", "store:consumption_report", params={"period": "WEEK", "by": "category"}),
+    ]
+    for kind in ("item", "supplier", "client", "order", "issue", "payment"):
+        reads += [
+            Route(f"{kind}_list", f"store:{kind}_list"),
+            Route(f"{kind}_export", f"store:{kind}_export"),
+            Route(f"{kind}_create", f"store:{kind}_create"),
+        ]
+        if kind != "payment" and sample[kind]:
+            reads += [
+                Route(f"{kind}_update", f"store:{kind}_update", args=cycle(kind)),
+                Route(f"{kind}_delete", f"store:{kind}_delete", args=cycle(kind)),
+            ]
+    reads += [
+        Route("item_list?status", "store:item_list", params={"status": "LOW"}),
+        Route("item_import", "store:item_import"),
+    ]
+    if sample["order"]:
+        reads.append(Route("order_pay_mpesa", "store:order_pay_mpesa", args=cycle("order")))
+
+    writes = [
+        Route(
+            "item_create POST", "store:item_create", "POST", expect=302,
+            data=lambda n: {"name": f"Bench item {n}", "category": "Building", "quantity": 100, "unit_price": "12.50", "reorder_level": 10},
+        ),
+        Route("supplier_create POST", "store:supplier_create", "POST", expect=302, data=lambda n: {"name": f"Bench supplier {n}", "is_active": "on"}),
+        Route("client_create POST", "store:client_create", "POST", expect=302, data=lambda n: {"name": f"Bench client {n}"}),
+        Route("item_import POST", "store:item_import", "POST", data=import_file),
+        Route(
+            "payment_create POST", "store:payment_create", "POST", expect=302,
+            data=lambda n: {"order": first("order"), "method": "CASH", "amount": "100.00", "status": "SUCCESS", "reference": f"BENCH-POST-{n}"},
+        ),
+        Route(
+            "mpesa_callback POST", "store:mpesa_callback", "POST", content_type="application/json",
+            params={"token": mpesa.callback_token()},
+            data=lambda n: stk_callback(f"ws_CO_bench_unknown_{n}", True),     #no such payment: the lookup and the acknowledgement
+        ),
+    ]
+    if sample["item"]:
+        writes.append(Route(
+            "item_update POST", "store:item_update", "POST", args=cycle("item"), expect=302,
+            data=lambda n: {"name": f"Bench item {n}", "category": "Building", "quantity": 5000, "unit_price": "12.50", "reorder_level": 10},
+        ))
+    if sample["stocked_item"]:
+        writes.append(Route(
+            "issue_create POST", "store:issue_create", "POST", expect=302,
+            data=lambda n: {"item": sample["stocked_item"][n % len(sample["stocked_item"])], "client": first("client"), "quantity": 1,
+                            "issue_date": timezone.localdate().isoformat(), "issued_by": BENCH_USER},
+        ))
+    if sample["item"] and sample["supplier"]:
+        writes.append(Route(
+            "order_create POST", "store:order_create", "POST", expect=302,
+            data=lambda n: {"supplier": first("supplier"), "item": first("item"), "quantity_ordered": 5, "unit_price": "10.00", "status": "PENDING"},
+        ))
+    if sample["pending_order"]:
+        writes += [
+            Route("order_receive POST", "store:order_receive", "POST", args=cycle("pending_order"), expect=302),
+            Route(
+                "order_receive_selected POST", "store:order_receive_selected", "POST", expect=302,
+                data=lambda n: {"order": sample["pending_order"][n % len(sample["pending_order"]):][:5]},
+            ),
+        ]
+    if sample["order"]:
+        writes.append(Route(
+            "order_pay_mpesa POST", "store:order_pay_mpesa", "POST", args=cycle("order"), expect=302,
+            data=lambda n: {"phone_number": f"07{n % 100000000:08d}"},
+        ))
+    return reads + writes
+
+
+# Stubbed Daraja
+
+class StubDaraja(BaseHTTPRequestHandler):
+    """Hands out a token and accepts every STK push, each with its own CheckoutRequestID."""
+    protocol_version = "HTTP/1.1"      #keep-alive, like Daraja, so the worker's pooled session reuses connections
+
+    def _reply(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._reply({"access_token": "stub-token", "expires_in": "3599"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self._reply({"ResponseCode": "0", "CheckoutRequestID": f"ws_CO_bench_{uuid.uuid4().hex}", "MerchantRequestID": "bench"})
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def stub_daraja():
+    """Point the M-Pesa client at a StubDaraja on a free local port for the duration."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubDaraja)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with override_settings(MPESA_API_BASE_URL=f"http://127.0.0.1:{server.server_port}/", MPESA_PUSH_RETRY_DELAY=0):
+            yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Measuring
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def _client(user):
+    host = "testserver" if "testserver" in settings.ALLOWED_HOSTS else "localhost"   #as replay_mpesa_callbacks does
+    client = TestClient(SERVER_NAME=host, raise_request_exception=False)
+    client.force_login(user)
+    return client
+
+
+def _finish(response):
+    """Read the whole body, as a server would before the request counts as done."""
+    if response.streaming:
+        b"".join(response.streaming_content)
+    response.close()
+
+
+def _drive(route, numbers, user):
+    """Send the route once per n in numbers from this thread. Returns [(status, seconds, queries)]."""
+    client = _client(user)
+    results = []
+    for n in numbers:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = route.send(client, n)
+            _finish(response)
+            elapsed = time.perf_counter() - started
+        results.append((response.status_code, elapsed, len(queries)))
+    return results
+
+
+def _drive_in_thread(route, numbers, user):
+    try:
+        return _drive(route, numbers, user)
+    finally:
+        connection.close()       #each thread has its own database connection
+
+
+def run_route(route, requests, concurrency, user):
+    """Send the route `requests` times, `concurrency` at a time, and summarise the timings."""
+    _drive(route, [requests], user)        #warm-up: templates, connections, cache entries
+    started = time.perf_counter()
+    if concurrency <= 1:
+        results = _drive(route, range(requests), user)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            shares = [range(k, requests, concurrency) for k in range(concurrency)]
+            results = [r for part in pool.map(_drive_in_thread, [route] * concurrency, shares, [user] * concurrency) for r in part]
+    elapsed = time.perf_counter() - started
+    return {"method": route.method, "path": route.path(), **_summarise(results, route.expect, elapsed)}
+
+
+def _summarise(results, expect, elapsed):
+    """Counts, statuses, throughput and latency/query statistics of [(status, seconds, queries)]."""
+    latencies = sorted(seconds * 1000 for status, seconds, queries in results)
+    query_counts = [queries for status, seconds, queries in results]
+    statuses = {}
+    for status, seconds, queries in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "errors": sum(1 for status, seconds, queries in results if status != expect),
+        "statuses": statuses,
+        "requests_per_second": round(len(results) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            **{f"p{p}": round(percentile(latencies, p), 2) for p in PERCENTILES},
+            "mean": round(sum(latencies) / len(latencies), 2),
+            "max": round(latencies[-1], 2),
+        },
+        "queries": {"mean": round(sum(query_counts) / len(query_counts), 2), "max": max(query_counts)},
+    }
+
+
+def peak_memory(route, requests, user):
+    """The most Python memory (KiB) one request of the route allocated at once, over `requests` sequential requests."""
+    client = _client(user)
+    peak = 0
+    tracemalloc.start()
+    try:
+        for n in range(requests):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            _finish(route.send(client, n))
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def drain_mpesa_queue(concurrency):
+    """Send every queued STK push to StubDaraja with dispatch.run_worker() and time it."""
+    queued = PaymentDispatch.objects.count()
+    error = None
+    with stub_daraja():
+        started = time.perf_counter()
+        try:
+            run_worker(concurrency=concurrency, once=True)
+        except DatabaseError as e:     #for example "database is locked" between the worker's threads
+            error = str(e)
+        elapsed = time.perf_counter() - started
+    pushes = queued - PaymentDispatch.objects.count()
+    return {
+        "pushes": pushes,
+        "left_queued": queued - pushes,
+        "error": error,
+        "seconds": round(elapsed, 3),
+        "pushes_per_second": round(pushes / elapsed, 1) if pushes and elapsed else None,
+    }
+
+
+# Concurrent writers
+
+@contextmanager
+def sqlite_profile(name):
+    """Open every database connection made in the block, in any thread, with settings.SQLITE_PROFILES[name]."""
+    options = settings.SQLITE_PROFILES[name]
+    old = connection.settings_dict["OPTIONS"]
+    connection.close()
+    connection.settings_dict["OPTIONS"] = options      #the dict each thread's connection is created from
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict["OPTIONS"] = old
+
+
+def _client_process_init(database, caches):
+    """Point a client process at the benchmark database and cache, whether it was forked or spawned."""
+    django.setup()
+    connection.settings_dict.update(database)
+    override_settings(CACHES=caches).enable()
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+
+
+def _drive_process(route_label, numbers, user_id, seed):
+    """One client process: send the route for each n, and say when it started and finished."""
+    route = next(route for route in routes(sample_ids(seed)) if route.label == route_label)
+    began = time.time()        #wall clock, comparable between processes
+    results = _drive_in_thread(route, numbers, User.objects.get(pk=user_id))
+    return results, began, time.time()
+
+
+def run_concurrency(writers=8, readers=4, requests=25, seed=0):
+    """
+    Post the CONCURRENT_WRITES from `writers` processes while `readers`
+    processes load the CONCURRENT_READS, `requests` each, all at once
+    against the current database: one process per client, as gunicorn
+    workers are, because threads of one process take turns on the GIL and
+    hardly ever meet on SQLite's lock. Returns the writers' throughput and
+    failures (a "database is locked" is a 500) and the readers' latencies.
+    """
+    user, created = User.objects.get_or_create(username=BENCH_USER)
+    by_label = {route.label: route for route in routes(sample_ids(seed))}
+    writes = [by_label[label] for label in CONCURRENT_WRITES]
+    reads = [by_label[label] for label in CONCURRENT_READS]
+    for n, route in enumerate(writes + reads):
+        _drive(route, [writers * requests + n], user)      #warm-up, numbered after the timed posts
+    connection.close()                                     #not to be inherited by forked processes
+
+    tasks = [(writes[k % len(writes)].label, range(k * requests, (k + 1) * requests), user.pk, seed) for k in range(writers)]
+    tasks += [(reads[k % len(reads)].label, range(requests), user.pk, seed) for k in range(readers)]
+    database = {"NAME": connection.settings_dict["NAME"], "OPTIONS": connection.settings_dict["OPTIONS"]}
+    with multiprocessing.Pool(len(tasks), initializer=_client_process_init, initargs=(database, settings.CACHES)) as pool:
+        done = pool.starmap(_drive_process, tasks, chunksize=1)
+
+    def group(part):
+        results = [r for results, began, finished in part for r in results]
+        return results, max(finished for results, began, finished in part) - min(began for results, began, finished in part)
+
+    write_results, write_seconds = group(done[:writers])
+    writer = {"processes": writers, **_summarise(write_results, writes[0].expect, write_seconds)}
+    writer["writes_per_second"] = round((writer["requests"] - writer["errors"]) / write_seconds, 1)
+    report = {
+        "journal_mode": connection.cursor().execute("PRAGMA journal_mode").fetchone()[0],
+        "writers": writer,
+    }
+    if readers:
+        read_results, read_seconds = group(done[writers:])
+        report["readers"] = {"processes": readers, **_summarise(read_results, reads[0].expect, read_seconds)}
+    return report
+
+
+def max_rss_kib():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss     #bytes on macOS, KiB elsewhere
+
+
+def git_commit():
+    """`git describe` of the working tree (with -dirty when it has changes), or None outside a checkout."""
+    try:
+        described = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return described.stdout.strip() or None
+
+
+def run(requests=50, concurrency=8, memory_requests=5, only=None, mpesa_worker=True, seed=0, progress=None):
+    """
+    Benchmark every route (or those whose label is in `only`) against the
+    current database and return the report. progress(label, result) is
+    called after each route.
+    """
+    user, created = User.objects.get_or_create(username=BENCH_USER)
+    report = {
+        "commit": git_commit(),
+        "created_at": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": f"{connection.vendor} {'.'.join(map(str, connection.get_database_version()))}",
+        "dataset": dataset_sizes(),
+        "requests_per_route": requests,
+        "concurrency": concurrency,
+        "routes": {},
+    }
+    request_log = logging.getLogger("django.request")
+    level = request_log.level
+    request_log.setLevel(logging.CRITICAL)      #failed requests are counted in "statuses", not logged one by one
+    try:
+        for route in routes(sample_ids(seed)):
+            if only and route.label not in only:
+                continue
+            result = run_route(route, requests, concurrency, user)
+            result["peak_memory_kib"] = peak_memory(route, memory_requests, user) if memory_requests else None
+            report["routes"][route.label] = result
+            if progress:
+                progress(route.label, result)
+    finally:
+        request_log.setLevel(level)
+    if mpesa_worker:
+        report["mpesa_worker"] = drain_mpesa_queue(concurrency)
+    report["max_rss_kib"] = max_rss_kib()
+    return report
+
+
+def compare(baseline, report):
+    """[(route, metric, before, after)] for every route and COMPARED metric both reports have."""
+    rows = []
+    for label, result in report["routes"].items():
+        before = baseline.get("routes", {}).get(label)
+        if before is None:
+            continue
+        for metric, path in COMPARED:
+            old, new = before, result
+            for key in path:
+                old = old.get(key) if isinstance(old, dict) else None
+                new = new.get(key) if isinstance(new, dict) else None
+            if old is not None and new is not None:
+                rows.append((label, metric, old, new))
+    return rows
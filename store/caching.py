@@ -0,0 +1,216 @@
+"""
+Caching for the store's read pages.
+
+Every cached entry depends on one or more generations, e.g. "item" or
+"supplier". store.signals replaces a generation on every post_save /
+post_delete of its model, and code that writes with update() or raw SQL
+calls bump() itself. The current generations are part of each cache key, so
+after a write the old entries are simply never looked up again; nothing has
+to find and delete them.
+
+Three layers use this:
+
+- cached_fragment() caches a rendered piece of a page (a table, the dashboard
+  widgets). Fragments hold no per-user markup, so every user shares them.
+- cache_response() caches a whole response for views whose output does not
+  depend on the user, such as the JSON search endpoint.
+- conditional_page() gives pages an ETag built from the same generations and
+  answers a repeated poll with 304 Not Modified before the view runs.
+
+Entries live in the STORE_CACHE_ALIAS cache, which must be shared by all
+processes (the file backend by default). Hits and misses are counted per
+entry name; see cache_stats().
+"""
+
+import hashlib
+import time
+import uuid
+from functools import partial, wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
+
+from . import replicas
+
+
+def store_cache():
+    return caches[getattr(settings, "STORE_CACHE_ALIAS", "default")]
+
+
+def cache_timeout():
+    return getattr(settings, "STORE_CACHE_TIMEOUT", 3600)
+
+
+def _generation_key(name):
+    return f"store:gen:{name}"
+
+
+def _new_generation():
+    # Never a counter: if the cache evicts a generation, a fresh value still
+    # cannot match the keys of entries written before the eviction.
+    return f"{time.time_ns():x}{uuid.uuid4().hex[:6]}"
+
+
+def bump(*names):
+    """
+    Start new generations, so every entry that depends on them is out of date.
+    Inside a transaction this waits for the commit; bumping earlier would let
+    another request cache the old rows under the new generation.
+    """
+    transaction.on_commit(partial(bump_now, names))
+
+
+def bump_now(names):
+    """bump() without waiting for a commit. Returns the new generations, {name: generation}."""
+    fresh = {name: _new_generation() for name in names}
+    store_cache().set_many({_generation_key(name): generation for name, generation in fresh.items()}, timeout=None)
+    return fresh
+
+
+def generations(names):
+    cache = store_cache()
+    keys = [_generation_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_generation(), timeout=None)
+            found[key] = cache.get(key)     #another process may have added it first
+    return [found[key] for key in keys]
+
+
+def entry_key(name, depends_on, vary_on):
+    digest = hashlib.md5(     #a replica may lag, so what it gives is kept apart from default's
+        "|".join([*generations(depends_on), vary_on, replicas.reading_from() or ""]).encode()
+    ).hexdigest()
+    return f"store:{name}:{digest}"
+
+
+# Hit / miss counters
+
+def _stats_key(name, outcome):
+    return f"store:stats:{name}:{outcome}"
+
+
+def _count(name, outcome):
+    cache = store_cache()
+    key = _stats_key(name, outcome)
+    try:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+    except ValueError:       #evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def cache_stats(names):
+    """{entry name: {"hits": n, "misses": n}} for the given entry names."""
+    keys = [_stats_key(name, outcome) for name in names for outcome in ("hits", "misses")]
+    found = store_cache().get_many(keys)
+    return {
+        name: {outcome: found.get(_stats_key(name, outcome), 0) for outcome in ("hits", "misses")}
+        for name in names
+    }
+
+
+# Fragments
+
+def _lookup(name, depends_on, vary_on):
+    key = entry_key(name, depends_on, vary_on)
+    html = store_cache().get(key)
+    _count(name, "misses" if html is None else "hits")
+    return key, html
+
+
+def _store(key, html):
+    store_cache().set(key, html, cache_timeout())
+
+
+async def cached_fragment(name, depends_on, vary_on, template_name, get_context):
+    """
+    The HTML of template_name, from the cache when possible. get_context is a
+    coroutine function that is only awaited on a miss, so the queries behind
+    the fragment are skipped on a hit.
+    """
+    key, html = await sync_to_async(_lookup)(name, depends_on, vary_on)
+    if html is None:
+        html = render_to_string(template_name, await get_context())
+        await sync_to_async(_store)(key, html)
+    return mark_safe(html)
+
+
+# Whole responses
+
+def cache_response(name, depends_on):
+    """
+    Cache a GET view's response body, keyed by its full URL. Only for views
+    whose output is the same for every user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+            key, cached = _lookup(name, depends_on, request.get_full_path())
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                _store(key, (response.content, response["Content-Type"]))
+            return response
+        return wrapper
+    return decorator
+
+
+# Conditional GET
+
+def etag(depends_on, *parts):
+    """A strong ETag that changes whenever one of the depends_on generations does."""
+    digest = hashlib.md5("|".join([*generations(depends_on), *parts]).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def conditional_page(depends_on):
+    """
+    ETag / If-None-Match for a page built from depends_on. When the client's
+    copy is current the view never runs, so a poll that finds nothing new
+    costs the login check and a few cache reads: no store query and no
+    rendering.
+
+    The ETag also covers the URL and the session cookie, because pages show
+    who is signed in. A page with a flash message waiting gets no ETag. The
+    response says private, no-cache: browsers keep it but ask again each time,
+    and shared caches do not keep it at all. Nothing here touches the
+    database, so it is safe on async views.
+    """
+    def page_etag(request, *args, **kwargs):
+        if CookieStorage.cookie_name in request.COOKIES:
+            return None
+        session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, "")
+        return etag(depends_on, request.get_full_path(), session)
+
+    def decorator(view):
+        conditional = condition(etag_func=page_etag)(view)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                response = await conditional(request, *args, **kwargs)
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                response = conditional(request, *args, **kwargs)
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+        return wrapper
+    return decorator
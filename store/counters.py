@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max
+
+from .models import Client, PaymentRecord, StoreCounter, Supplier, SupplierOrder
+
+
+COUNTER_NAMES = (
+    "supplier_count",
+    "client_count",
+    "order_count",
+    "pending_payment_count",
+)
+
+
+def counter_table_enabled():
+    return getattr(settings, "STORE_COUNTER_TABLE", False)
+
+
+def live_counts():
+    """
+    Count suppliers, clients, orders and pending payments in one query,
+    using a scalar sub-select per table instead of four COUNT round trips.
+    """
+    qn = connection.ops.quote_name
+    sql = (
+        "SELECT "
+        f"(SELECT COUNT(*) FROM {qn(Supplier._meta.db_table)}), "
+        f"(SELECT COUNT(*) FROM {qn(Client._meta.db_table)}), "
+        f"(SELECT COUNT(*) FROM {qn(SupplierOrder._meta.db_table)}), "
+        f"(SELECT COUNT(*) FROM {qn(PaymentRecord._meta.db_table)} WHERE status = %s)"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, ["PENDING"])
+        row = cursor.fetchone()
+    return dict(zip(COUNTER_NAMES, row))
+
+
+def entity_counts():
+    """
+    Dashboard counters. Reads the StoreCounter table when STORE_COUNTER_TABLE
+    is on, otherwise falls back to live_counts(). Either way it is one query.
+    """
+    if not counter_table_enabled():
+        return live_counts()
+
+    counts = dict(
+        StoreCounter.objects.filter(name__in=COUNTER_NAMES).values_list("name", "value")
+    )
+    if len(counts) < len(COUNTER_NAMES):   #table was never seeded, build it now
+        return rebuild_counters()
+    return counts
+
+
+def bump(name, delta):
+    """Add delta to one counter with a single UPDATE (no read-modify-write)."""
+    if not counter_table_enabled() or not delta:
+        return
+    updated = StoreCounter.objects.filter(name=name).update(value=F("value") + delta)
+    if not updated:
+        rebuild_counters()
+
+
+def rebuild_counters():
+    """Recount every counter from the source tables and store the results."""
+    counts = live_counts()
+    with transaction.atomic():
+        for name, value in counts.items():
+            StoreCounter.objects.update_or_create(name=name, defaults={"value": value})
+    return counts
+
+
+def estimated_count(model):
+    """
+    A cheap row count for a whole table: the highest primary key, read from
+    the end of the primary key index. Rows deleted since make it an overestimate.
+    None when the primary key is not an integer.
+    """
+    if model._meta.pk.get_internal_type() not in ("AutoField", "BigAutoField", "SmallAutoField"):
+        return None
+    return model._default_manager.aggregate(top=Max("pk"))["top"] or 0
@@ -0,0 +1,166 @@
+"""
+Background dispatch of M-Pesa STK pushes.
+
+start_mpesa_payment only saves a PENDING PaymentRecord and a PaymentDispatch
+row. A worker process (manage.py run_mpesa_worker) claims queued rows, sends
+the pushes with bounded concurrency, retries network failures with backoff
+and writes the outcome back to the PaymentRecord.
+
+Only failures where Daraja cannot have seen the push (the connection was
+never made, or a 5xx answer) are retried. A push that went out but got no
+answer may already be on the customer's phone, so it is not sent again: its
+payment stays PENDING with reference UNCONFIRMED until someone reconciles
+it against the M-Pesa statement. Without the CheckoutRequestID that answer
+would have carried, an STK Query cannot look it up.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import mpesa
+from .models import PaymentDispatch, PaymentRecord
+
+UNCONFIRMED = "UNCONFIRMED"      #reference of a payment whose push may or may not have reached the customer
+
+
+def max_attempts():
+    return getattr(settings, "MPESA_PUSH_MAX_ATTEMPTS", 3)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next try: 5, 10, 20, ... capped at 5 minutes."""
+    base = getattr(settings, "MPESA_PUSH_RETRY_DELAY", 5)
+    return min(base * 2 ** (attempts - 1), 300)
+
+
+def enqueue_push(payment):
+    return PaymentDispatch.objects.create(payment=payment)
+
+
+def queue_mpesa_payment(order, phone_number, amount):
+    """Create a PENDING M-Pesa PaymentRecord for order and queue its push, in one transaction."""
+    with transaction.atomic():
+        payment = PaymentRecord.objects.create(
+            order=order,
+            method="MPESA",
+            amount=amount,
+            status="PENDING",
+            phone_number=phone_number,
+        )
+        enqueue_push(payment)
+    return payment
+
+
+def claim_jobs(limit, lease_seconds=60):
+    """
+    Claim up to `limit` due jobs for this worker. Each claim is a conditional
+    UPDATE, so two workers can never take the same job.
+    """
+    now = timezone.now()
+    free = Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+    candidates = list(
+        PaymentDispatch.objects.filter(free, available_at__lte=now)
+        .order_by("available_at")
+        .values_list("pk", flat=True)[: limit * 2]
+    )
+    claimed = []
+    lease = now + timedelta(seconds=lease_seconds)
+    for pk in candidates:
+        if PaymentDispatch.objects.filter(free, pk=pk).update(claimed_until=lease):
+            claimed.append(pk)
+        if len(claimed) == limit:
+            break
+    return claimed
+
+
+def send_push(job_pk):
+    """Send one claimed push and record the result. Returns the payment status afterwards."""
+    job = PaymentDispatch.objects.select_related("payment__order").get(pk=job_pk)
+    payment = job.payment
+    order = payment.order
+    try:
+        response = mpesa.stk_push(
+            payment.phone_number,
+            int(payment.amount) or 1,       #Safaricom cannot process 0 shillings
+            f"Order-{order.id}" if order else f"Payment-{payment.id}",
+            "ITEMO IMS payment",
+            mpesa.callback_url(),
+        )
+    except mpesa.CircuitOpen as e:
+        return _postpone(job, str(e), mpesa.breaker.reset_after)
+    except mpesa.MpesaUnavailable as e:
+        return _retry_or_fail(job, str(e))
+    except mpesa.MpesaOutcomeUnknown as e:
+        return _finish(job, "PENDING", UNCONFIRMED, str(e))
+    except Exception as e:       #rejected by Daraja or bad data such as a short phone number
+        return _finish(job, "FAILED", "ERROR", str(e))
+    checkout_id = response.get("CheckoutRequestID") or None
+    status = _finish(job, "PENDING", checkout_id or "MPESA_STK_SENT", checkout_request_id=checkout_id)
+    if checkout_id and mpesa.apply_kept_callback(checkout_id):     #the callback beat us here
+        status = PaymentRecord.objects.values_list("status", flat=True).get(pk=payment.pk)
+    return status
+
+
+def _finish(job, status, reference, error="", checkout_request_id=None):
+    with transaction.atomic():
+        payment = PaymentRecord.objects.select_for_update().get(pk=job.payment_id)
+        payment.status = status
+        payment.reference = reference
+        payment.checkout_request_id = checkout_request_id
+        payment.save(update_fields=["status", "reference", "checkout_request_id", "updated_at"])   #save() so the dashboard counters follow
+        job.delete()
+    return status
+
+
+def _retry_or_fail(job, error):
+    job.attempts += 1
+    if job.attempts >= max_attempts():
+        return _finish(job, "FAILED", "ERROR", error)
+    return _postpone(job, error, retry_delay(job.attempts))
+
+
+def _postpone(job, error, seconds):
+    """Put the job back in the queue. A push the breaker refused does not use up an attempt."""
+    job.last_error = error
+    job.claimed_until = None
+    job.available_at = timezone.now() + timedelta(seconds=seconds)
+    job.save(update_fields=["attempts", "last_error", "claimed_until", "available_at"])
+    return "RETRY"
+
+
+def _send_in_thread(job_pk):
+    try:
+        return send_push(job_pk)
+    finally:
+        connection.close()       #each worker thread has its own DB connection
+
+
+def process_batch(concurrency):
+    """Claim and send up to `concurrency` pushes. Returns how many were handled."""
+    jobs = claim_jobs(concurrency)
+    if concurrency <= 1 or len(jobs) <= 1:
+        for pk in jobs:
+            send_push(pk)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(_send_in_thread, jobs))
+    return len(jobs)
+
+
+def run_worker(concurrency=4, poll_interval=1.0, once=False):
+    """Keep sending queued pushes. With once=True, stop when the queue is empty."""
+    handled = 0
+    while True:
+        close_old_connections()
+        count = process_batch(concurrency)
+        handled += count
+        if not count:
+            if once:
+                return handled
+            time.sleep(poll_interval)
@@ -0,0 +1,119 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+CHUNK_SIZE = 2000
+
+# (header, field path for values_list) per export; related names are joined in the same query
+COLUMNS = {
+    "items": [
+        ("id", "id"),
+        ("name", "name"),
+        ("category", "category"),
+        ("description", "description"),
+        ("quantity", "quantity"),
+        ("unit_price", "unit_price"),
+        ("total_value", "total_value"),
+        ("status", "status"),
+        ("reorder_level", "reorder_level"),
+        ("date_added", "date_added"),
+        ("updated_at", "updated_at"),
+    ],
+    "suppliers": [
+        ("id", "id"),
+        ("name", "name"),
+        ("contact_person", "contact_person"),
+        ("phone", "phone"),
+        ("email", "email"),
+        ("address", "address"),
+        ("is_active", "is_active"),
+        ("created_at", "created_at"),
+        ("updated_at", "updated_at"),
+    ],
+    "clients": [
+        ("id", "id"),
+        ("name", "name"),
+        ("contact_person", "contact_person"),
+        ("phone", "phone"),
+        ("email", "email"),
+        ("address", "address"),
+        ("created_at", "created_at"),
+        ("updated_at", "updated_at"),
+    ],
+    "orders": [
+        ("id", "id"),
+        ("supplier", "supplier__name"),
+        ("item", "item__name"),
+        ("quantity_ordered", "quantity_ordered"),
+        ("unit_price", "unit_price"),
+        ("total_cost", "total_cost"),
+        ("status", "status"),
+        ("ordered_at", "ordered_at"),
+        ("notes", "notes"),
+        ("updated_at", "updated_at"),
+    ],
+    "issues": [
+        ("id", "id"),
+        ("item", "item__name"),
+        ("client", "client__name"),
+        ("quantity", "quantity"),
+        ("issue_date", "issue_date"),
+        ("issued_by", "issued_by"),
+        ("notes", "notes"),
+        ("updated_at", "updated_at"),
+    ],
+    "payments": [
+        ("id", "id"),
+        ("order_id", "order_id"),
+        ("method", "method"),
+        ("amount", "amount"),
+        ("status", "status"),
+        ("phone_number", "phone_number"),
+        ("reference", "reference"),
+        ("created_at", "created_at"),
+        ("updated_at", "updated_at"),
+    ],
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+
+class Echo:
+    """A file-like object whose write() just returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(headers, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _jsonl_lines(headers, rows):
+    encoder = DjangoJSONEncoder()      #handles Decimal, date and datetime
+    for row in rows:
+        yield encoder.encode(dict(zip(headers, row))) + "\n"
+
+
+def stream_export(queryset, kind, fmt):
+    """
+    Stream queryset as CSV or JSON lines. Rows come from values_list() in
+    chunks via iterator(), and each line is written as soon as it is ready,
+    so memory stays flat whatever the row count.
+    """
+    headers = [header for header, path in COLUMNS[kind]]
+    paths = [path for header, path in COLUMNS[kind]]
+    rows = queryset.values_list(*paths).iterator(chunk_size=CHUNK_SIZE)
+    lines = _csv_lines(headers, rows) if fmt == "csv" else _jsonl_lines(headers, rows)
+
+    response = StreamingHttpResponse(lines, content_type=FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+    return response
@@ -1,4 +1,7 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+
 from .models import (
     Item,
     Supplier,
@@ -9,6 +12,38 @@ from .models import (
 )
 
 
+class AutocompleteSelect(forms.Select):
+    """
+    A <select> that only holds the chosen option. style/js/autocomplete.js
+    adds a search box that fills it from store:autocomplete as the user types,
+    so rendering the form costs at most one query however big the table is.
+    """
+
+    class Media:
+        js = ["style/js/autocomplete.js"]
+
+    def __init__(self, kind, attrs=None):
+        super().__init__(attrs)
+        self.kind = kind
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs["data-autocomplete-url"] = reverse("store:autocomplete", args=[self.kind])
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        chosen = [v for v in value if v not in ("", None)]
+        options = [self.create_option(name, "", field.empty_label or "", not chosen, 0)]
+        try:
+            selected = list(self.choices.queryset.filter(pk__in=chosen)) if chosen else []
+        except (ValueError, ValidationError):     #a tampered value that is not a valid id
+            selected = []
+        for index, obj in enumerate(selected, start=1):
+            options.append(self.create_option(name, str(obj.pk), field.label_from_instance(obj), True, index))
+        return [(None, options, 0)]
+
+
 class ItemForm(forms.ModelForm):
     class Meta:
         model = Item
@@ -18,7 +53,6 @@ class ItemForm(forms.ModelForm):
             "description",
             "quantity",
             "unit_price",
-            "status",
             "reorder_level",
         ]
         widgets = {
@@ -29,11 +63,17 @@ class ItemForm(forms.ModelForm):
             ),
             "quantity": forms.NumberInput(attrs={"class": "form-control"}),
             "unit_price": forms.NumberInput(attrs={"class": "form-control"}),
-            "status": forms.Select(attrs={"class": "form-select"}),
             "reorder_level": forms.NumberInput(attrs={"class": "form-control"}),
         }
 
 
+class ItemImportForm(forms.Form):
+    file = forms.FileField(
+        help_text="A .csv or .xlsx file with a header row: name, category, description, quantity, unit_price, reorder_level.",
+        widget=forms.ClearableFileInput(attrs={"class": "form-control", "accept": ".csv,.xlsx"}),
+    )
+
+
 class SupplierForm(forms.ModelForm):
     class Meta:
         model = Supplier
@@ -88,8 +128,8 @@ class SupplierOrderForm(forms.ModelForm):
             "notes",
         ]
         widgets = {
-            "supplier": forms.Select(attrs={"class": "form-select"}),
-            "item": forms.Select(attrs={"class": "form-select"}),
+            "supplier": AutocompleteSelect("supplier", attrs={"class": "form-select"}),
+            "item": AutocompleteSelect("item", attrs={"class": "form-select"}),
             "quantity_ordered": forms.NumberInput(
                 attrs={"class": "form-control"}
             ),
@@ -113,8 +153,8 @@ class StockIssueForm(forms.ModelForm):
             "notes",
         ]
         widgets = {
-            "item": forms.Select(attrs={"class": "form-select"}),
-            "client": forms.Select(attrs={"class": "form-select"}),
+            "item": AutocompleteSelect("item", attrs={"class": "form-select"}),
+            "client": AutocompleteSelect("client", attrs={"class": "form-select"}),
             "quantity": forms.NumberInput(attrs={"class": "form-control"}),
             "issue_date": forms.DateInput(
                 attrs={"class": "form-control", "type": "date"}
@@ -138,10 +178,14 @@ class PaymentRecordForm(forms.ModelForm):
             "reference",
         ]
         widgets = {
-            "order": forms.Select(attrs={"class": "form-select"}),
+            "order": AutocompleteSelect("order", attrs={"class": "form-select"}),
             "method": forms.Select(attrs={"class": "form-select"}),
             "amount": forms.NumberInput(attrs={"class": "form-control"}),
             "status": forms.Select(attrs={"class": "form-select"}),
             "phone_number": forms.TextInput(attrs={"class": "form-control"}),
             "reference": forms.TextInput(attrs={"class": "form-control"}),
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["order"].queryset = SupplierOrder.objects.select_related("supplier")   #the label shows the supplier name
@@ -0,0 +1,204 @@
+import csv
+import io
+from functools import lru_cache
+
+from django import forms
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import caching, ledger
+from .forms import ItemForm
+from .models import Item, StockMovement, stock_status
+from .search import index_items
+
+
+IMPORT_FIELDS = ItemForm._meta.fields
+MAX_REPORTED_ERRORS = 200   #keep the error report small even for a huge bad file
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []       #(row number, message), only the first MAX_REPORTED_ERRORS
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+
+def read_rows(fileobj, filename):
+    """
+    Yield one dict per data row from a .csv or .xlsx file without loading the
+    whole file. Header names are matched case-insensitively.
+    """
+    if filename.lower().endswith(".xlsx"):
+        yield from _read_xlsx(fileobj)
+    else:
+        yield from _read_csv(fileobj)
+
+
+def _read_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = [column.strip().lower() for column in next(reader, [])]
+    for values in reader:
+        yield dict(zip(header, values))
+
+
+def _read_xlsx(fileobj):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Install openpyxl to import .xlsx files.")
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)   #read_only streams rows from the zip
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(column or "").strip().lower() for column in next(rows, ())]
+        for values in rows:
+            yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+@lru_cache(maxsize=4096)
+def _clean_value(name, value):
+    # Columns like category, unit_price and reorder_level repeat a lot in a
+    # real file, so identical cells are only validated once.
+    return ItemForm.base_fields[name].clean(value)
+
+
+def clean_row(raw):
+    """
+    Validate one row with the same field rules as ItemForm.
+    Returns (cleaned data, None) or (None, error message).
+    """
+    data = {}
+    errors = []
+    for name in IMPORT_FIELDS:
+        value = raw.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        try:
+            data[name] = _clean_value(name, value)
+        except forms.ValidationError as e:
+            errors.append(f"{name}: {' '.join(e.messages)}")
+    if errors:
+        return None, "; ".join(errors)
+    return data, None
+
+
+def import_items(rows, batch_size=2000):
+    """
+    Create or update items from an iterable of row dicts, matching existing
+    items by name. Rows are written batch_size at a time, one transaction per
+    batch, so memory stays flat however long the file is.
+    """
+    result = ImportResult()
+    batch = {}
+    for row_number, raw in enumerate(rows, start=2):   #row 1 is the header
+        result.rows += 1
+        data, error = clean_row(raw)
+        if error:
+            result.add_error(row_number, error)
+            continue
+        batch[data["name"]] = data     #a name repeated in one batch keeps the last row
+        if len(batch) >= batch_size:
+            _save_batch(batch, result)
+            batch = {}
+    if batch:
+        _save_batch(batch, result)
+
+    if result.created or result.updated:
+        caching.bump("item")
+    return result
+
+
+def _save_batch(batch, result):
+    with transaction.atomic():
+        existing = {}
+        rows = Item.objects.filter(name__in=batch.keys()).order_by("-pk").values_list("pk", "name", "quantity")
+        for pk, name, quantity in rows:
+            existing[name] = (pk, quantity)      #with duplicate names the oldest item wins
+
+        to_create, to_update, movements = [], [], []
+        for name, data in batch.items():
+            if name in existing:
+                pk, quantity = existing[name]
+                to_update.append((pk, data))
+                movements.append(StockMovement(item_id=pk, quantity=data["quantity"] - quantity, kind="ADJUST"))
+            else:
+                to_create.append(data)
+
+        last_pk = Item.objects.aggregate(last=Max("pk"))["last"] or 0
+        _insert_items(to_create)
+        _update_items(to_update)
+        created = []
+        if to_create:
+            created = list(
+                Item.objects.filter(pk__gt=last_pk, name__in=[data["name"] for data in to_create]).values_list("pk", "quantity")
+            )
+            movements.extend(StockMovement(item_id=pk, quantity=quantity, kind="OPENING") for pk, quantity in created)
+        ledger.record_many(movements)      #the raw writes above skip Item.save()
+        index_items([pk for pk, data in to_update] + [pk for pk, quantity in created])     #and the signals that keep search in sync
+    result.created += len(to_create)
+    result.updated += len(to_update)
+
+
+# The two helpers below write exactly the columns Item.objects.bulk_create /
+# bulk_update would (status and timestamps included), but as one executemany each. Building
+# and preparing every value through the ORM, and bulk_update's CASE WHEN per
+# column, were most of the import time on large files.
+
+def _columns(names):
+    qn = connection.ops.quote_name
+    return [qn(Item._meta.get_field(name).column) for name in names]
+
+
+def _insert_items(rows):
+    if not rows:
+        return
+    columns = _columns([*IMPORT_FIELDS, "status", "date_added", "updated_at"])
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        connection.ops.quote_name(Item._meta.db_table),
+        ", ".join(columns),
+        ", ".join(["%s"] * len(columns)),
+    )
+    now = Item._meta.get_field("date_added").get_db_prep_save(timezone.now(), connection)
+    params = [
+        (
+            *(data[name] for name in IMPORT_FIELDS),
+            stock_status(data["quantity"], data["reorder_level"]),
+            now,
+            now,
+        )
+        for data in rows
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def _update_items(rows):
+    if not rows:
+        return
+    sql = "UPDATE {} SET {} WHERE {} = %s".format(
+        connection.ops.quote_name(Item._meta.db_table),
+        ", ".join(f"{column} = %s" for column in _columns([*IMPORT_FIELDS, "status", "updated_at"])),
+        _columns(["id"])[0],
+    )
+    now = Item._meta.get_field("updated_at").get_db_prep_save(timezone.now(), connection)
+    params = [
+        (
+            *(data[name] for name in IMPORT_FIELDS),
+            stock_status(data["quantity"], data["reorder_level"]),
+            now,
+            pk,
+        )
+        for pk, data in rows
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
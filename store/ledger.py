@@ -0,0 +1,115 @@
+"""
+The stock ledger: StockMovement rows for every change to Item.quantity, and
+StockSnapshot rows that make point-in-time questions cheap.
+
+How many of an item were on hand at time X is its latest snapshot at or
+before X plus the movements between that snapshot and X. Both lookups are
+index range scans (snapshot_item_time_uniq, movement_item_time_idx), so the
+cost depends on how many movements an item had since its last snapshot, not
+on the size of the whole history. Run the snapshot_stock command regularly
+(for example nightly) to keep that gap short.
+
+A movement's occurred_at is set when it is written, before its transaction
+commits, so a snapshot can only be trusted for times every writer has
+committed since. take_snapshots() therefore never snapshots later than
+STORE_SNAPSHOT_LAG seconds ago, which must be longer than any write
+transaction takes.
+
+Item.save() records its own movements (see store.signals). Code that changes
+quantity with update() or raw SQL must call record() or record_many() itself,
+as take_stock() and the importer do.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Exists, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Item, StockMovement, StockSnapshot
+
+BEGINNING = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)     #stands in for "no snapshot yet"
+
+
+def record(item_id, quantity, kind, issue=None, order=None):
+    """Append one movement. quantity is the change: negative for stock going out."""
+    if item_id is None or not quantity:
+        return
+    StockMovement.objects.create(item_id=item_id, quantity=quantity, kind=kind, issue=issue, order=order)
+
+
+def record_many(movements):
+    """Append StockMovement objects in one INSERT, skipping zero changes."""
+    StockMovement.objects.bulk_create([m for m in movements if m.quantity], batch_size=2000)
+
+
+def _snapshot_before(when):
+    return StockSnapshot.objects.filter(item=OuterRef("pk"), taken_at__lte=when).order_by("-taken_at")
+
+
+def _with_on_hand(items, when):
+    """items annotated with snapshot_at and on_hand as of when."""
+    latest = _snapshot_before(when)
+    items = items.annotate(
+        snapshot_at=Coalesce(Subquery(latest.values("taken_at")[:1]), Value(BEGINNING)),
+        snapshot_quantity=Coalesce(Subquery(latest.values("quantity")[:1]), 0),
+    )
+    since_snapshot = (
+        StockMovement.objects.filter(item=OuterRef("pk"), occurred_at__gt=OuterRef("snapshot_at"), occurred_at__lte=when)
+        .order_by()
+        .values("item")
+        .annotate(total=Sum("quantity"))
+        .values("total")
+    )
+    return items.annotate(
+        on_hand=F("snapshot_quantity") + Coalesce(Subquery(since_snapshot, output_field=IntegerField()), 0)
+    )
+
+
+def on_hand_at(when, items=None):
+    """{item id: quantity on hand at `when`} for items (all items by default), in one query."""
+    items = Item.objects.all() if items is None else items
+    return dict(_with_on_hand(items.order_by(), when).values_list("pk", "on_hand"))
+
+
+def snapshot_lag():
+    return getattr(settings, "STORE_SNAPSHOT_LAG", 300)
+
+
+def take_snapshots(at=None, batch_size=2000):
+    """
+    Write a snapshot at `at` (default STORE_SNAPSHOT_LAG seconds ago) for
+    every item that has moved since its previous snapshot. Items without new
+    movements are skipped: their last snapshot already gives the answer.
+    Returns how many snapshots were written. Raises ValueError for an `at`
+    more recent than the lag allows, where a transaction still open could
+    yet commit a movement the snapshot missed.
+    """
+    latest = timezone.now() - timedelta(seconds=snapshot_lag())
+    if at is None:
+        at = latest
+    elif at > latest:
+        raise ValueError(f"Snapshots must be at least {snapshot_lag()} seconds old (STORE_SNAPSHOT_LAG).")
+    moved = StockMovement.objects.filter(item=OuterRef("pk"), occurred_at__gt=OuterRef("snapshot_at"), occurred_at__lte=at)
+    rows = (
+        _with_on_hand(Item.objects.order_by(), at)
+        .filter(Exists(moved))
+        .values_list("pk", "on_hand")
+        .iterator(chunk_size=batch_size)
+    )
+    written, batch = 0, []
+    for pk, on_hand in rows:
+        batch.append(StockSnapshot(item_id=pk, taken_at=at, quantity=on_hand))
+        if len(batch) >= batch_size:
+            written += len(StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True))
+            batch = []
+    if batch:
+        written += len(StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True))
+    return written
+
+
+def drifted_items(limit=20):
+    """[(item id, Item.quantity, ledger quantity)] for items whose ledger disagrees with Item.quantity."""
+    items = _with_on_hand(Item.objects.order_by("pk"), timezone.now()).exclude(quantity=F("on_hand"))
+    return list(items.values_list("pk", "quantity", "on_hand")[:limit])
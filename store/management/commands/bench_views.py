@@ -0,0 +1,151 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+BENCH_USER = "bench"
+DEFAULT_VIEWS = [
+    "store:dashboard",
+    "store:item_list",
+    "store:supplier_list",
+    "store:client_list",
+    "store:order_list",
+    "store:issue_list",
+    "store:payment_list",
+]
+
+
+def session_cookie():
+    """Log the bench user in once and return the Cookie header to send with every request."""
+    user, created = User.objects.get_or_create(username=BENCH_USER)
+    client = Client()
+    client.force_login(user)
+    return "; ".join(f"{name}={morsel.value}" for name, morsel in client.cookies.items())
+
+
+def run_wsgi(paths, total, workers, cookie):
+    """Serve `total` requests through wsgi.py with `workers` threads, like a threaded WSGI server."""
+    from itemo_IMS.wsgi import application
+
+    def one(n):
+        path = paths[n % len(paths)]
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "QUERY_STRING": "",
+            "SCRIPT_NAME": "",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": "localhost",
+            "HTTP_COOKIE": cookie,
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.url_scheme": "http",
+            "wsgi.version": (1, 0),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        status = []
+        started = time.perf_counter()
+        body = application(environ, lambda s, headers: status.append(s))
+        b"".join(body)
+        body.close()
+        return status[0].split()[0], time.perf_counter() - started, threading.active_count()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(one, range(total)))
+    return results, time.perf_counter() - started
+
+
+def run_asgi(paths, total, concurrency, cookie):
+    """Serve `total` requests through asgi.py on one event loop, `concurrency` in flight at a time."""
+    from itemo_IMS.asgi import application
+
+    async def one(n, gate):
+        path = paths[n % len(paths)]
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"localhost"), (b"cookie", cookie.encode())],
+            "client": ("127.0.0.1", 50000 + n % 10000),
+            "server": ("localhost", 80),
+        }
+        done = asyncio.Event()
+        sent_request = False
+        status = []
+
+        async def receive():
+            nonlocal sent_request
+            if not sent_request:
+                sent_request = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await done.wait()       #the client stays connected until the response is complete
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(str(message["status"]))
+            elif not message.get("more_body"):
+                done.set()
+
+        async with gate:
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            return status[0], time.perf_counter() - started, threading.active_count()
+
+    async def main():
+        gate = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(one(n, gate) for n in range(total)))
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    return results, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the store's read views served through wsgi.py (a thread per request) "
+        "and asgi.py (async views on one event loop) with the same number of requests "
+        "in flight. Run it against a database with realistic data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight (WSGI threads).")
+        parser.add_argument("--view", action="append", dest="views", help="URL name, repeatable.")
+
+    def handle(self, *args, **options):
+        paths = [reverse(name) for name in options["views"] or DEFAULT_VIEWS]
+        cookie = session_cookie()
+        total, concurrency = options["requests"], options["concurrency"]
+
+        for label, runner in (("WSGI", run_wsgi), ("ASGI", run_asgi)):
+            runner(paths, len(paths), 1, cookie)        #warm up templates and connections
+            results, elapsed = runner(paths, total, concurrency, cookie)
+            errors = [code for code, seconds, threads in results if code != "200"]
+            if errors:
+                raise CommandError(f"{label}: {len(errors)} requests failed (status {errors[0]}).")
+            latencies = sorted(seconds * 1000 for code, seconds, threads in results)
+            self.stdout.write(
+                f"{label}: {total} requests, {concurrency} in flight, {elapsed:.2f}s "
+                f"({total / elapsed:.0f} req/s); latency ms median {statistics.median(latencies):.1f}, "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f}; "
+                f"peak threads {max(threads for code, seconds, threads in results)}"
+            )
@@ -0,0 +1,95 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with a dataset of the given size, load-test every "
+        "store route with concurrent clients and report p50/p95/p99 latency, queries "
+        "per request and peak memory. --output saves the report as JSON and "
+        "--compare sets it against an earlier one."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.SIZES.items():
+            parser.add_argument(f"--{name}", type=int, default=default, help=f"{name.capitalize()} to seed.")
+        parser.add_argument("--seed", type=int, default=0, help="Same seed, same dataset.")
+        parser.add_argument("--workers", type=int, default=1, help="Processes generating the dataset.")
+        parser.add_argument("--requests", type=int, default=50, help="Requests per route.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Clients sending at once.")
+        parser.add_argument(
+            "--memory-requests",
+            type=int,
+            default=5,
+            help="Sequential requests per route traced for peak memory; 0 skips the memory pass.",
+        )
+        parser.add_argument("--route", action="append", dest="routes", help="Route label, repeatable (default: all).")
+        parser.add_argument("--no-mpesa-worker", action="store_true", help="Leave the queued STK pushes unsent.")
+        parser.add_argument(
+            "--db-file",
+            help="SQLite file to benchmark in. It is kept, and seeded only while it holds no items, "
+                 "so a big dataset can be reused between runs. Default: a temporary file.",
+        )
+        parser.add_argument("--output", help="Write the report to this JSON file.")
+        parser.add_argument("--compare", help="An earlier JSON report to compare against.")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1.")
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        with benchmark.benchmark_database(options["db_file"]):
+            if not benchmark.dataset_sizes()["items"]:
+                sizes = benchmark.seed(
+                    {name: options[name] for name in benchmark.SIZES}, seed=options["seed"], workers=options["workers"]
+                )
+                self.stdout.write("Seeded " + ", ".join(f"{count} {name}" for name, count in sizes.items()))
+            self.stdout.write(f"{'route':<32} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'peak KiB':>9} {'errors':>6}")
+            report = benchmark.run(
+                requests=options["requests"],
+                concurrency=options["concurrency"],
+                memory_requests=options["memory_requests"],
+                only=options["routes"],
+                mpesa_worker=not options["no_mpesa_worker"],
+                seed=options["seed"],
+                progress=self._print_route,
+            )
+
+        if "mpesa_worker" in report:
+            worker = report["mpesa_worker"]
+            self.stdout.write(f"M-Pesa worker: {worker['pushes']} pushes to the stub in {worker['seconds']}s")
+            if worker["error"]:
+                self.stderr.write(f"The worker stopped with {worker['left_queued']} pushes queued: {worker['error']}")
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}.")
+        if baseline is not None:
+            self._print_comparison(baseline, report)
+
+        failing = [label for label, result in report["routes"].items() if result["errors"]]
+        if failing:
+            self.stderr.write(f"Unexpected statuses from {', '.join(failing)}; see \"statuses\" in the report.")
+
+    def _print_route(self, label, result):
+        latency = result["latency_ms"]
+        peak = result["peak_memory_kib"]
+        self.stdout.write(
+            f"{label:<32} {latency['p50']:>8.1f} {latency['p95']:>8.1f} {latency['p99']:>8.1f} "
+            f"{result['queries']['mean']:>8.1f} {'-' if peak is None else f'{peak:.0f}':>9} {result['errors']:>6}"
+        )
+
+    def _print_comparison(self, baseline, report):
+        self.stdout.write(f"\nCompared with {baseline.get('commit') or 'the baseline'}:")
+        for label, metric, before, after in benchmark.compare(baseline, report):
+            change = f"{(after - before) / before:+.0%}" if before else "n/a"
+            self.stdout.write(f"{label:<32} {metric:<9} {before:>10.1f} -> {after:>10.1f}  {change}")
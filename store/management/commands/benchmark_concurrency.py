@@ -0,0 +1,71 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from store import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Post stock issues and payments from many processes while others load the dashboard "
+        "and item list, once per SQLite profile in settings.SQLITE_PROFILES, each in a "
+        "freshly seeded throwaway database, and report writer throughput, failed writes "
+        "and reader latency side by side."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.SIZES.items():
+            parser.add_argument(f"--{name}", type=int, default=default, help=f"{name.capitalize()} to seed.")
+        parser.add_argument("--seed", type=int, default=0, help="Same seed, same dataset.")
+        parser.add_argument("--workers", type=int, default=1, help="Processes generating the dataset.")
+        parser.add_argument("--writers", type=int, default=8, help="Processes posting at once.")
+        parser.add_argument("--readers", type=int, default=4, help="Processes reading at the same time.")
+        parser.add_argument("--requests", type=int, default=25, help="Requests per process.")
+        parser.add_argument("--profile", action="append", dest="profiles", help="Profile name, repeatable (default: all).")
+        parser.add_argument("--output", help="Write the report to this JSON file.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The connection profiles are for SQLite; the default database is not SQLite.")
+        if options["writers"] < 1 or options["readers"] < 0 or options["requests"] < 1:
+            raise CommandError("--writers and --requests must be at least 1 and --readers at least 0.")
+        profiles = options["profiles"] or list(settings.SQLITE_PROFILES)
+        unknown = [name for name in profiles if name not in settings.SQLITE_PROFILES]
+        if unknown:
+            raise CommandError(f"Unknown profile {', '.join(unknown)}; choose from {', '.join(settings.SQLITE_PROFILES)}.")
+
+        report = {"commit": benchmark.git_commit(), "created_at": timezone.now().isoformat(), "profiles": {}}
+        self.stdout.write(
+            f"{'profile':<12} {'journal':<8} {'writes/s':>9} {'failed':>7} {'write p95':>10} "
+            f"{'read p50':>9} {'read p95':>9} {'read p99':>9} {'failed':>7}"
+        )
+        for name in profiles:
+            with benchmark.sqlite_profile(name), benchmark.benchmark_database():
+                report["dataset"] = benchmark.seed(
+                    {size: options[size] for size in benchmark.SIZES}, seed=options["seed"], workers=options["workers"]
+                )
+                result = benchmark.run_concurrency(
+                    writers=options["writers"], readers=options["readers"], requests=options["requests"], seed=options["seed"]
+                )
+            report["profiles"][name] = result
+            self._print_profile(name, result)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}.")
+
+    def _print_profile(self, name, result):
+        writer = result["writers"]
+        reader = result.get("readers")
+        reads = (
+            f"{reader['latency_ms']['p50']:>9.1f} {reader['latency_ms']['p95']:>9.1f} {reader['latency_ms']['p99']:>9.1f} {reader['errors']:>7}"
+            if reader else f"{'-':>9} {'-':>9} {'-':>9} {'-':>7}"
+        )
+        self.stdout.write(
+            f"{name:<12} {result['journal_mode']:<8} {writer['writes_per_second']:>9.1f} {writer['errors']:>7} "
+            f"{writer['latency_ms']['p95']:>10.1f} {reads}"
+        )
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import forecast
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every item's reorder level and suggested order quantity from its "
+        "issue history. Needs numpy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--history-days", type=int, default=forecast.HISTORY_DAYS)
+        parser.add_argument("--lead-time-days", type=int, default=forecast.LEAD_TIME_DAYS)
+        parser.add_argument(
+            "--service-level",
+            type=float,
+            default=forecast.SERVICE_LEVEL,
+            help="Chance that stock lasts through the supplier lead time, between 0 and 1.",
+        )
+        parser.add_argument(
+            "--review-days",
+            type=int,
+            default=forecast.REVIEW_DAYS,
+            help="Days of demand a reorder should cover on top of the reorder level.",
+        )
+        parser.add_argument(
+            "--draft-orders",
+            action="store_true",
+            help="Create a DRAFT supplier order for each item that needs reordering.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Compute and report without saving.")
+
+    def handle(self, *args, **options):
+        if not 0 < options["service_level"] < 1:
+            raise CommandError("--service-level must be between 0 and 1.")
+        if options["history_days"] < 1:
+            raise CommandError("--history-days must be at least 1.")
+        try:
+            result = forecast.forecast_reorder(
+                history_days=options["history_days"],
+                lead_time_days=options["lead_time_days"],
+                service_level=options["service_level"],
+                review_days=options["review_days"],
+                create_orders=options["draft_orders"],
+                write=not options["dry_run"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{result.items} items: {result.with_history} forecast from their issues, "
+                f"{result.to_reorder} to reorder, {result.orders_created} draft orders created."
+            )
+        )
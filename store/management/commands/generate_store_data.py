@@ -0,0 +1,75 @@
+import os
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Add deterministic synthetic suppliers, clients, items, orders, issues and "
+        "payments, with Zipf-skewed item popularity, at production volumes by default. "
+        "The same --seed and --end-date give the same rows on an empty database."
+    )
+
+    def add_arguments(self, parser):
+        for table, default in synthetic.COUNTS.items():
+            parser.add_argument(f"--{table}", type=int, default=default, help=f"Default {default}.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes building rows; one process writes them. Default: one per CPU.",
+        )
+        parser.add_argument(
+            "--zipf",
+            type=float,
+            default=synthetic.ZIPF_EXPONENT,
+            help="Popularity skew: rank k is picked with weight 1/k**zipf. 0 picks evenly.",
+        )
+        parser.add_argument("--days", type=int, default=synthetic.HISTORY_DAYS, help="Days of history up to the end date.")
+        parser.add_argument("--end-date", type=date.fromisoformat, help="Last day of history, YYYY-MM-DD. Default: today.")
+        parser.add_argument("--chunk-size", type=int, default=synthetic.CHUNK_SIZE, help="Rows per batch and transaction.")
+        parser.add_argument(
+            "--skip-rebuild",
+            action="store_true",
+            help="Leave the counters, search index and consumption rollups to rebuild_counters, "
+                 "rebuild_search_index and rebuild_rollups.",
+        )
+
+    def handle(self, *args, **options):
+        counts = {table: options[table] for table in synthetic.COUNTS}
+        if min(counts.values()) < 0 or options["days"] < 1 or options["chunk_size"] < 1 or options["zipf"] < 0:
+            raise CommandError("Counts and --zipf cannot be negative; --days and --chunk-size must be at least 1.")
+        started = time.perf_counter()
+        try:
+            written = synthetic.generate(
+                counts,
+                seed=options["seed"],
+                workers=options["workers"],
+                zipf=options["zipf"],
+                days=options["days"],
+                end=options["end_date"],
+                chunk_size=options["chunk_size"],
+                rebuild=not options["skip_rebuild"],
+                progress=self._progress(started, options["verbosity"]),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+        total = sum(written.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s): "
+                + ", ".join(f"{count} {table}" for table, count in written.items())
+            )
+        )
+
+    def _progress(self, started, verbosity):
+        def report(table, written, total):
+            if written == total or verbosity > 1:
+                self.stdout.write(f"{table}: {written}/{total} after {time.perf_counter() - started:.1f}s")
+        return report
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.importer import import_items, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update items from a .csv or .xlsx file, matching by name."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        try:
+            with open(path, "rb") as fileobj:
+                result = import_items(read_rows(fileobj, path), batch_size=options["batch_size"])
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            raise CommandError(f"Could not import {path}: {e}")
+
+        for row_number, message in result.errors:
+            self.stderr.write(f"row {row_number}: {message}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{result.rows} rows read: {result.created} created, "
+                f"{result.updated} updated, {result.error_count} skipped."
+            )
+        )
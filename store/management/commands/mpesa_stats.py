@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store.mpesa import latency_histograms, reset_latency_histograms
+
+
+class Command(BaseCommand):
+    help = "Show how long Daraja calls have taken, as a histogram per call type."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Clear the histograms afterwards.")
+
+    def handle(self, *args, **options):
+        for operation, buckets in latency_histograms().items():
+            total = sum(buckets.values())
+            self.stdout.write(f"{operation}: {total} calls")
+            for label, count in buckets.items():
+                bound = "> 10000 ms" if label == "+Inf" else f"<= {label} ms"
+                self.stdout.write(f"  {bound:>12}  {count}")
+        if options["reset"]:
+            reset_latency_histograms()
+            self.stdout.write(self.style.SUCCESS("Histograms cleared."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recount the dashboard counters stored in the StoreCounter table."
+
+    def handle(self, *args, **options):
+        counts = rebuild_counters()
+        for name, value in counts.items():
+            self.stdout.write(f"{name}: {value}")
+        self.stdout.write(self.style.SUCCESS("Counters rebuilt."))
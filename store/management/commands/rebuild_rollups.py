@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Refill the daily, weekly and monthly consumption rollups from every stock issue. "
+        "Run it after writing issues without their save signals."
+    )
+
+    def handle(self, *args, **options):
+        written = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Consumption rollups rebuilt: {written} rows."))
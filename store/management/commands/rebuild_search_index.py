@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for items, suppliers and clients."
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError("The search index needs SQLite (FTS5).")
+        total = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} records."))
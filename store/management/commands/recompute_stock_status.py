@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from store import caching
+from store.models import Item
+
+
+class Command(BaseCommand):
+    help = "Recompute Item.status from quantity and reorder_level for every item, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        changed = 0
+        while True:
+            pks = list(
+                Item.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            changed += Item.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).refresh_status()
+            last_pk = pks[-1]
+        if changed:
+            caching.bump("item")
+        self.stdout.write(self.style.SUCCESS(f"Updated status on {changed} items."))
@@ -0,0 +1,141 @@
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from store import caching
+from store.counters import counter_table_enabled, rebuild_counters
+from store.models import PaymentRecord
+from store.mpesa import callback_token, with_callback_token
+
+
+def stk_callback(checkout_request_id, success):
+    """An STK callback body shaped like the ones Daraja sends."""
+    result = {
+        "MerchantRequestID": "replay",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": 0 if success else 1032,
+        "ResultDesc": "The service request is processed successfully." if success else "Request cancelled by user",
+    }
+    if success:
+        result["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": 1},
+            {"Name": "MpesaReceiptNumber", "Value": "R" + checkout_request_id[-9:].upper()},
+            {"Name": "PhoneNumber", "Value": 254712345678},
+        ]}
+    return json.dumps({"Body": {"stkCallback": result}}).encode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the M-Pesa callback: create PENDING payments, replay their STK "
+        "callbacks (each delivered several times, shuffled) and check every payment "
+        "was settled exactly once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=500)
+        parser.add_argument("--duplicates", type=int, default=3, help="Deliveries per callback.")
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument(
+            "--url",
+            help="Callback URL of a running server, with its ?token=. Without it the callbacks "
+                 "go through Django's test client in this process.",
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the replay payments afterwards.")
+
+    def handle(self, *args, **options):
+        if not options["url"] and not callback_token():
+            raise CommandError("Set MPESA_CALLBACK_TOKEN; the callback refuses every request without it.")
+        count, duplicates = options["payments"], options["duplicates"]
+        tag = uuid.uuid4().hex[:12]
+        payments = [
+            PaymentRecord(
+                method="MPESA",
+                amount=1,
+                status="PENDING",
+                phone_number="replay",
+                checkout_request_id=f"ws_CO_replay_{tag}_{n}",
+            )
+            for n in range(count)
+        ]
+        PaymentRecord.objects.bulk_create(payments, batch_size=1000)
+        caching.bump("payment")      #bulk_create sends no save signals
+        outcomes = {p.checkout_request_id: n % 4 != 0 for n, p in enumerate(payments)}   #one in four is cancelled
+
+        deliveries = [stk_callback(cid, ok) for cid, ok in outcomes.items() for _ in range(duplicates)]
+        random.shuffle(deliveries)
+        send = self._http_sender(options["url"]) if options["url"] else self._client_sender()
+
+        started = time.perf_counter()
+        if options["concurrency"] <= 1:
+            results = [send(body) for body in deliveries]
+        else:
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+                results = list(pool.map(send, deliveries))
+        elapsed = time.perf_counter() - started
+
+        try:
+            self._report(results, elapsed, tag, outcomes)
+        finally:
+            if not options["keep"]:
+                PaymentRecord.objects.filter(checkout_request_id__startswith=f"ws_CO_replay_{tag}_").delete()
+            if counter_table_enabled():
+                rebuild_counters()     #bulk_create and delete() above bypass the counter signals
+
+    def _client_sender(self):
+        url = with_callback_token(reverse("store:mpesa_callback"))
+        host = "testserver" if "testserver" in settings.ALLOWED_HOSTS else "localhost"   #the test runner only allows testserver
+
+        def send(body):
+            started = time.perf_counter()
+            response = Client(SERVER_NAME=host).post(url, body, content_type="application/json")
+            return response.status_code, time.perf_counter() - started
+        return send
+
+    def _http_sender(self, url):
+        def send(body):
+            started = time.perf_counter()
+            request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = 0
+            return status, time.perf_counter() - started
+        return send
+
+    def _report(self, results, elapsed, tag, outcomes):
+        latencies = sorted(seconds for status, seconds in results)
+        errors = sum(1 for status, seconds in results if status != 200)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(
+            f"{len(results)} callbacks in {elapsed:.2f}s ({len(results) / elapsed:.0f}/s), "
+            f"{errors} errors; latency ms p50 {percentile(0.5):.1f}, "
+            f"p95 {percentile(0.95):.1f}, p99 {percentile(0.99):.1f}"
+        )
+
+        settled = dict(
+            PaymentRecord.objects.filter(checkout_request_id__startswith=f"ws_CO_replay_{tag}_")
+            .values_list("checkout_request_id", "status")
+        )
+        wrong = [
+            cid for cid, ok in outcomes.items()
+            if settled.get(cid) != ("SUCCESS" if ok else "FAILED")
+        ]
+        if errors or wrong:
+            raise CommandError(f"{errors} failed deliveries, {len(wrong)} payments not settled correctly.")
+        self.stdout.write(self.style.SUCCESS(f"All {len(outcomes)} payments settled exactly once."))
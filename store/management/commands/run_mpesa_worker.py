@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.dispatch import run_worker
+
+
+class Command(BaseCommand):
+    help = "Send queued M-Pesa STK pushes in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=getattr(settings, "MPESA_WORKER_CONCURRENCY", 4),
+            help="How many pushes may be in flight at once.",
+        )
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument("--once", action="store_true", help="Stop when the queue is empty.")
+
+    def handle(self, *args, **options):
+        handled = run_worker(
+            concurrency=options["concurrency"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Sent {handled} STK pushes."))
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store.ledger import drifted_items, snapshot_lag, take_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a StockSnapshot for every item that moved since its last snapshot. "
+        "Run it regularly (for example nightly from cron) so point-in-time stock "
+        "queries only add up a few movements."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lag",
+            type=int,
+            default=snapshot_lag(),
+            help="Snapshot this many seconds in the past, so transactions still open now cannot "
+                 "add a movement before the snapshot after it was written. At least STORE_SNAPSHOT_LAG.",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Also compare the ledger with Item.quantity and fail if they disagree.",
+        )
+
+    def handle(self, *args, **options):
+        at = timezone.now() - timedelta(seconds=options["lag"])
+        try:
+            written = take_snapshots(at, batch_size=options["batch_size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} snapshots at {at:%Y-%m-%d %H:%M:%S}."))
+
+        if options["check"]:
+            drifted = drifted_items()
+            for pk, quantity, on_hand in drifted:
+                self.stdout.write(f"Item #{pk}: quantity {quantity}, ledger {on_hand}")
+            if drifted:
+                raise CommandError(f"At least {len(drifted)} items disagree with the ledger.")
+            self.stdout.write("Ledger matches Item.quantity.")
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from store.replicas import replica_alias, sync_replica
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the default SQLite database over the STORE_REPLICA_ALIAS file that the "
+        "dashboard, lists, exports and reports read from. With --every, keep copying."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--every",
+            type=float,
+            default=0,
+            help="Seconds between copies; 0 copies once. Keep it below STORE_REPLICA_STICKY_SECONDS.",
+        )
+
+    def handle(self, *args, **options):
+        if options["every"] < 0:
+            raise CommandError("--every cannot be negative.")
+        while True:
+            close_old_connections()
+            started = time.perf_counter()
+            try:
+                bumped = sync_replica()
+            except ValueError as e:
+                raise CommandError(str(e))
+            if options["verbosity"] > 1 or not options["every"]:
+                self.stdout.write(
+                    f"Copied to {replica_alias()} in {time.perf_counter() - started:.2f}s; "
+                    f"cache generations bumped: {', '.join(bumped) or 'none'}."
+                )
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
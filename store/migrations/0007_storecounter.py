@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_alter_stockissue_client_alter_stockissue_item_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoreCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS store_search USING fts5("
+    "name, category, description, contact, "
+    "prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+)
+
+FILL_SQL = [
+    "INSERT INTO store_search(rowid, name, category, description, contact) "
+    "SELECT id * 4 + 1, name, COALESCE(category, ''), COALESCE(description, ''), '' "
+    "FROM store_item",
+    "INSERT INTO store_search(rowid, name, category, description, contact) "
+    "SELECT id * 4 + 2, name, '', COALESCE(address, ''), "
+    "COALESCE(contact_person, '') || ' ' || COALESCE(phone, '') || ' ' || COALESCE(email, '') "
+    "FROM store_supplier",
+    "INSERT INTO store_search(rowid, name, category, description, contact) "
+    "SELECT id * 4 + 3, name, '', COALESCE(address, ''), "
+    "COALESCE(contact_person, '') || ' ' || COALESCE(phone, '') || ' ' || COALESCE(email, '') "
+    "FROM store_client",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":   #FTS5 is SQLite only, other databases use icontains
+        return
+    schema_editor.execute(CREATE_SQL)
+    for sql in FILL_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS store_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_storecounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:43
+
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+
+
+def derive_status(apps, schema_editor):
+    Item = apps.get_model("store", "Item")
+    Item.objects.update(
+        status=Case(
+            When(quantity=0, then=Value("OUT")),
+            When(quantity__lte=F("reorder_level"), then=Value("LOW")),
+            default=Value("OK"),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='status',
+            field=models.CharField(choices=[('OK', 'OK'), ('LOW', 'Low Stock'), ('OUT', 'Out of Stock')], default='OK', editable=False, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['status', 'name'], name='item_status_name_idx'),
+        ),
+        migrations.RunPython(derive_status, migrations.RunPython.noop),
+    ]
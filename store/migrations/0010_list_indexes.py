@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_item_status_derived'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['name'], name='client_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['name'], name='item_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['date_added'], name='item_date_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['status', 'quantity', 'unit_price'], name='item_stock_totals_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentrecord',
+            index=models.Index(fields=['created_at'], name='payment_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentrecord',
+            index=models.Index(fields=['status', 'created_at'], name='payment_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockissue',
+            index=models.Index(fields=['issue_date'], name='issue_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockissue',
+            index=models.Index(fields=['item', 'issue_date'], name='issue_item_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockissue',
+            index=models.Index(fields=['client', 'issue_date'], name='issue_client_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplier',
+            index=models.Index(fields=['name'], name='supplier_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierorder',
+            index=models.Index(fields=['ordered_at'], name='order_ordered_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierorder',
+            index=models.Index(fields=['status', 'ordered_at'], name='order_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierorder',
+            index=models.Index(fields=['supplier', 'ordered_at'], name='order_supplier_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_paymentdispatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentrecord',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, unique=True),
+        ),
+    ]
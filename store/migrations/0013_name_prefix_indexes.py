@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:10
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_paymentrecord_checkout_request_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='client_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='item_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplier',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='supplier_name_lower_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:19
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_name_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='total_value',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('quantity'), '*', models.F('unit_price')), output_field=models.DecimalField(decimal_places=2, max_digits=22)),
+        ),
+        migrations.AddField(
+            model_name='supplierorder',
+            name='total_cost',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('quantity_ordered'), '*', models.F('unit_price')), output_field=models.DecimalField(decimal_places=2, max_digits=22)),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'quantity', 'unit_price'], name='item_category_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['total_value'], name='item_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierorder',
+            index=models.Index(fields=['status', 'supplier', 'quantity_ordered', 'unit_price'], name='order_open_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierorder',
+            index=models.Index(fields=['total_cost'], name='order_cost_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def opening_balances(apps, schema_editor):
+    """The ledger starts now: one OPENING movement per item with stock on hand."""
+    Item = apps.get_model("store", "Item")
+    StockMovement = apps.get_model("store", "StockMovement")
+    now = timezone.now()
+    rows = (
+        StockMovement(item_id=pk, quantity=quantity, kind="OPENING", occurred_at=now)
+        for pk, quantity in Item.objects.filter(quantity__gt=0).values_list("pk", "quantity").iterator()
+    )
+    StockMovement.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_valuation_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('kind', models.CharField(choices=[('OPENING', 'Opening balance'), ('ISSUE', 'Issued'), ('RETURN', 'Returned'), ('RECEIPT', 'Received'), ('ADJUST', 'Adjusted')], max_length=10)),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('issue', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movements', to='store.stockissue')),
+                ('item', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movements', to='store.item')),
+                ('order', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movements', to='store.supplierorder')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item', 'occurred_at', 'quantity'], name='movement_item_time_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('item', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='snapshots', to='store.item')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item', 'taken_at'), name='snapshot_item_time_uniq')],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
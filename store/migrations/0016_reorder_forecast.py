@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='stockissue',
+            name='issue_item_date_idx',
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='daily_demand',
+            field=models.FloatField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='demand_std',
+            field=models.FloatField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='reorder_quantity',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='supplierorder',
+            name='status',
+            field=models.CharField(choices=[('DRAFT', 'Draft'), ('PENDING', 'Pending'), ('RECEIVED', 'Received'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='stockissue',
+            index=models.Index(fields=['item', 'issue_date', 'quantity'], name='issue_item_date_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_rollups(apps, schema_editor):
+    """Count the issues already written, as "manage.py rebuild_rollups" does."""
+    from store.rollups import rebuild
+    rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_reorder_forecast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('WEEK', 'Week'), ('MONTH', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('issue_count', models.IntegerField(default=0)),
+                ('category', models.CharField(blank=True, max_length=100)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'period', 'period_start', 'quantity', 'issue_count'], name='category_rollup_series_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'period_start', 'category'), name='category_rollup_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ClientConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('WEEK', 'Week'), ('MONTH', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('issue_count', models.IntegerField(default=0)),
+                ('client', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.client')),
+                ('item', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.item')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', 'period', 'period_start', 'item', 'quantity', 'issue_count'], name='client_rollup_series_idx'), models.Index(fields=['item', 'period', 'period_start', 'client', 'quantity', 'issue_count'], name='client_rollup_item_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'period_start', 'client', 'item'), name='client_rollup_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ItemConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('WEEK', 'Week'), ('MONTH', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('issue_count', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.item')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item', 'period', 'period_start', 'quantity', 'issue_count'], name='item_rollup_series_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'period_start', 'item'), name='item_rollup_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('success', models.BooleanField()),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
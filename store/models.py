@@ -1,7 +1,79 @@
 from django.db import models
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Lower, Now
+from django.db.models.lookups import LessThanOrEqual
 from django.utils import timezone
 
 
+def stock_status(quantity, reorder_level):
+    """OUT at zero, LOW at or below the reorder level, otherwise OK."""
+    if quantity <= 0:
+        return "OUT"
+    if quantity <= reorder_level:
+        return "LOW"
+    return "OK"
+
+
+def stock_status_expression(quantity=F("quantity"), reorder_level=F("reorder_level")):
+    """
+    stock_status() as a SQL CASE, so status can be set in the same UPDATE
+    that changes the quantity. Pass the new quantity expression, for example
+    F("quantity") - 3, because every SET clause reads the old row values.
+    """
+    if not hasattr(quantity, "resolve_expression"):
+        quantity = Value(quantity)
+    if not hasattr(reorder_level, "resolve_expression"):
+        reorder_level = Value(reorder_level)
+    return Case(
+        When(LessThanOrEqual(quantity, 0), then=Value("OUT")),
+        When(LessThanOrEqual(quantity, reorder_level), then=Value("LOW")),
+        default=Value("OK"),
+    )
+
+
+class ItemQuerySet(models.QuerySet):
+    """Keeps Item.status and updated_at in step on bulk writes too."""
+
+    def update(self, **kwargs):
+        if "status" not in kwargs and ("quantity" in kwargs or "reorder_level" in kwargs):
+            kwargs["status"] = stock_status_expression(
+                kwargs.get("quantity", F("quantity")),
+                kwargs.get("reorder_level", F("reorder_level")),
+            )
+        kwargs.setdefault("updated_at", timezone.now())
+        return super().update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.status = stock_status(obj.quantity, obj.reorder_level)
+        created = super().bulk_create(objs, *args, **kwargs)
+        StockMovement.objects.bulk_create(      #opening balances, as post_save would have written them
+            StockMovement(item_id=obj.pk, quantity=obj.quantity, kind="OPENING")
+            for obj in created
+            if obj.pk is not None and obj.quantity
+        )
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        if "quantity" in fields or "reorder_level" in fields:
+            for obj in objs:
+                obj.status = stock_status(obj.quantity, obj.reorder_level)
+            fields += [] if "status" in fields else ["status"]
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        fields += [] if "updated_at" in fields else ["updated_at"]
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def refresh_status(self):
+        """Recompute status from the current quantities, touching only rows that are wrong."""
+        expression = stock_status_expression()
+        return self.exclude(status=expression).update(status=expression)
+
+
 class Item(models.Model):
     STATUS_CHOICES = [
         ("OK", "OK"), #left side is how it's stored in database, right side is  how it's shown to user
@@ -14,19 +86,43 @@ class Item(models.Model):
     description = models.TextField(blank=True, null=True)
     quantity = models.PositiveIntegerField(default=0)
     unit_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="OK")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="OK", editable=False)   #worked out from quantity and reorder_level, never typed in
     date_added = models.DateTimeField(auto_now_add=True)                            #It never updates again. It is basically a "created at" timestamp for the item.
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())     #ItemQuerySet sets it on update() and bulk_update() too; db_default covers raw SQL inserts
     reorder_level = models.PositiveIntegerField(default=0)
+    # db_default too, because the importer inserts items with plain SQL
+    daily_demand = models.FloatField(default=0, db_default=0, editable=False)            #average units issued per day; set by store.forecast
+    demand_std = models.FloatField(default=0, db_default=0, editable=False)              #day-to-day spread of that demand
+    reorder_quantity = models.PositiveIntegerField(default=0, db_default=0, editable=False)   #suggested order size; 0 while stock is above reorder_level
+    total_value = models.GeneratedField(      #quantity * unit_price, kept by the database so it can be summed, sorted and filtered
+        expression=F("quantity") * F("unit_price"),
+        output_field=models.DecimalField(max_digits=22, decimal_places=2),
+        db_persist=True,
+    )
+
+    objects = ItemQuerySet.as_manager()
 
     class Meta:
         ordering = ["name"]     #tells Django that when you ask for a list of Items,  it should sort them by the name field in ascending order
+        indexes = [
+            models.Index(fields=["name"], name="item_name_idx"),
+            models.Index(Lower("name"), name="item_name_lower_idx"),     #case-insensitive prefix search (autocomplete)
+            models.Index(fields=["date_added"], name="item_date_added_idx"),     #dashboard table, newest first
+            models.Index(fields=["status", "name"], name="item_status_name_idx"),   #low/out of stock lists and counts
+            models.Index(fields=["status", "quantity", "unit_price"], name="item_stock_totals_idx"),   #covers the dashboard totals
+            models.Index(fields=["category", "quantity", "unit_price"], name="item_category_value_idx"),   #covers stock value by category
+            models.Index(fields=["total_value"], name="item_value_idx"),     #sort and filter by value
+        ]
 
     def __str__(self):          #When you print an Item object, Django will show its name, such as "Cement 50kg Bag".
         return self.name
 
-    @property               #It means you can use it like a field, for example item.total_value, without calling it like a function.
-    def total_value(self):
-        return self.quantity * self.unit_price
+    def save(self, *args, **kwargs):
+        self.status = stock_status(self.quantity, self.reorder_level)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "status" not in update_fields:
+            kwargs["update_fields"] = [*update_fields, "status", *([] if "updated_at" in update_fields else ["updated_at"])]
+        super().save(*args, **kwargs)
 
 
 class Supplier(models.Model):
@@ -37,9 +133,14 @@ class Supplier(models.Model):
     address = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)   #means new suppliers start as active by default
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
 
     class Meta:
         ordering = ["name"]  #orders suppliers ascending order alphabetically by name
+        indexes = [
+            models.Index(fields=["name"], name="supplier_name_idx"),
+            models.Index(Lower("name"), name="supplier_name_lower_idx"),
+        ]
 
 
     def __str__(self):
@@ -53,9 +154,14 @@ class Client(models.Model):
     email = models.EmailField(blank=True, null=True)
     address = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["name"], name="client_name_idx"),
+            models.Index(Lower("name"), name="client_name_lower_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -64,6 +170,7 @@ class Client(models.Model):
 class SupplierOrder(models.Model):
     
     STATUS_CHOICES = [                      #variable to declare different status options for supplier orders
+        ("DRAFT", "Draft"),                 #suggested by the reorder forecast, not sent to the supplier yet
         ("PENDING", "Pending"),
         ("RECEIVED", "Received"),
         ("CANCELLED", "Cancelled"),
@@ -78,19 +185,28 @@ class SupplierOrder(models.Model):
     unit_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING",)
     ordered_at = models.DateField(auto_now_add=True, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
     notes = models.TextField(blank=True, null=True)
+    total_cost = models.GeneratedField(       #quantity_ordered * unit_price, computed by the database like Item.total_value
+        expression=F("quantity_ordered") * F("unit_price"),
+        output_field=models.DecimalField(max_digits=22, decimal_places=2),
+        db_persist=True,
+    )
 
     class Meta:
         ordering = ["-ordered_at"]     #Orders will be returned sorted by date in descending order.The minus sign means "newest first".
+        indexes = [
+            models.Index(fields=["ordered_at"], name="order_ordered_at_idx"),
+            models.Index(fields=["status", "ordered_at"], name="order_status_date_idx"),
+            models.Index(fields=["supplier", "ordered_at"], name="order_supplier_date_idx"),
+            models.Index(fields=["status", "supplier", "quantity_ordered", "unit_price"], name="order_open_value_idx"),   #covers open-order value by supplier
+            models.Index(fields=["total_cost"], name="order_cost_idx"),     #sort and filter by cost
+        ]
 
     def __str__(self):
         supplier_name = self.supplier.name if self.supplier else "Unknown supplier"
         return f"Order #{self.id} - {supplier_name}"   #self.id is the primary key auto integer.self.supplier.name shows the linked supplier name.
 
-    @property
-    def total_cost(self):     #not saved in the database, just computed when needed.
-        return self.quantity_ordered * self.unit_price
-
 
 class StockIssue(models.Model):     # SET_NULL must be combined with null=True (and usually blank=True)
     item = models.ForeignKey(Item, on_delete=models.SET_NULL, null=True,
@@ -105,9 +221,15 @@ class StockIssue(models.Model):     # SET_NULL must be combined with null=True (
     issue_date = models.DateField(default=timezone.now, null=True, blank=True)
     issued_by = models.CharField(max_length=150, blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
 
     class Meta:
         ordering = ["-issue_date"]   #Issues will be listed from newest to oldest.
+        indexes = [
+            models.Index(fields=["issue_date"], name="issue_date_idx"),
+            models.Index(fields=["item", "issue_date", "quantity"], name="issue_item_date_idx"),     #quantity: covers the reorder forecast
+            models.Index(fields=["client", "issue_date"], name="issue_client_date_idx"),
+        ]
 
     def __str__(self):
         client_name = self.client.name if self.client else "N/A"         # item can now also be None because of SET_NULL
@@ -153,10 +275,191 @@ class PaymentRecord(models.Model):
         blank=True,
         help_text="Payment reference or transaction code.",
     )
+    checkout_request_id = models.CharField(      #Daraja's id for an STK push; the callback is matched on it
+        max_length=100,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+    )
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
 
     class Meta:
         ordering = ["-created_at"]     #Payment records will appear from newest to oldest.
+        indexes = [
+            models.Index(fields=["created_at"], name="payment_created_at_idx"),
+            models.Index(fields=["status", "created_at"], name="payment_status_date_idx"),   #pending payments
+        ]
 
     def __str__(self):
         return f"{self.method} {self.amount} ({self.status})"
+
+
+class PaymentDispatch(models.Model):
+    """
+    A queued M-Pesa STK push for a PaymentRecord. The request only adds a
+    row here; the run_mpesa_worker command sends the push and deletes the row.
+    """
+    payment = models.OneToOneField(PaymentRecord, on_delete=models.CASCADE, related_name="dispatch")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)      #not picked up before this time (used for retry backoff)
+    claimed_until = models.DateTimeField(null=True, blank=True)    #a worker is busy with it until then
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["available_at"], name="dispatch_available_idx"),
+        ]
+
+    def __str__(self):
+        return f"STK push for payment #{self.payment_id} (attempt {self.attempts})"
+
+
+class MpesaCallback(models.Model):
+    """
+    An STK callback that matched no payment when it arrived, kept so it is
+    not lost: usually it came before the worker had saved the payment's
+    CheckoutRequestID, and is applied as soon as it has (see store.mpesa).
+    """
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    success = models.BooleanField()
+    reference = models.CharField(max_length=100, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"STK callback {self.checkout_request_id}"
+
+
+class StoreCounter(models.Model):
+    """
+    Running totals for the dashboard, kept up to date by store.signals
+    so the page can read every counter in one small query.
+    """
+    name = models.CharField(max_length=50, primary_key=True)   #for example "supplier_count"
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class StockMovement(models.Model):
+    """
+    One change to an item's quantity, positive or negative. Rows are only
+    ever added: store.ledger writes one for every stock change and answers
+    "how many were on hand at time X" from them and StockSnapshot.
+
+    The foreign keys have no database constraint and are never cascaded, so
+    deleting an item, issue or order leaves its history in place.
+    """
+    KIND_CHOICES = [
+        ("OPENING", "Opening balance"),
+        ("ISSUE", "Issued"),
+        ("RETURN", "Returned"),
+        ("RECEIPT", "Received"),
+        ("ADJUST", "Adjusted"),
+    ]
+
+    item = models.ForeignKey(Item, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name="movements")
+    quantity = models.IntegerField()      #the change: negative when stock goes out
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    occurred_at = models.DateTimeField(default=timezone.now)
+    issue = models.ForeignKey(StockIssue, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="movements")
+    order = models.ForeignKey(SupplierOrder, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="movements")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["item", "occurred_at", "quantity"], name="movement_item_time_idx"),   #covers the delta sum after a snapshot
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} of item #{self.item_id} at {self.occurred_at:%Y-%m-%d %H:%M}"
+
+
+class StockSnapshot(models.Model):
+    """
+    An item's on-hand quantity at taken_at, counting every movement up to and
+    including that moment. Written by the snapshot_stock command, so a
+    point-in-time query only adds the movements after the latest snapshot.
+    """
+    item = models.ForeignKey(Item, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name="snapshots")
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["item", "taken_at"], name="snapshot_item_time_uniq"),   #also the index for "latest before X"
+        ]
+
+    def __str__(self):
+        return f"Item #{self.item_id}: {self.quantity} at {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class ConsumptionRollup(models.Model):
+    """
+    Units issued per period, kept in step with StockIssue by store.rollups so
+    consumption reports never read the issues themselves. One row per period
+    length, period start and key; a row's period_start is the first day of its
+    day, ISO week (Monday) or month.
+    """
+    PERIOD_CHOICES = [
+        ("DAY", "Day"),
+        ("WEEK", "Week"),
+        ("MONTH", "Month"),
+    ]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    quantity = models.BigIntegerField(default=0)
+    issue_count = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ItemConsumption(ConsumptionRollup):
+    item = models.ForeignKey(Item, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "period_start", "item"], name="item_rollup_uniq"),    #also top items in a range
+        ]
+        indexes = [
+            models.Index(fields=["item", "period", "period_start", "quantity", "issue_count"], name="item_rollup_series_idx"),   #covers one item's series
+        ]
+
+    def __str__(self):
+        return f"Item #{self.item_id}: {self.quantity} in {self.period.lower()} of {self.period_start}"
+
+
+class ClientConsumption(ConsumptionRollup):
+    """What each client took of each item."""
+    client = models.ForeignKey(Client, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name="+")
+    item = models.ForeignKey(Item, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "period_start", "client", "item"], name="client_rollup_uniq"),   #also top clients in a range
+        ]
+        indexes = [
+            models.Index(fields=["client", "period", "period_start", "item", "quantity", "issue_count"], name="client_rollup_series_idx"),   #covers a client's series and items
+            models.Index(fields=["item", "period", "period_start", "client", "quantity", "issue_count"], name="client_rollup_item_idx"),     #covers who took an item
+        ]
+
+    def __str__(self):
+        return f"Client #{self.client_id}, item #{self.item_id}: {self.quantity} in {self.period.lower()} of {self.period_start}"
+
+
+class CategoryConsumption(ConsumptionRollup):
+    category = models.CharField(max_length=100, blank=True)     #"" for items without one
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "period_start", "category"], name="category_rollup_uniq"),   #also totals and top categories in a range
+        ]
+        indexes = [
+            models.Index(fields=["category", "period", "period_start", "quantity", "issue_count"], name="category_rollup_series_idx"),   #covers one category's series
+        ]
+
+    def __str__(self):
+        return f"{self.category or 'Uncategorised'}: {self.quantity} in {self.period.lower()} of {self.period_start}"
@@ -0,0 +1,403 @@
+"""
+Daraja (M-Pesa) gateway used by the payment worker, and handling of the STK
+callback Safaricom sends back.
+
+This follows django_daraja's MpesaClient.stk_push and reuses its config and
+phone helpers, with what a busy worker needs on top:
+
+- every HTTP call has a timeout and goes through one pooled keep-alive
+  requests.Session, so connections are reused between pushes;
+- the OAuth token is kept in the shared cache (MPESA_CACHE_ALIAS) until just
+  before it expires, so all worker processes share one token;
+- a circuit breaker stops calling Daraja for a while after repeated failures;
+- every call's latency is counted into a histogram (latency_histograms()).
+
+The base URL can be pointed somewhere else with MPESA_API_BASE_URL (for
+example a local stub).
+"""
+
+import base64
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.utils import timezone
+from django_daraja.mpesa.utils import api_base_url as daraja_base_url
+from django_daraja.mpesa.utils import format_phone_number, mpesa_config
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from . import caching, counters
+from .models import MpesaCallback, PaymentRecord
+
+
+TOKEN_CACHE_KEY = "mpesa:access-token"
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)   #upper bounds; slower calls go in "+Inf"
+OPERATIONS = ("token", "stk_push")
+
+
+class MpesaUnavailable(Exception):
+    """Daraja could not be reached or answered with a server error; worth retrying."""
+
+
+class CircuitOpen(MpesaUnavailable):
+    """Daraja failed too often recently, so the call was not even attempted."""
+
+
+class MpesaRejected(Exception):
+    """Daraja answered but refused the request; retrying will not help."""
+
+
+class MpesaOutcomeUnknown(Exception):
+    """
+    The request was sent but no answer came back (for example a read
+    timeout), so Daraja may have acted on it. Sending it again could prompt
+    and charge the customer twice.
+    """
+
+
+def api_base_url():
+    base = getattr(settings, "MPESA_API_BASE_URL", None) or daraja_base_url()
+    return base if base.endswith("/") else base + "/"
+
+
+def request_timeout():
+    return getattr(settings, "MPESA_REQUEST_TIMEOUT", 10)
+
+
+def callback_token():
+    return getattr(settings, "MPESA_CALLBACK_TOKEN", "")
+
+
+def with_callback_token(url):
+    """url with MPESA_CALLBACK_TOKEN added to its query, as the callback must be called."""
+    return f"{url}{'&' if '?' in url else '?'}{urlencode({'token': callback_token()})}"
+
+
+def callback_url():
+    """The URL Daraja is told to post the STK result to."""
+    return with_callback_token(settings.MPESA_CALLBACK_URL)
+
+
+def callback_authorized(request):
+    """True when the request carries MPESA_CALLBACK_TOKEN; with no token configured, none does."""
+    expected = callback_token()
+    return bool(expected) and hmac.compare_digest(request.GET.get("token", ""), expected)
+
+
+def shared_cache():
+    return caches[getattr(settings, "MPESA_CACHE_ALIAS", "default")]
+
+
+# HTTP session
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """One requests.Session per process, with a connection pool big enough for the worker threads."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                size = getattr(settings, "MPESA_WORKER_CONCURRENCY", 4)
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=size))
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=size))
+                _session = session
+    return _session
+
+
+# Circuit breaker
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures. After `threshold` of them the circuit opens
+    and calls fail at once with CircuitOpen for `reset_after` seconds; then
+    one trial call is let through, and its result closes or reopens it.
+    State is per process. Limits left as None are read from
+    MPESA_BREAKER_THRESHOLD and MPESA_BREAKER_RESET_AFTER on each call.
+    """
+
+    def __init__(self, threshold=None, reset_after=None):
+        self._threshold = threshold
+        self._reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def threshold(self):
+        return self._threshold or getattr(settings, "MPESA_BREAKER_THRESHOLD", 5)
+
+    @property
+    def reset_after(self):
+        return self._reset_after or getattr(settings, "MPESA_BREAKER_RESET_AFTER", 30)
+
+    def reset(self):
+        self.record_success()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self.trial_running):
+                raise CircuitOpen("M-Pesa is failing, not calling it for now")
+            if state == "half-open":
+                self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+
+# Latency histograms
+
+def _bucket_label(milliseconds):
+    index = bisect_left(LATENCY_BUCKETS_MS, milliseconds)
+    return str(LATENCY_BUCKETS_MS[index]) if index < len(LATENCY_BUCKETS_MS) else "+Inf"
+
+
+def record_latency(operation, seconds):
+    """Count one call in its latency bucket, in the shared cache so every process adds to the same histogram."""
+    cache = shared_cache()
+    key = f"mpesa:latency:{operation}:{_bucket_label(seconds * 1000)}"
+    try:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+    except ValueError:       #evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+    except Exception:        #metrics must never break a payment (e.g. cache table not created yet)
+        pass
+
+
+def latency_histograms():
+    """{operation: {bucket upper bound in ms: call count}} for every Daraja call type."""
+    labels = [str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"]
+    cache = shared_cache()
+    histograms = {}
+    for operation in OPERATIONS:
+        found = cache.get_many([f"mpesa:latency:{operation}:{label}" for label in labels])
+        histograms[operation] = {
+            label: found.get(f"mpesa:latency:{operation}:{label}", 0) for label in labels
+        }
+    return histograms
+
+
+def reset_latency_histograms():
+    labels = [str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"]
+    shared_cache().delete_many(
+        [f"mpesa:latency:{operation}:{label}" for operation in OPERATIONS for label in labels]
+    )
+
+
+def _never_sent(error):
+    """True for a requests error raised while connecting, before any of the request went out."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None     #urllib3's MaxRetryError
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def _call(operation, method, url, idempotent=True, **kwargs):
+    """
+    Make one HTTP call to Daraja through the breaker and the pooled session,
+    timing it. Connection errors and 5xx answers count as failures. For a
+    call that is not idempotent, an error after the request may have reached
+    Daraja raises MpesaOutcomeUnknown instead of MpesaUnavailable.
+    """
+    breaker.before_call()
+    started = time.perf_counter()
+    try:
+        r = http_session().request(method, url, timeout=request_timeout(), **kwargs)
+    except requests.RequestException as e:
+        breaker.record_failure()
+        if not idempotent and not _never_sent(e):
+            raise MpesaOutcomeUnknown(f"{operation} got no answer: {e}")
+        raise MpesaUnavailable(f"{operation} request failed: {e}")
+    finally:
+        record_latency(operation, time.perf_counter() - started)
+    if r.status_code >= 500:
+        breaker.record_failure()
+        raise MpesaUnavailable(f"{operation} returned HTTP {r.status_code}")
+    breaker.record_success()
+    return r
+
+
+# Daraja calls
+
+def fetch_access_token():
+    url = api_base_url() + "oauth/v1/generate?grant_type=client_credentials"
+    auth = (mpesa_config("MPESA_CONSUMER_KEY"), mpesa_config("MPESA_CONSUMER_SECRET"))
+    r = _call("token", "GET", url, auth=auth)
+    if r.status_code != 200:
+        raise MpesaUnavailable(f"Token request returned HTTP {r.status_code}")
+    body = r.json()
+    return body["access_token"], int(body.get("expires_in") or 3599)
+
+
+def access_token(refresh=False):
+    """
+    The current OAuth token, shared by all processes through the cache. It is
+    dropped MPESA_TOKEN_REFRESH_MARGIN seconds before Daraja expires it. If
+    the cache cannot be used (its table not created yet), every call fetches
+    a fresh token rather than failing the payment.
+    """
+    cache = shared_cache()
+    try:
+        token = None if refresh else cache.get(TOKEN_CACHE_KEY)
+    except DatabaseError:
+        return fetch_access_token()[0]
+    if token is None:
+        token, expires_in = fetch_access_token()
+        margin = getattr(settings, "MPESA_TOKEN_REFRESH_MARGIN", 60)
+        try:
+            cache.set(TOKEN_CACHE_KEY, token, timeout=max(expires_in - margin, 1))
+        except DatabaseError:
+            pass
+    return token
+
+
+def stk_push(phone_number, amount, account_reference, transaction_desc, callback_url):
+    """
+    Send an STK push and return Daraja's JSON answer, which includes
+    MerchantRequestID and CheckoutRequestID when it is accepted. Raises
+    MpesaOutcomeUnknown when the push went out but no answer came back.
+    """
+    if mpesa_config("MPESA_ENVIRONMENT") == "sandbox":
+        short_code = mpesa_config("MPESA_EXPRESS_SHORTCODE")
+    else:
+        short_code = mpesa_config("MPESA_SHORTCODE")
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    password = base64.b64encode(
+        (short_code + mpesa_config("MPESA_PASSKEY") + timestamp).encode("ascii")
+    ).decode("utf-8")
+    phone_number = format_phone_number(phone_number)
+
+    data = {
+        "BusinessShortCode": short_code,
+        "Password": password,
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerPayBillOnline",
+        "Amount": int(amount),
+        "PartyA": phone_number,
+        "PartyB": short_code,
+        "PhoneNumber": phone_number,
+        "CallBackURL": callback_url,
+        "AccountReference": account_reference,
+        "TransactionDesc": transaction_desc,
+    }
+    url = api_base_url() + "mpesa/stkpush/v1/processrequest"
+    r = _call("stk_push", "POST", url, idempotent=False, json=data, headers={"Authorization": "Bearer " + access_token()})
+    if r.status_code == 401:      #token revoked early; fetch a new one and try once more
+        r = _call(
+            "stk_push", "POST", url, idempotent=False, json=data,
+            headers={"Authorization": "Bearer " + access_token(refresh=True)},
+        )
+
+    try:
+        body = r.json()
+    except ValueError:
+        raise MpesaUnavailable(f"STK push returned a non-JSON answer (HTTP {r.status_code})")
+    if r.status_code != 200 or str(body.get("ResponseCode")) != "0":
+        raise MpesaRejected(body.get("errorMessage") or body.get("ResponseDescription") or f"HTTP {r.status_code}")
+    return body
+
+
+def parse_stk_callback(body):
+    """
+    Pull what we need out of an STK callback body. Returns a dict with
+    checkout_request_id, success and reference (the M-Pesa receipt number when
+    the payment went through, otherwise the result description), or raises
+    ValueError when the body is not an STK callback.
+    """
+    try:
+        result = body["Body"]["stkCallback"]
+        checkout_id = str(result["CheckoutRequestID"])
+        code = int(result["ResultCode"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Not an STK callback")
+
+    if code == 0:
+        items = (result.get("CallbackMetadata") or {}).get("Item") or []
+        metadata = {item.get("Name"): item.get("Value") for item in items if isinstance(item, dict)}
+        reference = str(metadata.get("MpesaReceiptNumber") or checkout_id)
+    else:
+        reference = str(result.get("ResultDesc") or f"Result {code}")
+    return {
+        "checkout_request_id": checkout_id,
+        "success": code == 0,
+        "reference": reference[:100],
+    }
+
+
+def _settle(checkout_request_id, success, reference):
+    settled = PaymentRecord.objects.filter(
+        checkout_request_id=checkout_request_id, status="PENDING"
+    ).update(status="SUCCESS" if success else "FAILED", reference=reference, updated_at=timezone.now())
+    if settled:
+        counters.bump("pending_payment_count", -settled)   #update() skips the save signals
+        caching.bump("payment")
+    return bool(settled)
+
+
+def apply_stk_result(checkout_request_id, success, reference):
+    """
+    Settle the payment for one STK callback with a single UPDATE. Only a
+    PENDING payment is changed, so a repeated delivery of the same callback
+    matches nothing and is a no-op. A callback for no known payment is kept
+    as an MpesaCallback until the worker saves that CheckoutRequestID.
+    Returns True if a payment was settled.
+    """
+    if _settle(checkout_request_id, success, reference):
+        return True
+    if PaymentRecord.objects.filter(checkout_request_id=checkout_request_id).exists():
+        return False        #already settled: a repeated delivery
+    MpesaCallback.objects.bulk_create(
+        [MpesaCallback(checkout_request_id=checkout_request_id, success=success, reference=reference)],
+        ignore_conflicts=True,
+    )
+    return apply_kept_callback(checkout_request_id)     #the worker may have saved the id meanwhile
+
+
+def apply_kept_callback(checkout_request_id):
+    """
+    Settle the payment with a callback kept for its CheckoutRequestID, if
+    there is one. The worker calls this after saving the id and the callback
+    after keeping itself, each after committing, so whichever comes second
+    finds both. Returns True if a payment was settled.
+    """
+    if not PaymentRecord.objects.filter(checkout_request_id=checkout_request_id).exists():
+        return False        #keep it until the payment has the id
+    kept = MpesaCallback.objects.filter(checkout_request_id=checkout_request_id).first()
+    if kept is None or not MpesaCallback.objects.filter(pk=kept.pk).delete()[0]:
+        return False        #none, or taken by the other side
+    return _settle(checkout_request_id, kept.success, kept.reference)
@@ -0,0 +1,190 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import F, Q
+
+
+class KeysetPage:
+    """
+    One page of a keyset-paginated list. Iterating it gives the rows;
+    next_url / previous_url are ready to drop into an <a href>.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor, page_size, request):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.page_size = page_size
+        self.request = request
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def _url(self, direction, cursor):
+        params = self.request.GET.copy()    #keep search and other filters in the link
+        params.pop("after", None)
+        params.pop("before", None)
+        params[direction] = cursor
+        return f"?{params.urlencode()}"
+
+    @property
+    def next_url(self):
+        return self._url("after", self.next_cursor) if self.has_next else ""
+
+    @property
+    def previous_url(self):
+        return self._url("before", self.previous_cursor) if self.has_previous else ""
+
+
+def get_page_size(request):
+    default = getattr(settings, "STORE_PAGE_SIZE", 50)
+    limit = getattr(settings, "STORE_MAX_PAGE_SIZE", 200)
+    try:
+        size = int(request.GET.get("page_size", default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, limit))
+
+
+def encode_cursor(value, pk):
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    raw = json.dumps([value, pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, field):
+    """Return (value, pk) from a cursor, or None if it is missing or tampered with."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        if value is not None:
+            value = field.to_python(value)
+        return value, int(pk)
+    except Exception:
+        return None
+
+
+def _walk(queryset, name, op, cursor, nullable):
+    """
+    Querysets that together hold every row past cursor=(value, pk) when
+    walking the ordering upwards (op="gt") or downwards (op="lt"), in walk
+    order. NULLs sort lowest and get their own segment, so each piece is a
+    plain range on the (column, pk) index rather than an OR with IS NULL.
+    """
+    value, pk = cursor
+    step = "pk" if op == "gt" else "-pk"
+    column = name if op == "gt" else f"-{name}"
+    nulls = queryset.filter(**{f"{name}__isnull": True}).order_by(step)
+
+    if value is None:
+        segments = [nulls.filter(**{f"pk__{op}": pk})]
+        if op == "gt":
+            segments.append(queryset.filter(**{f"{name}__isnull": False}).order_by(column, step))
+        return segments
+
+    past = Q(**{f"{name}__{op}": value}) | Q(**{name: value, f"pk__{op}": pk})
+    segments = [queryset.filter(past).order_by(column, step)]
+    if op == "lt" and nullable:
+        segments.append(nulls)
+    return segments
+
+
+def _fetch(segments, count):
+    rows = []
+    for segment in segments:
+        rows.extend(segment[: count - len(rows)])
+        if len(rows) >= count:
+            break
+    return rows
+
+
+async def _afetch(segments, count):
+    rows = []
+    for segment in segments:
+        rows.extend([obj async for obj in segment[: count - len(rows)]])
+        if len(rows) >= count:
+            break
+    return rows
+
+
+class _PagePlan:
+    """What to fetch for one page, and how to turn the rows into a KeysetPage."""
+
+    def __init__(self, request, queryset, ordering):
+        descending = ordering.startswith("-")
+        name = ordering.lstrip("-")
+        field = queryset.model._meta.get_field(name)
+        self.request = request
+        self.name = name
+        self.page_size = get_page_size(request)
+
+        if descending:
+            first_page = [F(name).desc(nulls_last=True) if field.null else F(name).desc(), F("pk").desc()]
+        else:
+            first_page = [F(name).asc(nulls_first=True) if field.null else F(name).asc(), F("pk").asc()]
+        forward, backward = ("lt", "gt") if descending else ("gt", "lt")
+
+        self.after = decode_cursor(request.GET.get("after", ""), field)
+        self.before = decode_cursor(request.GET.get("before", ""), field) if not self.after else None
+
+        if self.before:
+            self.segments = _walk(queryset, name, backward, self.before, field.null)
+        elif self.after:
+            self.segments = _walk(queryset, name, forward, self.after, field.null)
+        else:
+            self.segments = [queryset.order_by(*first_page)]
+
+    def page(self, rows):
+        page_size = self.page_size
+        if self.before:
+            has_more_before = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_more_after = True
+        else:
+            has_more_after = len(rows) > page_size
+            rows = rows[:page_size]
+            has_more_before = bool(self.after)
+
+        next_cursor = previous_cursor = None
+        if rows and has_more_after:
+            last = rows[-1]
+            next_cursor = encode_cursor(getattr(last, self.name), last.pk)
+        if rows and has_more_before:
+            first = rows[0]
+            previous_cursor = encode_cursor(getattr(first, self.name), first.pk)
+
+        return KeysetPage(rows, next_cursor, previous_cursor, page_size, self.request)
+
+
+def keyset_paginate(request, queryset, ordering):
+    """
+    Paginate queryset by the single ordering column (for example "name" or
+    "-issue_date") plus pk as a tiebreaker. Instead of OFFSET, each page
+    filters on the last row it has seen, so page N costs the same as page 1.
+
+    Reads ?after=<cursor> or ?before=<cursor> and ?page_size= from the request.
+    """
+    plan = _PagePlan(request, queryset, ordering)
+    return plan.page(_fetch(plan.segments, plan.page_size + 1))
+
+
+async def akeyset_paginate(request, queryset, ordering):
+    """keyset_paginate() for async views, reading the rows with the async ORM."""
+    plan = _PagePlan(request, queryset, ordering)
+    return plan.page(await _afetch(plan.segments, plan.page_size + 1))
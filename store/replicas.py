@@ -0,0 +1,195 @@
+"""
+Reading from a replica database.
+
+Views decorated with read_replica (the dashboard, list pages, exports and
+reports) run their store queries on the STORE_REPLICA_ALIAS database when
+settings.DATABASES has it. ReplicaRouter only sends reads there while such
+a view runs; writes, and reads anywhere else, stay on default. Without the
+alias the decorator changes nothing.
+
+A replica lags behind. So that people see what they have just saved,
+PrimaryAfterWriteMiddleware marks every POST with a cookie, and for
+STORE_REPLICA_STICKY_SECONDS afterwards that browser reads from default
+again.
+
+For SQLite the replica is a second file, and sync_replica() (run by
+"manage.py sync_replica --every 5") copies default over it. The cached
+pages and fragments of store.caching are keyed by the database they were
+read from, so a page built from the replica is never shown to someone
+reading from default. Each copy also bumps the generations of every model
+written since the previous copy began, which retires the replica's pages
+built from rows it had not caught up with yet.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+from . import caching
+
+GENERATIONS = ("item", "supplier", "client", "order", "issue", "payment")
+STICKY_COOKIE = "store_primary_until"
+SYNCED_KEY = "store:replica:synced"        #generations as they were when the last copy began
+
+_reading = ContextVar("store_replica", default=None)     #the alias store reads go to, or None for default
+
+
+def replica_alias():
+    """STORE_REPLICA_ALIAS, or None when DATABASES has no such database."""
+    alias = getattr(settings, "STORE_REPLICA_ALIAS", "replica")
+    if alias not in settings.DATABASES:
+        return None
+    if connections[alias].settings_dict["NAME"] == connections[DEFAULT_DB_ALIAS].settings_dict["NAME"]:
+        return None      #a test MIRROR of default: a second connection would not see the test's transaction
+    return alias
+
+
+def reading_from():
+    """The alias store reads go to right now, or None for default."""
+    return _reading.get()
+
+
+def sticky_seconds():
+    return getattr(settings, "STORE_REPLICA_STICKY_SECONDS", 10)
+
+
+def reads_primary(request):
+    """True when the request must read from default: it is not a GET, or this browser wrote moments ago."""
+    if request.method not in ("GET", "HEAD"):
+        return True
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRouter:
+    """Store reads go to the replica inside read_replica views; every write goes to default."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == "store":
+            return reading_from()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS        #also for rows that were read from the replica
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == replica_alias():
+            return False               #the replica is a copy of default, tables and all
+        return None
+
+
+def _in_replica_context(alias, chunks):
+    """Iterate a streaming response's chunks with store reads on alias; exports query as they stream."""
+    context = copy_context()
+    context.run(_reading.set, alias)
+    chunks = iter(chunks)
+    while True:
+        try:
+            yield context.run(next, chunks)
+        except StopIteration:
+            return
+
+
+def read_replica(view):
+    """
+    Run a read-only view's store queries on the replica, unless
+    reads_primary(request). Goes below login_required, so the session and
+    user are still loaded from default, and above the caching decorators,
+    so that only a cache miss reads the replica.
+    """
+    def replica_for(request):
+        alias = replica_alias()
+        return None if alias is None or reads_primary(request) else alias
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = _reading.set(replica_for(request))     #sync_to_async carries it into the ORM's thread
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _reading.reset(token)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            alias = replica_for(request)
+            token = _reading.set(alias)
+            try:
+                response = view(request, *args, **kwargs)
+            finally:
+                _reading.reset(token)
+            if alias and response.streaming:
+                response.streaming_content = _in_replica_context(alias, response.streaming_content)
+            return response
+    return wrapper
+
+
+class PrimaryAfterWriteMiddleware(MiddlewareMixin):
+    """After a POST (or any other write method), read from default for STORE_REPLICA_STICKY_SECONDS."""
+
+    def process_response(self, request, response):
+        if request.method not in ("GET", "HEAD", "OPTIONS", "TRACE") and replica_alias():
+            seconds = sticky_seconds()
+            response.set_cookie(
+                STICKY_COOKIE, f"{time.time() + seconds:.3f}", max_age=seconds, httponly=True, samesite="Lax",
+            )
+        return response
+
+
+def sync_replica():
+    """
+    Copy the default SQLite database over the replica file, through a
+    temporary file that is renamed into place, so readers see either the old
+    copy or the new one. Returns the names of the generations bumped.
+    """
+    alias = replica_alias()
+    if alias is None:
+        raise ValueError(f"DATABASES has no {getattr(settings, 'STORE_REPLICA_ALIAS', 'replica')!r} database.")
+    primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+    if primary.vendor != "sqlite" or replica.vendor != "sqlite":
+        raise ValueError("sync_replica copies SQLite files; other databases replicate themselves.")
+
+    names = list(GENERATIONS)
+    began = dict(zip(names, caching.generations(names)))
+    target = os.path.abspath(replica.settings_dict["NAME"])
+    fd, copy_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".sqlite3-copy")
+    os.close(fd)
+    try:
+        primary.ensure_connection()
+        copy = sqlite3.connect(copy_path)
+        try:
+            primary.connection.backup(copy)          #one consistent snapshot, even while others write
+            copy.execute("PRAGMA journal_mode=DELETE")     #no -wal file that could outlive the rename
+        finally:
+            copy.close()
+        if os.path.isfile(primary.settings_dict["NAME"]):
+            shutil.copymode(primary.settings_dict["NAME"], copy_path)      #mkstemp makes it private to this user
+        replica.close()
+        os.replace(copy_path, target)
+    except BaseException:
+        os.remove(copy_path)
+        raise
+
+    cache = caching.store_cache()
+    synced = cache.get(SYNCED_KEY) or {}
+    changed = [name for name in names if synced.get(name) != began[name]]
+    fresh = caching.bump_now(changed) if changed else {}
+    cache.set(SYNCED_KEY, {**began, **fresh}, timeout=None)
+    return changed
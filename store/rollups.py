@@ -0,0 +1,266 @@
+"""
+Consumption rollups: units issued per day, ISO week and month, per item, per
+client and item, and per category (ItemConsumption, ClientConsumption,
+CategoryConsumption).
+
+store.signals applies every saved or deleted StockIssue as a delta: the
+issue's old values are taken off, its new ones added, each as one upsert per
+table. Code that writes issues with bulk_create(), update() or raw SQL must
+call apply() itself, or run the rebuild_rollups command afterwards.
+
+An issue counts under the category its item had when the issue was written.
+rebuild_rollups uses the categories items have now, and skips issues whose
+item or date is gone, so a rebuild can move totals between categories or
+drop those of deleted items.
+
+consumption() answers the reports from these tables alone.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncWeek
+
+from . import caching
+from .models import CategoryConsumption, Client, ClientConsumption, Item, ItemConsumption, StockIssue
+
+PERIODS = {     #period: (period start of a date, the same as a database function)
+    "DAY": (lambda day: day, TruncDay),
+    "WEEK": (lambda day: day - timedelta(days=day.weekday()), TruncWeek),
+    "MONTH": (lambda day: day.replace(day=1), TruncMonth),
+}
+TABLES = {     #table: the fields that key a row, besides period and period_start
+    ItemConsumption: ["item_id"],
+    ClientConsumption: ["client_id", "item_id"],
+    CategoryConsumption: ["category"],
+}
+REPORT_LIMIT = 20
+
+
+def period_start(period, day):
+    return PERIODS[period][0](day)
+
+
+def issue_values(issue):
+    """(item id, client id, issue date, quantity) of an issue as apply() takes them."""
+    issue_date = StockIssue._meta.get_field("issue_date").to_python(issue.issue_date)    #a string until the issue is reloaded
+    return issue.item_id, issue.client_id, issue_date, issue.quantity
+
+
+def _upsert(table, rows):
+    """Add [(period, period_start, *key, quantity, issue_count)] onto the table's rows, creating missing ones."""
+    qn = connection.ops.quote_name
+    keys = [table._meta.get_field(name).column for name in TABLES[table]]
+    columns = ["period", "period_start", *keys, "quantity", "issue_count"]
+    sql = (
+        "INSERT INTO {table} ({columns}) VALUES ({values}) "
+        "ON CONFLICT ({unique}) DO UPDATE SET "
+        "quantity = {table}.quantity + excluded.quantity, "
+        "issue_count = {table}.issue_count + excluded.issue_count"
+    ).format(
+        table=qn(table._meta.db_table),
+        columns=", ".join(qn(c) for c in columns),
+        values=", ".join(["%s"] * len(columns)),
+        unique=", ".join(qn(c) for c in ["period", "period_start", *keys]),     #the table's UniqueConstraint
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _update(table, rows):
+    """Add [(period, period_start, *key, quantity, issue_count)] onto the table's existing rows only."""
+    qn = connection.ops.quote_name
+    keys = [table._meta.get_field(name).column for name in TABLES[table]]
+    sql = (
+        "UPDATE {table} SET quantity = quantity + %s, issue_count = issue_count + %s WHERE {match}"
+    ).format(
+        table=qn(table._meta.db_table),
+        match=" AND ".join(f"{qn(c)} = %s" for c in ["period", "period_start", *keys]),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(quantity, count, *key) for *key, quantity, count in rows])
+
+
+def apply(changes):
+    """
+    Apply [(item id, client id, issue date, quantity, sign)] to every rollup:
+    sign is 1 for an issue that now exists and -1 for one that no longer
+    does (or no longer has those values). Issues without an item or a date
+    are not counted; one without a client only counts for its item and
+    category. Changes that cancel out write nothing, and only changes that
+    add issues create rows: taking an issue off a row that does not exist
+    (the rollups were never filled) leaves it missing rather than negative.
+    """
+    changes = [change for change in changes if change[0] is not None and change[2] is not None]
+    if not changes:
+        return
+    categories = dict(
+        Item.objects.filter(pk__in={item_id for item_id, *rest in changes}).values_list("pk", Coalesce("category", Value("")))
+    )
+    deltas = {table: defaultdict(lambda: [0, 0]) for table in TABLES}
+    for item_id, client_id, day, quantity, sign in changes:
+        keys = {ItemConsumption: (item_id,), CategoryConsumption: (categories.get(item_id, ""),)}
+        if client_id is not None:
+            keys[ClientConsumption] = (client_id, item_id)
+        for period in PERIODS:
+            start = period_start(period, day)
+            for table, key in keys.items():
+                delta = deltas[table][(period, start, *key)]
+                delta[0] += sign * quantity
+                delta[1] += sign
+
+    with transaction.atomic():
+        for table, rows in deltas.items():
+            rows = [(*key, quantity, count) for key, (quantity, count) in rows.items() if quantity or count]
+            if not rows:
+                continue
+            _upsert(table, [row for row in rows if row[-1] > 0])
+            _update(table, [row for row in rows if row[-1] <= 0])
+            if any(count < 0 for *key, quantity, count in rows):
+                # Drop rows that no issue counts towards any more, so the
+                # tables hold what a rebuild would write.
+                first = TABLES[table][0]
+                table.objects.filter(issue_count=0, **{f"{first}__in": {row[2] for row in rows}}).delete()
+
+
+def _issue_totals(table):
+    """(period_start, *key, total, issue_total) of every DAY row of a rollup table, summed from the issues."""
+    issues = StockIssue.objects.filter(item__isnull=False, issue_date__isnull=False).order_by()
+    if table is ClientConsumption:
+        issues = issues.filter(client__isnull=False)
+    elif table is CategoryConsumption:
+        issues = issues.annotate(category=Coalesce("item__category", Value("")))
+    return (
+        issues.annotate(period_start=F("issue_date"))
+        .values("period_start", *TABLES[table])
+        .annotate(total=Sum("quantity"), issue_total=Count("pk"))
+        .values_list("period_start", *TABLES[table], "total", "issue_total")
+    )
+
+
+def _day_totals(table, trunc):
+    """The same for a longer period, summed from the table's DAY rows, which are fewer than the issues."""
+    return (
+        table.objects.filter(period="DAY")
+        .order_by()
+        .annotate(start=trunc("period_start"))
+        .values("start", *TABLES[table])
+        .annotate(total=Sum("quantity"), issue_total=Sum("issue_count"))
+        .values_list("start", *TABLES[table], "total", "issue_total")
+    )
+
+
+def _insert_totals(cursor, table, period, totals, start):
+    """INSERT ... SELECT a queryset's (start, *key, total, issue_total) rows into table as rows of period."""
+    qn = connection.ops.quote_name
+    keys = TABLES[table]
+    sql, params = totals.query.sql_with_params()
+    cursor.execute(
+        "INSERT INTO {table} ({columns}) SELECT %s, {selected} FROM ({totals}) totals".format(
+            table=qn(table._meta.db_table),
+            columns=", ".join(
+                qn(c) for c in ["period", "period_start", *(table._meta.get_field(k).column for k in keys), "quantity", "issue_count"]
+            ),
+            selected=", ".join(f"totals.{qn(c)}" for c in [start, *keys, "total", "issue_total"]),
+            totals=sql,
+        ),
+        [period, *params],
+    )
+    return cursor.rowcount
+
+
+def rebuild():
+    """
+    Empty the rollups and refill them from every StockIssue. Returns how
+    many rows were written. Each table and period is one INSERT ... SELECT,
+    so the totals never travel through Python: DAY rows are summed from the
+    issues, WEEK and MONTH rows from the DAY rows.
+    """
+    written = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table in TABLES:
+            table.objects.all().delete()
+            written += _insert_totals(cursor, table, "DAY", _issue_totals(table), "period_start")
+            for period in ("WEEK", "MONTH"):
+                written += _insert_totals(cursor, table, period, _day_totals(table, PERIODS[period][1]), "start")
+        caching.bump("issue")      #the reports are cached against the issue generation
+    return written
+
+
+def _series(rows):
+    return [
+        {"period_start": start.isoformat(), "quantity": quantity, "issues": count}
+        for start, quantity, count in rows
+    ]
+
+
+def consumption(period="MONTH", start=None, end=None, by="item", item=None, client=None, category=None, limit=REPORT_LIMIT):
+    """
+    Consumption between the period starts start and end (inclusive, either
+    may be None), read from the rollups only:
+
+        {"series": [{"period_start", "quantity", "issues"}, ...],    oldest first
+         "breakdown": [{"id", "name", "quantity", "issues"}, ...]}   largest first
+
+    series is the total per period, for the item, client or category given
+    (or everything). breakdown splits the whole range by `by`: "item",
+    "client" or "category". item and client may be combined, and so answer
+    "how much of item X did client Y take per month"; category goes alone.
+    Raises ValueError for anything else.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period {period!r}.")
+    if by not in ("item", "client", "category"):
+        raise ValueError(f"Cannot break down by {by!r}.")
+    if category is not None and (item is not None or client is not None or by != "category"):
+        raise ValueError("A category can only be broken down by category.")
+    if by == "category" and (item is not None or client is not None):
+        raise ValueError("Item and client consumption cannot be broken down by category.")
+
+    if by == "client" or client is not None:
+        table = ClientConsumption
+        filters = {name: value for name, value in (("client", client), ("item", item)) if value is not None}
+    elif by == "category":
+        table = CategoryConsumption
+        filters = {} if category is None else {"category": category}
+    else:
+        table = ItemConsumption
+        filters = {} if item is None else {"item": item}
+    if start is not None:
+        filters["period_start__gte"] = start
+    if end is not None:
+        filters["period_start__lte"] = end
+
+    # Totals over everything add up the fewest rows in the category table.
+    series_table = table if filters.keys() - {"period_start__gte", "period_start__lte"} else CategoryConsumption
+    series = (
+        series_table.objects.filter(period=period, **filters)
+        .order_by("period_start")
+        .values("period_start")
+        .annotate(total=Sum("quantity"), issue_total=Sum("issue_count"))
+        .values_list("period_start", "total", "issue_total")
+    )
+    column = {"item": "item_id", "client": "client_id", "category": "category"}[by]
+    breakdown = list(
+        table.objects.filter(period=period, **filters)
+        .order_by()
+        .values(column)
+        .annotate(total=Sum("quantity"), issue_total=Sum("issue_count"))
+        .order_by("-total", column)
+        .values_list(column, "total", "issue_total")[:limit]
+    )
+    if by == "category":
+        labels = {name: (None, name) for name, *totals in breakdown}
+    else:
+        model = Item if by == "item" else Client
+        names = dict(model.objects.filter(pk__in=[row[0] for row in breakdown]).values_list("pk", "name"))
+        labels = {pk: (pk, names.get(pk, "")) for pk, *totals in breakdown}     #"" once the item or client is deleted
+    return {
+        "series": _series(series),
+        "breakdown": [
+            {"id": labels[key][0], "name": labels[key][1], "quantity": quantity, "issues": count}
+            for key, quantity, count in breakdown
+        ],
+    }
@@ -0,0 +1,222 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower
+from django.urls import reverse
+
+from .models import Client, Item, Supplier, SupplierOrder
+
+
+SEARCH_TABLE = "store_search"
+
+# Each indexed row uses rowid = object id * 4 + kind code, so one object
+# can be found (and replaced or removed) by rowid without scanning the index.
+KINDS = {
+    "item": (1, Item, "store:item_update"),
+    "supplier": (2, Supplier, "store:supplier_update"),
+    "client": (3, Client, "store:client_update"),
+}
+MODEL_KINDS = {model: kind for kind, (code, model, url_name) in KINDS.items()}
+CODE_KINDS = {code: kind for kind, (code, model, url_name) in KINDS.items()}
+
+# bm25 weights for the name, category, description and contact columns
+RANK = f"bm25({SEARCH_TABLE}, 10.0, 4.0, 1.0, 2.0)"
+
+MAX_RESULTS = 50
+AUTOCOMPLETE_LIMIT = 20
+
+ITEM_DOCUMENTS = (
+    f"INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, name, category, description, contact) "
+    "SELECT id * 4 + 1, name, COALESCE(category, ''), COALESCE(description, ''), '' "
+    "FROM store_item"
+)
+
+# Same statements are used by migration 0008 for the first fill.
+REBUILD_SQL = [
+    f"DELETE FROM {SEARCH_TABLE}",
+    ITEM_DOCUMENTS,
+    f"INSERT INTO {SEARCH_TABLE}(rowid, name, category, description, contact) "
+    "SELECT id * 4 + 2, name, '', COALESCE(address, ''), "
+    "COALESCE(contact_person, '') || ' ' || COALESCE(phone, '') || ' ' || COALESCE(email, '') "
+    "FROM store_supplier",
+    f"INSERT INTO {SEARCH_TABLE}(rowid, name, category, description, contact) "
+    "SELECT id * 4 + 3, name, '', COALESCE(address, ''), "
+    "COALESCE(contact_person, '') || ' ' || COALESCE(phone, '') || ' ' || COALESCE(email, '') "
+    "FROM store_client",
+]
+
+
+def fts_enabled():
+    """The FTS5 index only exists on SQLite; other databases fall back to icontains."""
+    return connection.vendor == "sqlite"
+
+
+def match_expression(query):
+    """
+    Turn what the user typed into an FTS5 query where every word must match
+    as a prefix, e.g. 'cem 50' -> '"cem"* "50"*'. Quotes keep FTS5 operators
+    in the input from being interpreted.
+    """
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _document(instance):
+    kind = MODEL_KINDS[type(instance)]
+    rowid = instance.pk * 4 + KINDS[kind][0]
+    if kind == "item":
+        return rowid, instance.name, instance.category or "", instance.description or "", ""
+    contact = " ".join(
+        value for value in (instance.contact_person, instance.phone, instance.email) if value
+    )
+    return rowid, instance.name, "", instance.address or "", contact
+
+
+def index_object(instance):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, name, category, description, contact) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            _document(instance),
+        )
+
+
+def unindex_object(instance):
+    if not fts_enabled():
+        return
+    kind = MODEL_KINDS[type(instance)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+            [instance.pk * 4 + KINDS[kind][0]],
+        )
+
+
+def index_items(pks, chunk_size=500):
+    """Index (or re-index) the given items, for bulk writes that skip the save signals."""
+    if not fts_enabled():
+        return
+    pks = list(pks)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), chunk_size):
+            chunk = pks[start:start + chunk_size]
+            cursor.execute(f"{ITEM_DOCUMENTS} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+
+def rebuild_index():
+    """Refill the whole index from the item, supplier and client tables."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+        cursor.execute(f"SELECT COUNT(*) FROM {SEARCH_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def matching_ids(query, kind):
+    """
+    A subquery of matching ids for one kind, for use as
+    Item.objects.filter(pk__in=matching_ids(query, "item")).
+    """
+    code = KINDS[kind][0]
+    return RawSQL(
+        f"SELECT rowid / 4 FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND rowid %% 4 = %s",
+        (match_expression(query) or '""', code),
+    )
+
+
+def search(query, kinds=None, limit=20):
+    """
+    Ranked prefix search across items, suppliers and clients.
+    Returns at most `limit` dicts with kind, id, name, detail and url.
+    """
+    expression = match_expression(query)
+    kinds = [kind for kind in (kinds or KINDS) if kind in KINDS]
+    limit = max(1, min(int(limit), MAX_RESULTS))
+    if not expression or not kinds:
+        return []
+
+    if not fts_enabled():
+        return _fallback_search(query, kinds, limit)
+
+    codes = ", ".join(str(KINDS[kind][0]) for kind in kinds)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, name, category, contact FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid %% 4 IN ({codes}) "
+            f"ORDER BY {RANK} LIMIT %s",
+            [expression, limit],
+        )
+        rows = cursor.fetchall()
+
+    results = []
+    for rowid, name, category, contact in rows:
+        kind = CODE_KINDS[rowid % 4]
+        results.append(_result(kind, rowid // 4, name, category or contact))
+    return results
+
+
+def _fallback_search(query, kinds, limit):
+    results = []
+    for kind in kinds:
+        model = KINDS[kind][1]
+        for obj in model.objects.filter(name__icontains=query)[:limit]:
+            detail = getattr(obj, "category", None) or getattr(obj, "contact_person", None) or ""
+            results.append(_result(kind, obj.pk, obj.name, detail))
+    return results[:limit]
+
+
+def _result(kind, pk, name, detail):
+    return {
+        "kind": kind,
+        "id": pk,
+        "name": name,
+        "detail": detail.strip(),
+        "url": reverse(KINDS[kind][2], args=[pk]),
+    }
+
+
+# Autocomplete for the form widgets
+
+def name_prefix(queryset, query):
+    """
+    Rows whose name starts with query, ignoring case, in name order. Written
+    as a range on LOWER(name) so it walks the *_name_lower_idx index and stops
+    at the LIMIT, unlike LIKE which SQLite cannot run on that index.
+    """
+    prefix = query.strip().lower()
+    queryset = queryset.annotate(name_key=Lower("name")).order_by("name_key", "pk")
+    if prefix:
+        queryset = queryset.filter(name_key__gte=prefix, name_key__lt=prefix + "\U0010ffff")
+    return queryset
+
+
+def _order_choices(query, limit):
+    orders = SupplierOrder.objects.select_related("supplier").order_by("-ordered_at", "-pk")
+    query = query.strip().lstrip("#")
+    if query.isdigit():
+        orders = orders.filter(pk=int(query))
+    elif query:
+        suppliers = name_prefix(Supplier.objects.all(), query).values("pk")[:MAX_RESULTS]
+        # Grouped by supplier, newest first within each: order_supplier_date_idx
+        # yields rows in that order, where "newest overall" needs a sort.
+        orders = orders.filter(supplier__in=suppliers).order_by("-supplier_id", "-ordered_at", "-pk")
+    return [(order.pk, str(order)) for order in orders[:limit]]
+
+
+AUTOCOMPLETE_MODELS = {
+    "item": Item,
+    "supplier": Supplier,
+    "client": Client,
+}
+
+
+def autocomplete(kind, query, limit=AUTOCOMPLETE_LIMIT):
+    """[(id, label)] for a select widget: names starting with query, or orders by number or supplier."""
+    limit = max(1, min(int(limit), AUTOCOMPLETE_LIMIT))
+    if kind == "order":
+        return _order_choices(query, limit)
+    rows = name_prefix(AUTOCOMPLETE_MODELS[kind].objects.all(), query)
+    return list(rows.values_list("pk", "name")[:limit])
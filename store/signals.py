@@ -0,0 +1,147 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import caching, counters, ledger, rollups, search
+from .models import Client, Item, PaymentRecord, StockIssue, Supplier, SupplierOrder
+
+
+COUNTED_MODELS = {
+    Supplier: "supplier_count",
+    Client: "client_count",
+    SupplierOrder: "order_count",
+}
+
+
+# Dashboard counters
+
+def count_created(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(COUNTED_MODELS[sender], 1)
+
+
+def count_deleted(sender, instance, **kwargs):
+    counters.bump(COUNTED_MODELS[sender], -1)
+
+
+for model in COUNTED_MODELS:
+    post_save.connect(count_created, sender=model)
+    post_delete.connect(count_deleted, sender=model)
+
+
+@receiver(post_init, sender=PaymentRecord)
+def remember_payment_status(sender, instance, **kwargs):
+    instance._counted_status = instance.__dict__.get("status")   #status as loaded; None when deferred (reading it would query)
+
+
+def stored_status(instance):
+    """The status the row had before this save or delete, looked up only if it was deferred when loaded."""
+    if instance._counted_status is None and not instance._state.adding:
+        instance._counted_status = PaymentRecord.objects.filter(pk=instance.pk).values_list("status", flat=True).first()
+
+
+@receiver(pre_save, sender=PaymentRecord)
+def status_before_save(sender, instance, **kwargs):
+    if "status" in instance.__dict__:      #set since a deferred load; otherwise the save leaves it alone
+        stored_status(instance)
+
+
+@receiver(pre_delete, sender=PaymentRecord)
+def status_before_delete(sender, instance, **kwargs):
+    stored_status(instance)
+
+
+@receiver(post_save, sender=PaymentRecord)
+def count_pending_payment(sender, instance, created, **kwargs):
+    if "status" not in instance.__dict__:      #still deferred, so this save did not change it
+        return
+    was_pending = not created and instance._counted_status == "PENDING"
+    is_pending = instance.status == "PENDING"
+    counters.bump("pending_payment_count", int(is_pending) - int(was_pending))
+    instance._counted_status = instance.status
+
+
+@receiver(post_delete, sender=PaymentRecord)
+def uncount_pending_payment(sender, instance, **kwargs):
+    if instance._counted_status == "PENDING":
+        counters.bump("pending_payment_count", -1)
+
+
+# Stock ledger
+
+@receiver(post_init, sender=Item)
+def remember_quantity(sender, instance, **kwargs):
+    instance._ledger_quantity = instance.__dict__.get("quantity")    #as loaded; None when deferred (reading it would query)
+
+
+@receiver(post_save, sender=Item)
+def record_quantity_change(sender, instance, created, update_fields, **kwargs):
+    if update_fields is not None and "quantity" not in update_fields:
+        return
+    before = 0 if created else instance._ledger_quantity
+    if before is not None:
+        ledger.record(instance.pk, instance.quantity - before, "OPENING" if created else "ADJUST")
+    instance._ledger_quantity = instance.quantity
+
+
+# Consumption rollups
+
+@receiver(post_init, sender=StockIssue)
+def remember_issue(sender, instance, **kwargs):
+    fields = ("item_id", "client_id", "issue_date", "quantity")
+    if all(name in instance.__dict__ for name in fields):     #not when deferred: reading them would query
+        instance._rollup_values = rollups.issue_values(instance)
+    else:
+        instance._rollup_values = None
+
+
+@receiver(post_save, sender=StockIssue)
+def roll_up_issue(sender, instance, created, **kwargs):
+    if not created and instance._rollup_values is None:
+        return      #loaded with deferred fields, so what changed is unknown; rebuild_rollups catches up
+    changes = [(*rollups.issue_values(instance), 1)]
+    if not created:
+        changes.append((*instance._rollup_values, -1))
+    rollups.apply(changes)
+    instance._rollup_values = rollups.issue_values(instance)
+
+
+@receiver(post_delete, sender=StockIssue)
+def unroll_issue(sender, instance, **kwargs):
+    if instance._rollup_values is not None:
+        rollups.apply([(*instance._rollup_values, -1)])
+
+
+# Search index
+
+def index_for_search(sender, instance, **kwargs):
+    search.index_object(instance)
+
+
+def unindex_for_search(sender, instance, **kwargs):
+    search.unindex_object(instance)
+
+
+for model in (Item, Supplier, Client):
+    post_save.connect(index_for_search, sender=model)
+    post_delete.connect(unindex_for_search, sender=model)
+
+
+# Cache generations
+
+CACHE_GENERATIONS = {
+    Item: "item",
+    Supplier: "supplier",
+    Client: "client",
+    SupplierOrder: "order",
+    StockIssue: "issue",
+    PaymentRecord: "payment",
+}
+
+
+def bump_cache_generation(sender, **kwargs):
+    caching.bump(CACHE_GENERATIONS[sender])
+
+
+for model in CACHE_GENERATIONS:
+    post_save.connect(bump_cache_generation, sender=model)
+    post_delete.connect(bump_cache_generation, sender=model)
@@ -0,0 +1,178 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import caching, ledger
+from .models import Item, StockIssue, StockMovement, SupplierOrder
+
+
+class InsufficientStock(Exception):
+    """Raised when an item does not have enough quantity on hand."""
+
+
+class OrderAlreadyReceived(Exception):
+    """Raised when an edit would change the stock side of a received order."""
+
+
+def take_stock(item_id, quantity, issue=None):
+    """
+    Remove quantity from an item in one conditional UPDATE:
+
+        UPDATE store_item SET quantity = quantity - n WHERE id = ? AND quantity >= n
+
+    The check and the write happen in the database, so two people issuing
+    the same item at once can never oversell it. Only the quantity column
+    is written, plus an ISSUE row in the ledger.
+    """
+    if item_id is None or quantity <= 0:
+        return
+    updated = Item.objects.filter(pk=item_id, quantity__gte=quantity).update(
+        quantity=F("quantity") - quantity
+    )
+    if not updated:
+        raise InsufficientStock("Cannot issue more than the current stock quantity.")
+    ledger.record(item_id, -quantity, "ISSUE", issue=issue)
+    caching.bump("item")     #update() sends no save signal
+
+
+def return_stock(item_id, quantity, issue=None):
+    """Put quantity back on an item (for example when an issue is deleted)."""
+    if item_id is None or quantity <= 0:
+        return
+    Item.objects.filter(pk=item_id).update(quantity=F("quantity") + quantity)
+    ledger.record(item_id, quantity, "RETURN", issue=issue)
+    caching.bump("item")
+
+
+def issue_stock(issue):
+    """Save a new StockIssue and take its quantity off the item, all or nothing."""
+    try:
+        with transaction.atomic():
+            issue.save()        #first, so the ledger row can point at it
+            take_stock(issue.item_id, issue.quantity, issue=issue)
+    except InsufficientStock:
+        issue.pk = None         #the INSERT was rolled back
+        raise
+
+
+def change_issue(issue):
+    """
+    Save an edited StockIssue and apply only the difference to stock. The
+    difference is worked out from the stored row, locked until the commit,
+    so two people editing the same issue at once cannot both apply their
+    change against the same old values.
+    """
+    with transaction.atomic():
+        old_item_id, old_quantity = (
+            StockIssue.objects.select_for_update().values_list("item_id", "quantity").get(pk=issue.pk)
+        )
+        if issue.item_id == old_item_id:
+            delta = issue.quantity - old_quantity
+            if delta > 0:
+                take_stock(issue.item_id, delta, issue=issue)
+            else:
+                return_stock(issue.item_id, -delta, issue=issue)
+        else:
+            return_stock(old_item_id, old_quantity, issue=issue)
+            take_stock(issue.item_id, issue.quantity, issue=issue)
+        issue.save()
+
+
+def cancel_issue(issue):
+    """
+    Delete a StockIssue and give its quantity back to the item. The stored
+    row is locked and deleted, not the copy passed in, so when the same issue
+    is cancelled twice (a double submit, or two people) only the first gives
+    stock back. Returns False if the issue was already gone.
+    """
+    with transaction.atomic():
+        stored = StockIssue.objects.select_for_update().filter(pk=issue.pk).first()
+        if stored is None:
+            return False
+        deleted, _ = stored.delete()
+        if not deleted:
+            return False
+        return_stock(stored.item_id, stored.quantity, issue=issue)     #delete() cleared stored.pk
+    return True
+
+
+def receive_orders(order_ids):
+    """
+    Mark PENDING orders RECEIVED and add their quantities to stock, all or
+    nothing. Orders that are not PENDING are left alone. Returns how many
+    orders were received.
+
+    The cost does not grow with the number of orders: one SELECT ... FOR
+    UPDATE, one UPDATE for the orders, one UPDATE for all their items (a
+    CASE gives each item its own total, so three orders of cement add up to
+    a single increment) and one INSERT for the ledger rows.
+    """
+    with transaction.atomic():
+        orders = list(
+            SupplierOrder.objects.select_for_update()
+            .filter(pk__in=order_ids, status="PENDING")
+            .order_by()
+            .values_list("pk", "item_id", "quantity_ordered")
+        )
+        if not orders:
+            return 0
+        # The rows are locked, so no other receive can take these orders before
+        # we commit. SQLite has no row locks, but there the second of two
+        # overlapping writers fails with "database is locked" instead.
+        now = timezone.now()
+        SupplierOrder.objects.filter(pk__in=[pk for pk, _, _ in orders]).update(status="RECEIVED", updated_at=now)
+
+        totals = defaultdict(int)
+        for pk, item_id, quantity in orders:
+            if item_id is not None:
+                totals[item_id] += quantity
+        if totals:
+            increment = Case(
+                *(When(pk=item_id, then=Value(quantity)) for item_id, quantity in totals.items()),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            Item.objects.filter(pk__in=totals).update(quantity=F("quantity") + increment)
+
+        ledger.record_many(
+            StockMovement(item_id=item_id, quantity=quantity, kind="RECEIPT", order_id=pk, occurred_at=now)
+            for pk, item_id, quantity in orders
+            if item_id is not None
+        )
+        caching.bump("order", "item")      #update() sends no save signals
+    return len(orders)
+
+
+def save_order(order):
+    """
+    Save a SupplierOrder from the create or edit form. An order being set to
+    RECEIVED goes through receive_orders(), so its stock is added too; that
+    includes a DRAFT order received straight away.
+
+    RECEIVED is final: its stock is already on hand, so the status, item and
+    quantity of a received order cannot change (OrderAlreadyReceived). Notes
+    and the price can still be corrected.
+    """
+    with transaction.atomic():
+        stored = None
+        if order.pk is not None:
+            stored = (
+                SupplierOrder.objects.select_for_update()
+                .filter(pk=order.pk)
+                .values_list("status", "item_id", "quantity_ordered")
+                .first()
+            )
+        if stored is not None and stored[0] == "RECEIVED":
+            if (order.status, order.item_id, order.quantity_ordered) != stored:
+                raise OrderAlreadyReceived("This order has been received; its status, item and quantity can no longer change.")
+            order.save()
+            return
+        receiving = order.status == "RECEIVED"
+        if receiving:
+            order.status = "PENDING"
+        order.save()
+        if receiving:
+            receive_orders([order.pk])
+            order.status = "RECEIVED"
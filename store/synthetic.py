@@ -0,0 +1,314 @@
+"""
+Deterministic synthetic data at production volumes: suppliers, clients,
+items, supplier orders, stock issues and payments, for reproducing
+performance problems locally (manage.py generate_store_data).
+
+Item popularity follows a Zipf law: the item of popularity rank k is picked
+with weight 1 / k ** zipf, so a few items take most of the issues and
+orders, as in a real store. Clients are skewed the same way. Which item
+gets which rank is itself drawn from the seed.
+
+Every table is cut into chunks of chunk_size rows. A chunk's rows depend
+only on the seed, the table and the chunk number, so worker processes can
+build chunks in any order and an empty database ends up with the same rows
+for the same seed (and end date), whatever the number of workers. Rows get
+explicit primary keys, counted on from the highest key already in each
+table, which is how issues can point at items nobody has read back.
+
+The workers only build rows; the random draws and formatting are most of
+the work. This process writes them, one executemany and one transaction per
+chunk, because SQLite takes a single writer at a time. While loading,
+foreign key checks are off and checked once per table at the end (as
+loaddata does), and on SQLite the tables' indexes are dropped and rebuilt
+afterwards, which is much faster than updating them row by row.
+
+The dashboard counters, search index and consumption rollups are rebuilt at
+the end unless rebuild=False.
+"""
+
+import itertools
+import multiprocessing
+from collections import deque
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from random import Random
+
+import django
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import caching, counters, rollups, search
+from .models import Client, Item, PaymentRecord, StockIssue, StockMovement, Supplier, SupplierOrder, stock_status
+
+CHUNK_SIZE = 50000
+ZIPF_EXPONENT = 1.0
+HISTORY_DAYS = 730          #issues, orders and payments are spread over this many days up to the end date
+COUNTS = {                  #production-sized defaults
+    "suppliers": 5000,
+    "clients": 50000,
+    "items": 1000000,
+    "orders": 1000000,
+    "issues": 10000000,
+    "payments": 1000000,
+}
+TABLES = {     #in load order, parents first: (model, fields written, in the order the rows hold them)
+    "suppliers": (Supplier, ["id", "name", "contact_person", "phone", "email", "is_active", "created_at"]),
+    "clients": (Client, ["id", "name", "contact_person", "phone", "email", "address", "created_at"]),
+    "items": (Item, ["id", "name", "category", "quantity", "unit_price", "status", "reorder_level", "date_added"]),
+    "orders": (SupplierOrder, ["id", "supplier", "item", "quantity_ordered", "unit_price", "status", "ordered_at"]),
+    "issues": (StockIssue, ["id", "item", "client", "quantity", "issue_date", "issued_by"]),
+    "payments": (PaymentRecord, ["id", "order", "method", "amount", "status", "phone_number", "reference", "created_at"]),
+}
+
+ITEM_WORDS = [
+    "Cement", "Steel bar", "Roofing sheet", "Paint", "Nails", "Timber", "PVC pipe", "Cable",
+    "Tiles", "Sand", "Ballast", "Wire mesh", "Door hinge", "Padlock", "Gutter", "Water tank",
+]
+ITEM_GRADES = ["", "Standard", "Heavy duty", "Premium", "Economy", "50kg", "20L", "6m"]
+CATEGORIES = ["Building", "Plumbing", "Electrical", "Finishing", "Hardware", "Roofing", None]
+TOWNS = ["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret", "Thika", "Machakos", "Nyeri"]
+FIRST_NAMES = ["Wanjiku", "Otieno", "Achieng", "Kamau", "Njeri", "Mutua", "Chebet", "Kiprono", "Akinyi", "Mwangi"]
+ORDER_STATUSES = (["RECEIVED"] * 7) + (["PENDING"] * 2) + ["CANCELLED"]
+PAYMENT_METHODS = (["MPESA"] * 6) + (["CASH"] * 2) + ["PAYSTACK", "PAYPAL"]
+PAYMENT_STATUSES = (["SUCCESS"] * 8) + ["PENDING", "FAILED"]
+
+
+# Row building (runs in the worker processes)
+
+@lru_cache(maxsize=4)
+def _zipf_weights(n, exponent):
+    """Cumulative Zipf weights for ranks 1..n."""
+    return list(itertools.accumulate(1 / k ** exponent for k in range(1, n + 1)))
+
+
+@lru_cache(maxsize=4)
+def _by_rank(seed, table, n):
+    """The row index of each popularity rank: a shuffle of 0..n-1 drawn from the seed."""
+    order = list(range(n))
+    Random(f"{seed}:{table}:ranks").shuffle(order)
+    return order
+
+
+def _popular(rng, plan, table, size):
+    """`size` row indexes of table drawn with Zipf-skewed popularity."""
+    n = plan["counts"][table]
+    return rng.choices(_by_rank(plan["seed"], table, n), cum_weights=_zipf_weights(n, plan["zipf"]), k=size)
+
+
+def _when(plan, rng):
+    """A moment in the history window, as the database stores it."""
+    start = plan["end"] - timedelta(days=plan["days"] - 1)
+    moment = datetime.combine(start, time(), dt_timezone.utc) + timedelta(seconds=rng.randrange(plan["days"] * 86400))
+    return connection.ops.adapt_datetimefield_value(moment)
+
+
+def _day(plan, rng):
+    return (plan["end"] - timedelta(days=rng.randrange(plan["days"]))).isoformat()
+
+
+def _price(rng, low, high):
+    return f"{rng.randint(low * 100, high * 100) / 100:.2f}"
+
+
+def _phone(rng):
+    return f"07{rng.randrange(10 ** 8):08d}"
+
+
+def _suppliers(rng, plan, first, size):
+    created = _when(plan, rng)
+    for n in range(first, first + size):
+        town = rng.choice(TOWNS)
+        yield (
+            plan["bases"]["suppliers"] + n + 1, f"{town} Supplies {n}", rng.choice(FIRST_NAMES), _phone(rng),
+            f"sales{n}@supplier.example", rng.random() < 0.95, created,
+        )
+
+
+def _clients(rng, plan, first, size):
+    created = _when(plan, rng)
+    for n in range(first, first + size):
+        town = rng.choice(TOWNS)
+        yield (
+            plan["bases"]["clients"] + n + 1, f"Client {n} {town}", rng.choice(FIRST_NAMES), _phone(rng),
+            f"client{n}@example.com", f"{town} site {rng.randint(1, 99)}", created,
+        )
+
+
+def _items(rng, plan, first, size):
+    added = _when(plan, rng)
+    for n in range(first, first + size):
+        quantity = 0 if rng.random() < 0.05 else rng.randint(1, 2000)
+        reorder_level = rng.randint(0, 100)
+        name = " ".join(part for part in (rng.choice(ITEM_WORDS), rng.choice(ITEM_GRADES)) if part)
+        yield (
+            plan["bases"]["items"] + n + 1, f"{name} {n}", rng.choice(CATEGORIES), quantity, _price(rng, 5, 20000),
+            stock_status(quantity, reorder_level), reorder_level, added,
+        )
+
+
+def _orders(rng, plan, first, size):
+    items = _popular(rng, plan, "items", size)
+    for n, item in zip(range(first, first + size), items):
+        supplier = plan["bases"]["suppliers"] + rng.randrange(plan["counts"]["suppliers"]) + 1 if plan["counts"]["suppliers"] else None
+        yield (
+            plan["bases"]["orders"] + n + 1, supplier, plan["bases"]["items"] + item + 1, rng.randint(1, 500),
+            _price(rng, 5, 20000), rng.choice(ORDER_STATUSES), _day(plan, rng),
+        )
+
+
+def _issues(rng, plan, first, size):
+    items = _popular(rng, plan, "items", size)
+    clients = _popular(rng, plan, "clients", size) if plan["counts"]["clients"] else [None] * size
+    for n, item, client in zip(range(first, first + size), items, clients):
+        if client is not None and rng.random() < 0.95:      #a few walk-in issues have no client
+            client = plan["bases"]["clients"] + client + 1
+        else:
+            client = None
+        yield (
+            plan["bases"]["issues"] + n + 1, plan["bases"]["items"] + item + 1, client,
+            min(1 + int(rng.expovariate(0.25)), 500), _day(plan, rng), rng.choice(FIRST_NAMES),
+        )
+
+
+def _payments(rng, plan, first, size):
+    orders = plan["counts"]["orders"]
+    for n in range(first, first + size):
+        method = rng.choice(PAYMENT_METHODS)
+        yield (
+            plan["bases"]["payments"] + n + 1, plan["bases"]["orders"] + rng.randrange(orders) + 1 if orders else None,
+            method, _price(rng, 10, 500000), rng.choice(PAYMENT_STATUSES), _phone(rng) if method == "MPESA" else "",
+            f"SYN{n:09d}", _when(plan, rng),
+        )
+
+
+BUILDERS = {
+    "suppliers": _suppliers,
+    "clients": _clients,
+    "items": _items,
+    "orders": _orders,
+    "issues": _issues,
+    "payments": _payments,
+}
+
+
+def build_chunk(table, chunk, first, size, plan):
+    """The rows of one chunk. The same arguments always give the same rows."""
+    rng = Random(f"{plan['seed']}:{table}:{chunk}")
+    return table, list(BUILDERS[table](rng, plan, first, size))
+
+
+# Loading (runs in this process)
+
+def _insert_sql(table):
+    model, fields = TABLES[table]
+    qn = connection.ops.quote_name
+    columns = [qn(model._meta.get_field(name).column) for name in fields]
+    return "INSERT INTO {} ({}) VALUES ({})".format(
+        qn(model._meta.db_table), ", ".join(columns), ", ".join(["%s"] * len(columns))
+    )
+
+
+def _chunks(counts, chunk_size):
+    for table in TABLES:
+        for chunk, first in enumerate(range(0, counts[table], chunk_size)):
+            yield table, chunk, first, min(chunk_size, counts[table] - first)
+
+
+def _built_in_order(tasks, plan, workers):
+    """Yield (table, rows) for every task, in task order, built by `workers` processes."""
+    if workers <= 1:
+        for task in tasks:
+            yield build_chunk(*task, plan)
+        return
+    # Each worker sets Django up first, so this works with the spawn start method too.
+    with multiprocessing.Pool(workers, initializer=django.setup) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(build_chunk, (*task, plan)))
+            if len(pending) >= workers * 2:     #bounded, so memory stays flat when writing is the slow part
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+class _IndexesDropped:
+    """On SQLite, drop the tables' indexes for the block and create them again afterwards."""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.indexes = []
+
+    def __enter__(self):
+        if connection.vendor != "sqlite":
+            return self
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({})".format(
+                    ", ".join(["%s"] * len(self.tables))
+                ),
+                self.tables,
+            )
+            self.indexes = cursor.fetchall()     #unique constraints have no sql and stay
+            for name, sql in self.indexes:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+        return self
+
+    def __exit__(self, *exc_info):
+        with connection.cursor() as cursor:
+            for name, sql in self.indexes:
+                cursor.execute(sql)
+
+
+def generate(counts, seed=0, workers=1, zipf=ZIPF_EXPONENT, days=HISTORY_DAYS, end=None, chunk_size=CHUNK_SIZE, rebuild=True, progress=None):
+    """
+    Add counts[table] rows to each table in TABLES (missing tables get none)
+    and return how many were written per table. progress(table, written,
+    total) is called after every chunk. Raises ValueError when orders or
+    issues are asked for without items.
+    """
+    counts = {table: counts.get(table, 0) for table in TABLES}
+    if not counts["items"] and (counts["orders"] or counts["issues"]):
+        raise ValueError("Orders and issues are generated for new items, so items cannot be 0.")
+    plan = {
+        "seed": seed,
+        "zipf": zipf,
+        "days": days,
+        "end": end or timezone.localdate(),
+        "counts": counts,
+        "bases": {table: model.objects.aggregate(last=Max("pk"))["last"] or 0 for table, (model, fields) in TABLES.items()},
+    }
+    tables = [TABLES[table][0]._meta.db_table for table in TABLES if counts[table]]
+    written = dict.fromkeys(TABLES, 0)
+    sql = {table: _insert_sql(table) for table in TABLES}
+
+    with connection.constraint_checks_disabled(), _IndexesDropped(tables):
+        for table, rows in _built_in_order(_chunks(counts, chunk_size), plan, workers):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql[table], rows)
+            written[table] += len(rows)
+            if progress:
+                progress(table, written[table], counts[table])
+    connection.check_constraints(table_names=tables)
+
+    if counts["items"]:
+        # Opening balances for the new items, as Item.objects.bulk_create() writes them.
+        qn = connection.ops.quote_name
+        movement = StockMovement._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {} ({}, {}, {}, {}) SELECT id, quantity, 'OPENING', %s FROM {} WHERE id > %s AND quantity > 0".format(
+                    qn(movement.db_table),
+                    *(qn(movement.get_field(name).column) for name in ("item", "quantity", "kind", "occurred_at")),
+                    qn(Item._meta.db_table),
+                ),
+                [movement.get_field("occurred_at").get_db_prep_save(timezone.now(), connection), plan["bases"]["items"]],
+            )
+    if rebuild:
+        if counters.counter_table_enabled():
+            counters.rebuild_counters()
+        if search.fts_enabled():
+            search.rebuild_index()
+        rollups.rebuild()
+    caching.bump("item", "supplier", "client", "order", "issue", "payment")      #raw writes send no signals
+    return written
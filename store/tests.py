@@ -1,3 +1,1309 @@
-from django.test import TestCase
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import skipIf
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Count, F, Sum
+from django.test import TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+try:
+    import openpyxl
+except ImportError:   #only needed for .xlsx imports
+    openpyxl = None
+
+try:
+    import numpy
+except ImportError:   #only needed for reorder forecasts
+    numpy = None
+
+from . import benchmark, replicas, synthetic, urls as store_urls
+from .caching import store_cache
+from .counters import live_counts, rebuild_counters
+from .forecast import forecast_reorder
+from .forms import PaymentRecordForm
+from . import mpesa
+from .dispatch import run_worker
+from .management.commands.replay_mpesa_callbacks import stk_callback
+from .models import (
+    CategoryConsumption,
+    Client,
+    ClientConsumption,
+    Item,
+    ItemConsumption,
+    MpesaCallback,
+    PaymentDispatch,
+    PaymentRecord,
+    StockIssue,
+    StockMovement,
+    StockSnapshot,
+    StoreCounter,
+    Supplier,
+    SupplierOrder,
+    stock_status_expression,
+)
+from .search import search
+from .ledger import drifted_items, on_hand_at, take_snapshots
+from .importer import import_items
+from .rollups import rebuild as rebuild_rollups
+from .stock import cancel_issue, change_issue, receive_orders, take_stock
+from .valuation import valuation_summary
+
+
+TEST_CACHES = {     #the "store" cache lives on disk; tests get their own instead of clearing the developer's
+    **settings.CACHES,
+    settings.STORE_CACHE_ALIAS: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "store-tests"},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StoreTestCase(TestCase):
+    def setUp(self):
+        store_cache().clear()
+        self.user = User.objects.create_user("tester", password="pass12345")
+        self.client.force_login(self.user)
+
+
+class DashboardQueryTests(StoreTestCase):
+    # session + user, item stats, entity counters, recent items, valuation, items table
+    DASHBOARD_QUERIES = 7
+
+    def seed(self, n):
+        Item.objects.bulk_create(
+            Item(name=f"Item {i}", quantity=i % 7, unit_price=10) for i in range(n)
+        )
+        Supplier.objects.bulk_create(Supplier(name=f"Supplier {i}") for i in range(n))
+        Client.objects.bulk_create(Client(name=f"Client {i}") for i in range(n))
+
+    def test_query_count_does_not_grow_with_data(self):
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            self.client.get(reverse("store:dashboard"))
+        self.seed(50)
+        store_cache().clear()      #bulk_create sends no signals, so nothing retired the cached widgets
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            response = self.client.get(reverse("store:dashboard"))
+        self.assertEqual(response.context["total_items"], 50)
+        self.assertEqual(response.context["out_of_stock_count"], 8)
+        self.assertEqual(response.context["supplier_count"], 50)
+
+    @override_settings(STORE_COUNTER_TABLE=True)
+    def test_counter_table_follows_writes(self):
+        rebuild_counters()
+        supplier = Supplier.objects.create(name="Acme")
+        order = SupplierOrder.objects.create(supplier=supplier)
+        payment = PaymentRecord.objects.create(order=order, method="CASH")
+        Client.objects.create(name="Site A")
+        payment.status = "SUCCESS"
+        payment.save()
+        PaymentRecord.objects.create(method="CASH")
+        supplier.delete()
+        with self.assertNumQueries(1):
+            deferred = list(PaymentRecord.objects.only("method").order_by("pk"))     #status is not read for the counter
+        deferred[0].method = "MPESA"
+        deferred[0].save(update_fields=["method"])
+        deferred[1].status = "FAILED"       #was PENDING
+        deferred[1].save()
+
+        stored = dict(StoreCounter.objects.values_list("name", "value"))
+        self.assertEqual(stored, live_counts())
+        self.assertEqual(stored["pending_payment_count"], 0)
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            self.client.get(reverse("store:dashboard"))
+
+
+class KeysetPaginationTests(StoreTestCase):
+    def walk(self, url, key):
+        seen, params = [], {"page_size": 3}
+        while True:
+            page = self.client.get(url, params).context[key]
+            seen.append([obj.pk for obj in page])
+            if not page.has_next:
+                return seen, page
+            params = {"page_size": 3, "after": page.next_cursor}
+
+    def test_pages_cover_ordering_with_null_dates(self):
+        for i in range(8):
+            StockIssue.objects.create(
+                quantity=1,
+                issue_date=None if i % 3 == 0 else date(2025, 1, 1 + i // 2),
+            )
+        expected = list(
+            StockIssue.objects.order_by(F("issue_date").desc(nulls_last=True), "-pk")
+            .values_list("pk", flat=True)
+        )
+        pages, last = self.walk(reverse("store:issue_list"), "issues")
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertTrue(all(len(page) <= 3 for page in pages))
+
+        # walking back from the last page gives the same pages in reverse
+        back = self.client.get(
+            reverse("store:issue_list"), {"page_size": 3, "before": last.previous_cursor}
+        )
+        self.assertEqual([obj.pk for obj in back.context["issues"]], pages[-2])
+
+    def test_page_size_is_capped(self):
+        with self.settings(STORE_MAX_PAGE_SIZE=2):
+            Item.objects.bulk_create(Item(name=f"Item {i}") for i in range(5))
+            response = self.client.get(reverse("store:item_list"), {"page_size": 1000})
+        self.assertEqual(len(response.context["items"]), 2)
+        self.assertTrue(response.context["items"].has_next)
+
+
+class StockServiceTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.item = Item.objects.create(name="Cement", quantity=10)
+        self.other = Item.objects.create(name="Sand", quantity=5)
+
+    def post_issue(self, url, **data):
+        return self.client.post(url, {"quantity": 1, "issue_date": "2025-01-01", **data})
+
+    def test_cannot_issue_more_than_on_hand(self):
+        self.post_issue(reverse("store:issue_create"), item=self.item.pk, quantity=11)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 10)
+        self.assertFalse(StockIssue.objects.exists())
+
+    def test_create_update_delete_apply_deltas(self):
+        self.post_issue(reverse("store:issue_create"), item=self.item.pk, quantity=4)
+        issue = StockIssue.objects.get()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 6)
+
+        self.post_issue(reverse("store:issue_update", args=[issue.pk]), item=self.item.pk, quantity=7)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 3)
+
+        self.post_issue(reverse("store:issue_update", args=[issue.pk]), item=self.other.pk, quantity=2)
+        self.item.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.other.quantity), (10, 3))
+
+        self.client.post(reverse("store:issue_delete", args=[issue.pk]))
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.quantity, 5)
+
+    def test_cancelling_twice_returns_stock_once(self):
+        self.post_issue(reverse("store:issue_create"), item=self.item.pk, quantity=3)
+        first, second = StockIssue.objects.get(), StockIssue.objects.get()     #a double submit
+        self.assertTrue(cancel_issue(first))
+        self.assertFalse(cancel_issue(second))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 10)
+        self.assertEqual(StockMovement.objects.filter(kind="RETURN", issue_id=first.pk).count(), 1)
+
+    def test_edits_apply_against_the_stored_issue(self):
+        self.post_issue(reverse("store:issue_create"), item=self.item.pk, quantity=4)
+        first, second = StockIssue.objects.get(), StockIssue.objects.get()     #two people open the same issue
+        first.quantity = 6
+        change_issue(first)
+        second.quantity = 5       #still thinks the issue is for 4
+        change_issue(second)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 5)
+        self.assertEqual(StockIssue.objects.get().quantity, 5)
+        self.assertEqual(drifted_items(), [])
+
+    def test_failed_update_leaves_stock_and_issue_alone(self):
+        self.post_issue(reverse("store:issue_create"), item=self.item.pk, quantity=4)
+        issue = StockIssue.objects.get()
+        self.post_issue(reverse("store:issue_update", args=[issue.pk]), item=self.other.pk, quantity=6)
+        issue.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual((issue.item_id, issue.quantity, self.item.quantity), (self.item.pk, 4, 6))
+
+
+class SearchTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cement = Item.objects.create(name="Cement 50kg Bag", category="Building")
+        Item.objects.create(name="Sand", description="River sand for cement mixing")
+        Supplier.objects.create(name="Bamburi", contact_person="Jane Wanjiru")
+        Client.objects.create(name="Site Cemetery Road")
+
+    def test_ranked_prefix_search_across_models(self):
+        response = self.client.get(reverse("store:search_api"), {"q": "cem"})
+        results = response.json()["results"]
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1]["name"], "Sand")   #description-only match ranks below name matches
+        self.assertEqual({r["kind"] for r in results}, {"item", "client"})
+
+        results = self.client.get(reverse("store:search_api"), {"q": "wanj", "kind": "supplier"}).json()["results"]
+        self.assertEqual([r["name"] for r in results], ["Bamburi"])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.cement.name = "Portland Cement"
+        self.cement.save()
+        self.assertEqual(search("portland")[0]["id"], self.cement.pk)
+        self.cement.delete()
+        self.assertEqual(search("portland"), [])
+
+    def test_dashboard_search_uses_index(self):
+        response = self.client.get(reverse("store:dashboard"), {"search": "building"})
+        self.assertEqual([i.name for i in response.context["items"]], ["Cement 50kg Bag"])
+        response = self.client.get(reverse("store:dashboard"), {"search": "bamb"})
+        self.assertEqual([r["name"] for r in response.context["search_results"]], ["Bamburi"])
+
+
+class StockStatusTests(StoreTestCase):
+    def test_status_follows_every_kind_of_write(self):
+        item = Item.objects.create(name="Nails", quantity=20, reorder_level=5)
+        self.assertEqual(item.status, "OK")
+
+        take_stock(item.pk, 15)          #queryset update with an F() expression
+        item.refresh_from_db()
+        self.assertEqual((item.quantity, item.status), (5, "LOW"))
+
+        take_stock(item.pk, 5)
+        item.refresh_from_db()
+        self.assertEqual(item.status, "OUT")
+
+        item.quantity = 9
+        Item.objects.bulk_update([item], ["quantity"])
+        item.refresh_from_db()
+        self.assertEqual(item.status, "OK")
+
+        Item.objects.filter(pk=item.pk).update(reorder_level=10)
+        item.refresh_from_db()
+        self.assertEqual(item.status, "LOW")
+
+    def test_low_stock_list_and_recompute_command(self):
+        Item.objects.create(name="Bolts", quantity=2, reorder_level=3)
+        Item.objects.create(name="Wire", quantity=50, reorder_level=3)
+        Item.objects.all().update(status="OK")   #simulate rows written before status was derived
+        Item.objects.filter(name="Wire").update(status="OUT")
+
+        call_command("recompute_stock_status", batch_size=1, stdout=StringIO())
+        self.assertEqual(dict(Item.objects.values_list("name", "status")), {"Bolts": "LOW", "Wire": "OK"})
+
+        response = self.client.get(reverse("store:item_list"), {"status": "LOW"})
+        self.assertEqual([i.name for i in response.context["items"]], ["Bolts"])
+
+
+class QueryPlanTests(StoreTestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every store query a view makes and fails if
+    SQLite would read a table without an index or sort with a temp B-tree.
+    Full-text queries are exempt from the sort rule: ranking only orders the
+    rows that matched.
+    """
+
+    VIEWS = [    #(url name, query string, context name of the page)
+        ("store:dashboard", {}, "items"),
+        ("store:dashboard", {"search": "cem"}, "items"),
+        ("store:item_list", {}, "items"),
+        ("store:item_list", {"status": "LOW"}, "items"),
+        ("store:supplier_list", {}, "suppliers"),
+        ("store:client_list", {}, "clients"),
+        ("store:order_list", {}, "orders"),
+        ("store:issue_list", {}, "issues"),
+        ("store:payment_list", {}, "payments"),
+    ]
+    AUTOCOMPLETE = [   #(kind, query)
+        ("item", ""),
+        ("item", "cem"),
+        ("supplier", "bam"),
+        ("client", "site"),
+        ("order", ""),
+        ("order", "bam"),
+        ("order", "#1"),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        supplier = Supplier.objects.create(name="Bamburi")
+        client = Client.objects.create(name="Site A")
+        for i in range(3):
+            item = Item.objects.create(name=f"Cement {i}", quantity=i, reorder_level=1)
+            order = SupplierOrder.objects.create(supplier=supplier, item=item)
+            StockIssue.objects.create(item=item, client=client, issue_date=None if i == 1 else date(2025, 1, i + 1))
+            PaymentRecord.objects.create(order=order, method="CASH")
+
+    def plan_problems(self, url, params):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params)
+        problems = []
+        for query in captured.captured_queries:
+            sql = query["sql"]
+            if "store_" not in sql:      #sessions and auth are not ours
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                details = [row[-1] for row in cursor.fetchall()]
+            for detail in details:
+                full_scan = re.fullmatch(r"SCAN \w+", detail)
+                temp_sort = "TEMP B-TREE" in detail and "store_search" not in sql
+                if full_scan or temp_sort:
+                    problems.append(f"{detail}\n    {sql}")
+        return response, problems
+
+    def test_views_use_indexes_on_every_page(self):
+        for name, params, key in self.VIEWS:
+            params = {"page_size": 1, **params}
+            response, problems = self.plan_problems(reverse(name), params)
+            self.assertEqual(problems, [], name)
+
+            # follow the cursors both ways so the keyset filters are checked too
+            page = response.context[key]
+            for _ in range(2):
+                if not page.has_next:
+                    break
+                response, problems = self.plan_problems(reverse(name), {**params, "after": page.next_cursor})
+                self.assertEqual(problems, [], f"{name} next page")
+                page = response.context[key]
+            if page.has_previous:
+                _, problems = self.plan_problems(reverse(name), {**params, "before": page.previous_cursor})
+                self.assertEqual(problems, [], f"{name} previous page")
+
+    def test_autocomplete_uses_indexes(self):
+        for kind, query in self.AUTOCOMPLETE:
+            response, problems = self.plan_problems(reverse("store:autocomplete", args=[kind]), {"q": query})
+            self.assertEqual(problems, [], (kind, query))
+            self.assertTrue(response.json()["results"], (kind, query))
+
+
+class ItemImportTests(StoreTestCase):
+    CSV = (
+        "Name,Category,Quantity,Unit_Price,Reorder_Level,Description\n"
+        "Cement,Building,10,650.00,5,\n"
+        "Sand,Building,0,40,2,River sand\n"
+        ",Building,1,1,1,\n"            #no name
+        "Nails,Hardware,-3,5,1,\n"      #negative quantity
+    )
+
+    def test_upload_creates_updates_and_reports_errors(self):
+        Item.objects.create(name="Cement", quantity=1, unit_price=600)
+        upload = SimpleUploadedFile("items.csv", self.CSV.encode())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("store:item_import"), {"file": upload})
+        self.assertFalse([q for q in queries if "DELETE FROM store_search" in q["sql"]])     #only the imported rows are indexed
+
+        result = response.context["result"]
+        self.assertEqual((result.rows, result.created, result.updated, result.error_count), (4, 1, 1, 2))
+        self.assertEqual([row for row, message in result.errors], [4, 5])
+        cement = Item.objects.get(name="Cement")
+        self.assertEqual((cement.quantity, cement.unit_price, cement.status), (10, 650, "OK"))
+        self.assertEqual(Item.objects.get(name="Sand").status, "OUT")
+        self.assertEqual(search("river")[0]["name"], "Sand")
+        self.assertEqual([row["name"] for row in search("building", kinds=["item"])], ["Cement", "Sand"])    #the updated item too
+
+    @skipIf(openpyxl is None, "openpyxl is not installed")
+    def test_command_reads_xlsx(self):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["name", "quantity", "unit_price", "reorder_level"])
+        workbook.active.append(["Wire", 3, 12.5, 4])
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as f:
+            workbook.save(f.name)
+            call_command("import_items", f.name, stdout=StringIO(), stderr=StringIO())
+        wire = Item.objects.get(name="Wire")
+        self.assertEqual((wire.quantity, wire.status), (3, "LOW"))
+
+
+class ExportTests(StoreTestCase):
+    def test_csv_export_streams_filtered_rows(self):
+        Item.objects.create(name="Bolts", quantity=0)
+        Item.objects.create(name="Wire", quantity=9)
+        response = self.client.get(reverse("store:item_export"), {"format": "csv", "status": "OUT"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["id", "name", "category"])
+        self.assertEqual([line.split(",")[1] for line in lines[1:]], ["Bolts"])
+
+    def test_jsonl_export_joins_related_names(self):
+        item = Item.objects.create(name="Cement", quantity=5)
+        StockIssue.objects.create(item=item, quantity=2, issue_date=date(2025, 3, 1))
+        response = self.client.get(reverse("store:issue_export"), {"format": "jsonl"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(rows[0]["item"], "Cement")
+        self.assertEqual(rows[0]["issue_date"], "2025-03-01")
+
+
+class StubDaraja(BaseHTTPRequestHandler):
+    """Answers the two Daraja calls the worker makes. push_status and push_delay are set per test."""
+    push_status = 200
+    push_delay = 0
+    calls = []
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except BrokenPipeError:     #the worker gave up waiting
+            pass
+
+    def do_GET(self):
+        self.calls.append("token")
+        self._reply(200, {"access_token": "stub-token", "expires_in": "3599"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.calls.append("stk_push")
+        time.sleep(self.push_delay)
+        if self.push_status == 200:
+            self._reply(200, {"ResponseCode": "0", "CheckoutRequestID": "ws_CO_stub_1", "MerchantRequestID": "m-1"})
+        elif self.push_status == 400:
+            self._reply(400, {"errorCode": "400.002.02", "errorMessage": "Bad Request - Invalid PhoneNumber"})
+        else:
+            self._reply(self.push_status, {"errorMessage": "Service unavailable"})
+
+    def log_message(self, *args):
+        pass
+
+
+class MpesaDispatchTests(StoreTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(("127.0.0.1", 0), StubDaraja)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.settings = override_settings(
+            MPESA_API_BASE_URL=f"http://127.0.0.1:{cls.server.server_port}/",
+            MPESA_PUSH_RETRY_DELAY=0,
+        )
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        StubDaraja.push_status = 200
+        StubDaraja.push_delay = 0
+        StubDaraja.calls = []
+        mpesa.breaker.reset()
+        supplier = Supplier.objects.create(name="Acme")
+        item = Item.objects.create(name="Cement", quantity=5)
+        self.order = SupplierOrder.objects.create(supplier=supplier, item=item, quantity_ordered=2, unit_price=150)
+
+    def pay(self):
+        PaymentRecord.objects.filter(order=self.order).delete()
+        response = self.client.post(
+            reverse("store:order_pay_mpesa", args=[self.order.id]), {"phone_number": "0712345678"}
+        )
+        self.assertEqual(response.status_code, 302)
+        return PaymentRecord.objects.get(order=self.order)
+
+    def test_view_only_queues_the_push(self):
+        payment = self.pay()
+        self.assertEqual(payment.status, "PENDING")
+        self.assertTrue(PaymentDispatch.objects.filter(payment=payment).exists())
+
+    def test_worker_records_checkout_request_id(self):
+        payment = self.pay()
+        queued_at = payment.updated_at
+        self.assertEqual(run_worker(concurrency=1, once=True), 1)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.reference), ("PENDING", "ws_CO_stub_1"))
+        self.assertGreater(payment.updated_at, queued_at)      #the payment list's ETag moves on
+        self.assertFalse(PaymentDispatch.objects.exists())
+
+    def test_rejected_push_fails_without_retry(self):
+        StubDaraja.push_status = 400
+        payment = self.pay()
+        run_worker(concurrency=1, once=True)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "FAILED")
+        self.assertFalse(PaymentDispatch.objects.exists())
+        self.assertEqual(live_counts()["pending_payment_count"], 0)
+
+    @override_settings(MPESA_PUSH_MAX_ATTEMPTS=3)
+    def test_unavailable_gateway_is_retried_then_failed(self):
+        StubDaraja.push_status = 503
+        payment = self.pay()
+        self.assertEqual(run_worker(concurrency=1, once=True), 3)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.reference), ("FAILED", "ERROR"))
+
+    @override_settings(MPESA_CALLBACK_TOKEN="callback-secret")
+    def test_callback_before_the_push_is_recorded_is_kept(self):
+        payment = self.pay()
+        self.client.logout()
+        response = self.client.post(
+            mpesa.with_callback_token(reverse("store:mpesa_callback")),
+            stk_callback("ws_CO_stub_1", success=True), content_type="application/json",
+        )
+        self.assertEqual(response.json()["ResultCode"], 0)
+        self.assertTrue(MpesaCallback.objects.exists())
+
+        self.assertEqual(run_worker(concurrency=1, once=True), 1)       #saves ws_CO_stub_1, then finds the callback
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.reference), ("SUCCESS", "RCO_STUB_1"))
+        self.assertFalse(MpesaCallback.objects.exists())
+
+    @override_settings(MPESA_REQUEST_TIMEOUT=0.2, MPESA_PUSH_MAX_ATTEMPTS=3)
+    def test_unanswered_push_is_not_sent_again(self):
+        StubDaraja.push_delay = 0.5      #Daraja got the push but answers too late
+        payment = self.pay()
+        self.assertEqual(run_worker(concurrency=1, once=True), 1)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.reference), ("PENDING", "UNCONFIRMED"))
+        self.assertEqual(StubDaraja.calls.count("stk_push"), 1)
+        self.assertFalse(PaymentDispatch.objects.exists())
+
+    @override_settings(MPESA_PUSH_MAX_ATTEMPTS=2)
+    def test_push_that_never_connected_is_retried(self):
+        closed = HTTPServer(("127.0.0.1", 0), StubDaraja)
+        port = closed.server_port
+        closed.server_close()        #nothing listens there any more
+        mpesa.shared_cache().set(mpesa.TOKEN_CACHE_KEY, "stub-token")
+        with override_settings(MPESA_API_BASE_URL=f"http://127.0.0.1:{port}/"):
+            payment = self.pay()
+            self.assertEqual(run_worker(concurrency=1, once=True), 2)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.reference), ("FAILED", "ERROR"))
+
+    def test_token_is_cached_between_pushes(self):
+        for _ in range(3):
+            self.pay()
+            run_worker(concurrency=1, once=True)
+        self.assertEqual(StubDaraja.calls.count("token"), 1)
+        self.assertEqual(StubDaraja.calls.count("stk_push"), 3)
+        self.assertEqual(sum(mpesa.latency_histograms()["stk_push"].values()), 3)
+
+    @override_settings(
+        CACHES={**TEST_CACHES, "shared": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "no_such_table"}},
+    )
+    def test_push_works_before_createcachetable(self):
+        for _ in range(2):
+            payment = self.pay()
+            run_worker(concurrency=1, once=True)
+            payment.refresh_from_db()
+            self.assertEqual(payment.status, "PENDING")
+            self.assertTrue(payment.checkout_request_id)
+        self.assertEqual(StubDaraja.calls.count("token"), 2)       #nowhere to keep it, so fetched each time
+
+    @override_settings(MPESA_BREAKER_THRESHOLD=2, MPESA_PUSH_MAX_ATTEMPTS=10)
+    def test_breaker_stops_calls_after_repeated_failures(self):
+        StubDaraja.push_status = 503
+        payment = self.pay()
+        run_worker(concurrency=1, once=True)     #two real failures, then the breaker opens
+        self.assertEqual(mpesa.breaker.state, "open")
+        self.assertEqual(StubDaraja.calls.count("stk_push"), 2)
+
+        job = PaymentDispatch.objects.get(payment=payment)
+        self.assertEqual(job.attempts, 2)        #the refused call did not use up an attempt
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "PENDING")
+
+
+@override_settings(MPESA_CALLBACK_TOKEN="callback-secret")
+class MpesaCallbackTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = PaymentRecord.objects.create(
+            method="MPESA", amount=300, status="PENDING", phone_number="0712345678",
+            checkout_request_id="ws_CO_1",
+        )
+        self.client.logout()        #Safaricom has no session
+
+    def deliver(self, body, token="callback-secret"):
+        url = reverse("store:mpesa_callback") + (f"?token={token}" if token is not None else "")
+        return self.client.post(url, body, content_type="application/json")
+
+    def test_duplicate_deliveries_settle_once_in_one_statement(self):
+        body = json.loads(stk_callback("ws_CO_1", success=True))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.deliver(body)
+        self.assertEqual(response.json()["ResultCode"], 0)
+        self.assertEqual(len(queries), 1)
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.reference), ("SUCCESS", "RWS_CO_1"))
+
+        self.assertEqual(self.deliver(json.loads(stk_callback("ws_CO_1", success=False))).json()["ResultCode"], 0)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "SUCCESS")
+
+    @override_settings(STORE_COUNTER_TABLE=True)
+    def test_pending_counter_follows_callbacks(self):
+        rebuild_counters()
+        for _ in range(3):
+            self.deliver(json.loads(stk_callback("ws_CO_1", success=False)))
+        self.assertEqual(StoreCounter.objects.get(name="pending_payment_count").value, 0)
+
+    def test_unknown_and_malformed_callbacks(self):
+        self.assertEqual(self.deliver(json.loads(stk_callback("ws_CO_missing", success=True))).status_code, 200)
+        self.assertEqual(self.deliver({"Body": {}}).status_code, 400)
+        self.assertEqual(list(MpesaCallback.objects.values_list("checkout_request_id", flat=True)), ["ws_CO_missing"])
+
+        for _ in range(2):      #kept once; a settled payment's repeats are only acknowledged
+            self.deliver(json.loads(stk_callback("ws_CO_1", success=True)))
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+
+    def test_callbacks_without_the_token_are_refused(self):
+        body = json.loads(stk_callback("ws_CO_1", success=True))
+        self.assertEqual(self.deliver(body, token=None).status_code, 403)
+        self.assertEqual(self.deliver(body, token="guess").status_code, 403)
+        with override_settings(MPESA_CALLBACK_TOKEN=""):
+            self.assertEqual(self.deliver(body, token="").status_code, 403)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+
+    @override_settings(MPESA_CALLBACK_URL="https://example.com/store/mpesa/callback/?src=daraja")
+    def test_callback_url_carries_the_token(self):
+        self.assertEqual(mpesa.callback_url(), "https://example.com/store/mpesa/callback/?src=daraja&token=callback-secret")
+
+    def test_replay_load(self):
+        out = StringIO()
+        call_command("replay_mpesa_callbacks", payments=200, duplicates=3, concurrency=1, stdout=out)
+        self.assertIn("All 200 payments settled exactly once.", out.getvalue())
+
+
+class AsyncViewTests(StoreTestCase):
+    async def test_read_views_and_payment_on_the_async_path(self):
+        await self.async_client.aforce_login(self.user)
+        supplier = await Supplier.objects.acreate(name="Acme")
+        item = await Item.objects.acreate(name="Cement", quantity=5)
+        order = await SupplierOrder.objects.acreate(supplier=supplier, item=item, quantity_ordered=2, unit_price=150)
+
+        for name in ["dashboard", "item_list", "supplier_list", "client_list", "order_list", "issue_list", "payment_list"]:
+            response = await self.async_client.get(reverse(f"store:{name}"))
+            self.assertEqual(response.status_code, 200, name)
+
+        url = reverse("store:order_pay_mpesa", args=[order.id])
+        self.assertContains(await self.async_client.get(url), "Acme")
+        response = await self.async_client.post(url, {"phone_number": "0712345678"})
+        self.assertEqual(response.status_code, 302)
+        payment = await PaymentRecord.objects.aget(order=order)
+        self.assertTrue(await PaymentDispatch.objects.filter(payment=payment).aexists())
+
+
+class CachingTests(StoreTestCase):
+    def test_cached_list_is_shared_and_retired_by_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Supplier.objects.create(name="Acme")
+        url = reverse("store:supplier_list")
+        self.assertContains(self.client.get(url), "Acme")
+
+        other = User.objects.create_user("other", password="pass12345")
+        self.client.force_login(other)
+        with self.assertNumQueries(2):         #session + user; the table comes from the cache
+            self.assertContains(self.client.get(url), "Acme")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Supplier.objects.filter(name="Acme").first().delete()
+        self.assertNotContains(self.client.get(url), "Acme")
+
+        stats = self.client.get(reverse("store:cache_stats")).json()["entries"]["supplier_table"]
+        self.assertEqual(stats, {"hits": 1, "misses": 2})
+
+    def test_stock_update_retires_dashboard_widgets(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Item.objects.create(name="Cement", quantity=1)
+        self.assertEqual(self.client.get(reverse("store:dashboard")).context["out_of_stock_count"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            take_stock(item.pk, 1)       #a plain UPDATE, no save signal
+        self.assertEqual(self.client.get(reverse("store:dashboard")).context["out_of_stock_count"], 1)
+
+    def test_search_api_response_is_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(name="Cement")
+        url = reverse("store:search_api")
+        first = self.client.get(url, {"q": "cem"}).json()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url, {"q": "cem"}).json(), first)
+
+
+class AutocompleteTests(StoreTestCase):
+    def seed(self, n):
+        suppliers = Supplier.objects.bulk_create(Supplier(name=f"Supplier {i}") for i in range(n))
+        items = Item.objects.bulk_create(Item(name=f"Item {i}") for i in range(n))
+        Client.objects.bulk_create(Client(name=f"Client {i}") for i in range(n))
+        SupplierOrder.objects.bulk_create(
+            SupplierOrder(supplier=supplier, item=item) for supplier, item in zip(suppliers, items)
+        )
+
+    def test_form_pages_do_not_grow_with_tables(self):
+        pages = ["store:order_create", "store:issue_create", "store:payment_create"]
+        self.seed(2)
+        counts = {}
+        for name in pages:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse(name))
+            counts[name] = len(queries)
+        self.seed(40)
+        for name in pages:
+            with self.assertNumQueries(counts[name]):
+                response = self.client.get(reverse(name))
+            self.assertNotContains(response, "Supplier 30")
+
+    def test_edit_form_renders_only_the_chosen_option(self):
+        self.seed(5)
+        payment = PaymentRecord.objects.create(order=SupplierOrder.objects.first(), method="CASH")
+        response = self.client.get(reverse("store:payment_create"), {"order": payment.order_id})
+        form = PaymentRecordForm(instance=payment)
+        with self.assertNumQueries(1):     #the chosen order, joined to its supplier
+            html = str(form["order"])
+        self.assertEqual(html.count("<option"), 2)
+        self.assertIn(str(payment.order), html)
+        self.assertEqual(response.status_code, 200)
+
+    def test_prefix_search_ignores_case_and_limits(self):
+        self.seed(30)
+        Item.objects.create(name="cement")
+        url = reverse("store:autocomplete", args=["item"])
+        names = [r["text"] for r in self.client.get(url, {"q": "ITEM 1", "limit": 5}).json()["results"]]
+        self.assertEqual(names, ["Item 1", "Item 10", "Item 11", "Item 12", "Item 13"])
+        self.assertEqual(self.client.get(url, {"q": "Cem"}).json()["results"][0]["text"], "cement")
+        self.assertEqual(self.client.get(reverse("store:autocomplete", args=["nope"])).status_code, 404)
+
+
+class AdminChangelistTests(StoreTestCase):
+    PAGES = [
+        "admin:store_item_changelist",
+        "admin:store_supplier_changelist",
+        "admin:store_client_changelist",
+        "admin:store_supplierorder_changelist",
+        "admin:store_stockissue_changelist",
+        "admin:store_paymentrecord_changelist",
+        "admin:store_supplierorder_add",
+        "admin:store_stockissue_add",
+        "admin:store_paymentrecord_add",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser("admin", password="pass12345"))
+
+    def seed(self, n):
+        start = Supplier.objects.count()
+        suppliers = Supplier.objects.bulk_create(Supplier(name=f"Supplier {start + i}") for i in range(n))
+        items = Item.objects.bulk_create(Item(name=f"Item {start + i}") for i in range(n))
+        clients = Client.objects.bulk_create(Client(name=f"Client {start + i}") for i in range(n))
+        orders = SupplierOrder.objects.bulk_create(
+            SupplierOrder(supplier=supplier, item=item) for supplier, item in zip(suppliers, items)
+        )
+        StockIssue.objects.bulk_create(StockIssue(item=item, client=client) for item, client in zip(items, clients))
+        PaymentRecord.objects.bulk_create(PaymentRecord(order=order, method="CASH") for order in orders)
+
+    def test_changelists_do_not_grow_with_rows(self):
+        self.seed(2)
+        counts = {}
+        for name in self.PAGES:
+            self.client.get(reverse(name))      #fills the content type cache
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200, name)
+            counts[name] = len(queries)
+        self.seed(30)
+        for name in self.PAGES:
+            with self.assertNumQueries(counts[name]):
+                response = self.client.get(reverse(name))
+            self.assertNotContains(response, "supplier__id__exact", msg_prefix=name)   #no filter listing every supplier
+            if name.endswith("_add"):
+                self.assertNotContains(response, "Supplier 25", msg_prefix=name)   #no <option> per row
+
+    @override_settings(STORE_ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_unfiltered_total_is_estimated(self):
+        self.seed(10)
+        SupplierOrder.objects.filter(pk__in=SupplierOrder.objects.order_by("pk").values("pk")[:2]).delete()
+        url = reverse("admin:store_supplierorder_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context["cl"].result_count, 10)     #highest id, the two deletes not noticed
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"]])
+
+        response = self.client.get(url, {"status__exact": "PENDING"})
+        self.assertEqual(response.context["cl"].result_count, 8)
+
+
+class ValuationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        acme = Supplier.objects.create(name="Acme")
+        cement = Item.objects.create(name="Cement", category="Building", quantity=10, unit_price="650.50")
+        Item.objects.create(name="Sand", category="Building", quantity=4, unit_price="40")
+        Item.objects.create(name="Wire", quantity=3, unit_price="12.25")
+        SupplierOrder.objects.create(supplier=acme, item=cement, quantity_ordered=5, unit_price="600")
+        SupplierOrder.objects.create(supplier=acme, quantity_ordered=2, unit_price="10", status="RECEIVED")
+        SupplierOrder.objects.create(quantity_ordered=1, unit_price="99.99")
+
+    def test_columns_follow_bulk_updates_and_sort(self):
+        Item.objects.filter(name="Sand").update(quantity=F("quantity") * 100)
+        names = list(Item.objects.filter(total_value__gt=1000).order_by("-total_value").values_list("name", flat=True))
+        self.assertEqual(names, ["Sand", "Cement"])     #400 x 40 now outweighs 10 x 650.50
+        self.assertEqual(SupplierOrder.objects.get(supplier__name="Acme", status="PENDING").total_cost, 3000)
+
+    def test_summary_is_one_query(self):
+        with self.assertNumQueries(1):
+            summary = valuation_summary()
+        self.assertEqual(str(summary["stock_value"]), "6701.75")
+        self.assertEqual(
+            [(row["name"], str(row["value"]), row["rows"]) for row in summary["stock_by_category"]],
+            [("Building", "6665.00", 2), ("", "36.75", 1)],
+        )
+        self.assertEqual(str(summary["open_order_value"]), "3099.99")
+        self.assertEqual(
+            [(row["name"], str(row["value"])) for row in summary["open_orders_by_supplier"]],
+            [("Acme", "3000.00"), ("", "99.99")],
+        )
+
+    def test_report_endpoint_and_dashboard(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(name="Tiles", category="Finishes", quantity=1, unit_price="5")
+        report = self.client.get(reverse("store:valuation_report")).json()
+        self.assertEqual(report["stock_value"], "6706.75")
+        self.assertEqual(report["open_orders_by_supplier"][0]["name"], "Acme")
+        response = self.client.get(reverse("store:dashboard"))
+        self.assertContains(response, "KSh 6707", count=2)     #stock value card and valuation widget
+        self.assertContains(response, "Uncategorised")
+
+
+class StockLedgerTests(StoreTestCase):
+    def at(self, day):
+        return datetime(2025, 1, day, tzinfo=dt_timezone.utc)
+
+    def test_every_stock_path_writes_the_ledger(self):
+        item = Item.objects.create(name="Cement", quantity=10)
+        self.client.post(reverse("store:issue_create"), {"item": item.pk, "quantity": 4, "issue_date": "2025-01-01"})
+        issue = StockIssue.objects.get()
+        self.client.post(reverse("store:issue_update", args=[issue.pk]), {"item": item.pk, "quantity": 6, "issue_date": "2025-01-01"})
+        self.client.post(reverse("store:issue_delete", args=[issue.pk]))
+        item.refresh_from_db()
+        item.quantity = 25
+        item.save()
+        Item.objects.bulk_create([Item(name="Sand", quantity=3)])
+        row = {"unit_price": "1", "reorder_level": "0"}
+        result = import_items([{**row, "name": "Cement", "quantity": "20"}, {**row, "name": "Wire", "quantity": "7"}])
+        self.assertEqual((result.created, result.updated), (1, 1))
+
+        kinds = list(StockMovement.objects.filter(item=item).order_by("pk").values_list("kind", "quantity", "issue_id"))
+        self.assertEqual(kinds, [
+            ("OPENING", 10, None),
+            ("ISSUE", -4, issue.pk),
+            ("ISSUE", -2, issue.pk),
+            ("RETURN", 6, issue.pk),
+            ("ADJUST", 15, None),
+            ("ADJUST", -5, None),
+        ])
+        self.assertEqual(drifted_items(), [])
+        self.assertEqual(StockMovement.objects.count(), 8)      #plus Sand and Wire opening balances
+
+    def test_point_in_time_uses_latest_snapshot(self):
+        cement = Item.objects.create(name="Cement")
+        sand = Item.objects.create(name="Sand")
+        for day, item, quantity in [(1, cement, 10), (2, cement, -3), (2, sand, 5), (4, cement, -2), (6, sand, 1)]:
+            StockMovement.objects.create(item=item, quantity=quantity, kind="ADJUST", occurred_at=self.at(day))
+
+        self.assertEqual(take_snapshots(self.at(3)), 2)
+        self.assertEqual(take_snapshots(self.at(5)), 1)      #sand did not move between day 3 and day 5
+        StockMovement.objects.filter(occurred_at__lte=self.at(3)).delete()    #history before a snapshot is no longer read
+        self.assertEqual(StockSnapshot.objects.get(item=cement, taken_at=self.at(3)).quantity, 7)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(on_hand_at(self.at(4)), {cement.pk: 5, sand.pk: 5})
+        self.assertEqual(on_hand_at(self.at(7)), {cement.pk: 5, sand.pk: 6})
+        self.assertEqual(on_hand_at(self.at(3), Item.objects.filter(pk=sand.pk)), {sand.pk: 5})
+
+    @override_settings(STORE_SNAPSHOT_LAG=300)
+    def test_snapshots_stay_behind_open_transactions(self):
+        item = Item.objects.create(name="Cement", quantity=10)
+        stamped = timezone.now()        #a movement stamped now whose transaction has not committed yet
+        with self.assertRaises(ValueError):
+            take_snapshots(stamped)
+        self.assertEqual(take_snapshots(), 0)        #the opening balance is newer than the lag
+        StockMovement.objects.create(item=item, quantity=-3, kind="ADJUST", occurred_at=stamped)
+        self.assertEqual(on_hand_at(timezone.now())[item.pk], 7)
+
+
+class ReceiveOrdersTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cement = Item.objects.create(name="Cement", quantity=1)
+        self.sand = Item.objects.create(name="Sand", quantity=0)
+        self.supplier = Supplier.objects.create(name="Bamburi")
+
+    def orders(self, n, **fields):
+        return SupplierOrder.objects.bulk_create(
+            SupplierOrder(supplier=self.supplier, item=self.cement if i % 2 else self.sand, quantity_ordered=i + 1, **fields)
+            for i in range(n)
+        )
+
+    def test_statements_do_not_grow_with_the_batch(self):
+        small = [order.pk for order in self.orders(3)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(receive_orders(small), 3)
+        large = [order.pk for order in self.orders(40)]
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(receive_orders(large), 40)
+
+        self.cement.refresh_from_db()
+        self.sand.refresh_from_db()
+        self.assertEqual((self.cement.quantity, self.sand.quantity), (1 + 2 + 420, 4 + 400))
+        self.assertEqual(self.sand.status, "OK")
+        self.assertEqual(StockMovement.objects.filter(kind="RECEIPT").count(), 43)
+        self.assertEqual(drifted_items(), [])
+
+    def test_only_pending_orders_are_received_once(self):
+        pending = self.orders(2)
+        done = self.orders(1, status="RECEIVED")
+        loose = SupplierOrder.objects.create(supplier=self.supplier, quantity_ordered=9)     #no item
+        ids = [o.pk for o in [*pending, *done, loose]]
+        response = self.client.post(reverse("store:order_receive_selected"), {"order": ids})
+        self.assertRedirects(response, reverse("store:order_list"))
+        self.client.post(reverse("store:order_receive", args=[pending[0].pk]))     #second time: nothing happens
+
+        self.cement.refresh_from_db()
+        self.sand.refresh_from_db()
+        self.assertEqual((self.cement.quantity, self.sand.quantity), (3, 1))
+        self.assertEqual(SupplierOrder.objects.filter(status="RECEIVED").count(), 4)
+
+    def test_edit_form_receives_through_the_same_path(self):
+        order = SupplierOrder.objects.create(supplier=self.supplier, item=self.cement, quantity_ordered=5)
+        data = {"supplier": self.supplier.pk, "item": self.cement.pk, "quantity_ordered": 5, "unit_price": 1, "status": "RECEIVED"}
+        self.client.post(reverse("store:order_update", args=[order.pk]), data)
+        self.client.post(reverse("store:order_update", args=[order.pk]), {**data, "notes": "checked"})
+        self.cement.refresh_from_db()
+        self.assertEqual(self.cement.quantity, 6)
+        self.assertEqual(list(order.movements.values_list("kind", "quantity")), [("RECEIPT", 5)])
+
+        for change in [{"status": "PENDING"}, {"quantity_ordered": 8}, {"item": self.sand.pk}]:
+            response = self.client.post(reverse("store:order_update", args=[order.pk]), {**data, **change})
+            self.assertEqual(response.status_code, 200)      #the form again, with the error
+        order.refresh_from_db()
+        self.cement.refresh_from_db()
+        self.assertEqual((order.status, order.item_id, order.quantity_ordered, self.cement.quantity), ("RECEIVED", self.cement.pk, 5, 6))
+        self.assertEqual(order.movements.count(), 1)
+
+    def test_admin_receives_through_save_order(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        order = SupplierOrder.objects.create(supplier=self.supplier, item=self.cement, quantity_ordered=5)
+        data = {"supplier": self.supplier.pk, "item": self.cement.pk, "quantity_ordered": 5, "unit_price": 1, "status": "RECEIVED"}
+        response = self.client.post(reverse("admin:store_supplierorder_change", args=[order.pk]), data)
+        self.assertEqual(response.status_code, 302)
+        self.cement.refresh_from_db()
+        self.assertEqual(self.cement.quantity, 6)
+        self.assertEqual(list(order.movements.values_list("kind", "quantity")), [("RECEIPT", 5)])
+
+
+@skipIf(numpy is None, "numpy is not installed")
+class ForecastTests(StoreTestCase):
+    TODAY = date(2025, 3, 11)
+    PARAMS = {"history_days": 10, "lead_time_days": 4, "service_level": 0.5, "review_days": 5, "today": TODAY}
+
+    def setUp(self):
+        super().setUp()
+        self.cement = Item.objects.create(name="Cement", quantity=3, unit_price=2)
+        self.sand = Item.objects.create(name="Sand", quantity=0, reorder_level=5)      #never issued
+        self.supplier = Supplier.objects.create(name="Bamburi")
+        StockIssue.objects.bulk_create(
+            [
+                StockIssue(item=self.cement, quantity=4, issue_date=date(2025, 3, 2)),
+                StockIssue(item=self.cement, quantity=6, issue_date=date(2025, 3, 2)),     #same day: one daily total of 10
+                StockIssue(item=self.cement, quantity=10, issue_date=date(2025, 3, 9)),
+                StockIssue(item=self.cement, quantity=99, issue_date=date(2025, 2, 1)),    #before the window
+                StockIssue(item=self.cement, quantity=99, issue_date=self.TODAY),          #today is not over yet
+            ]
+        )
+
+    def test_reorder_level_from_demand_and_its_spread(self):
+        result = forecast_reorder(**self.PARAMS)
+        self.assertEqual((result.items, result.with_history, result.to_reorder), (2, 1, 1))
+
+        self.cement.refresh_from_db()
+        self.sand.refresh_from_db()
+        # 20 units over 10 days: 2 a day, daily totals spread by 4; z is 0 at a 50% service level
+        self.assertEqual((self.cement.daily_demand, self.cement.demand_std), (2.0, 4.0))
+        self.assertEqual(self.cement.reorder_level, 8)             #2 * 4 days
+        self.assertEqual(self.cement.reorder_quantity, 15)         #up to 8 + 2 * 5 days, from 3
+        self.assertEqual(self.cement.status, "LOW")
+        self.assertEqual((self.sand.reorder_level, self.sand.reorder_quantity), (5, 0))
+
+        higher = forecast_reorder(**{**self.PARAMS, "service_level": 0.95})
+        self.cement.refresh_from_db()
+        self.assertEqual(self.cement.reorder_level, 22)            #8 + 1.645 * 4 * 2, rounded up
+        self.assertEqual(higher.orders_created, 0)
+
+    def test_draft_orders_for_the_last_supplier_only_once(self):
+        other = Supplier.objects.create(name="Simba")
+        SupplierOrder.objects.create(supplier=other, item=self.cement, quantity_ordered=1, status="RECEIVED")
+        SupplierOrder.objects.create(supplier=self.supplier, item=self.cement, quantity_ordered=1, status="RECEIVED")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(forecast_reorder(create_orders=True, **self.PARAMS).orders_created, 1)
+        self.assertEqual(forecast_reorder(create_orders=True, **self.PARAMS).orders_created, 0)
+
+        draft = SupplierOrder.objects.get(status="DRAFT")
+        self.assertEqual((draft.supplier, draft.item, draft.quantity_ordered), (self.supplier, self.cement, 15))
+        self.assertContains(self.client.get(reverse("store:order_list")), "Draft")
+
+    def test_history_is_read_from_the_covering_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            forecast_reorder(write=False, **self.PARAMS)
+        sql = next(q["sql"] for q in queries.captured_queries if "FILTER" in q["sql"])
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("COVERING INDEX issue_item_date_idx", plan)
+
+    def test_issues_leaving_the_window_clear_the_forecast(self):
+        forecast_reorder(**self.PARAMS)
+        forecast_reorder(**{**self.PARAMS, "today": date(2025, 6, 1)})
+        self.cement.refresh_from_db()
+        self.assertEqual((self.cement.daily_demand, self.cement.reorder_quantity), (0, 0))
+        self.assertEqual(self.cement.reorder_level, 8)      #the last computed level stays until new issues come in
+
+
+class ConsumptionRollupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cement = Item.objects.create(name="Cement", category="Building", quantity=100)
+        self.paint = Item.objects.create(name="Paint", quantity=100)
+        self.site = Client.objects.create(name="Site A")
+        self.other = Client.objects.create(name="Site B")
+
+    def issue(self, **data):
+        data = {"item": self.cement.pk, "client": self.site.pk, "quantity": 1, "issue_date": "2025-03-05", **data}
+        self.client.post(reverse("store:issue_create"), data)
+        return StockIssue.objects.latest("pk")
+
+    def rollups(self):
+        return {
+            model.__name__: sorted(model.objects.values_list(*[f.attname for f in model._meta.concrete_fields if f.name != "id"]))
+            for model in (ItemConsumption, ClientConsumption, CategoryConsumption)
+        }
+
+    def report(self, **params):
+        response = self.client.get(reverse("store:consumption_report"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_issue_writes_match_a_rebuild(self):
+        first = self.issue(quantity=4)
+        self.issue(quantity=6, issue_date="2025-03-30", client=self.other.pk)
+        moved = self.issue(quantity=2, item=self.paint.pk, client="")
+        self.client.post(
+            reverse("store:issue_update", args=[first.pk]),
+            {"item": self.cement.pk, "client": self.site.pk, "quantity": 5, "issue_date": "2025-04-01"},
+        )
+        self.client.post(reverse("store:issue_update", args=[moved.pk]), {"item": self.cement.pk, "quantity": 2, "issue_date": "2025-03-05"})
+        self.client.post(reverse("store:issue_delete", args=[self.issue(quantity=3).pk]))
+
+        incremental = self.rollups()
+        self.assertTrue(incremental["ItemConsumption"])
+        self.assertFalse(ItemConsumption.objects.filter(item=self.paint).exists())     #its only issue moved to cement
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_cancel_before_rollups_are_filled_writes_no_negative_rows(self):
+        issue = self.issue(quantity=5)
+        for table in (ItemConsumption, ClientConsumption, CategoryConsumption):
+            table.objects.all().delete()        #as on a database whose rollups were never filled
+        self.client.post(reverse("store:issue_delete", args=[issue.pk]))
+        self.assertEqual(self.rollups(), {"ItemConsumption": [], "ClientConsumption": [], "CategoryConsumption": []})
+
+    def test_report_reads_only_the_rollups(self):
+        self.issue(quantity=4)
+        self.issue(quantity=6, issue_date="2025-04-02")
+        self.issue(quantity=5, client=self.other.pk)
+        self.issue(quantity=2, item=self.paint.pk)
+        with CaptureQueriesContext(connection) as queries:
+            month = self.report(item=self.cement.pk, client=self.site.pk, start="2025-01-01")
+            weeks = self.report(by="category", period="week")
+            clients = self.report(by="client", item=self.cement.pk, end="2025-03-31")
+        self.assertFalse([q["sql"] for q in queries.captured_queries if "store_stockissue" in q["sql"]])
+
+        self.assertEqual(
+            month["series"],
+            [{"period_start": "2025-03-01", "quantity": 4, "issues": 1}, {"period_start": "2025-04-01", "quantity": 6, "issues": 1}],
+        )
+        self.assertEqual(month["breakdown"], [{"id": self.cement.pk, "name": "Cement", "quantity": 10, "issues": 2}])
+        self.assertEqual([row["period_start"] for row in weeks["series"]], ["2025-03-03", "2025-03-31"])    #Mondays
+        self.assertEqual([(row["name"], row["quantity"]) for row in weeks["breakdown"]], [("Building", 15), ("", 2)])
+        self.assertEqual([(row["name"], row["quantity"]) for row in clients["breakdown"]], [("Site B", 5), ("Site A", 4)])
+
+    def test_bad_parameters(self):
+        for params in ({"period": "year"}, {"start": "March"}, {"by": "category", "item": 1}, {"item": "x"}):
+            self.assertEqual(self.client.get(reverse("store:consumption_report"), params).status_code, 400)
+
+
+class ConditionalGetTests(StoreTestCase):
+    def test_unchanged_list_answers_304_without_store_queries(self):
+        Item.objects.create(name="Cement", quantity=5)
+        first = self.client.get(reverse("store:item_list"))
+        self.assertIn("no-cache", first["Cache-Control"])
+        with self.assertNumQueries(2):      #session + user for login_required, nothing else
+            again = self.client.get(reverse("store:item_list"), HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        other_page = self.client.get(reverse("store:item_list"), {"status": "LOW"}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(other_page.status_code, 200)
+        self.assertNotEqual(other_page["ETag"], first["ETag"])
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get(reverse("store:issue_list"))["ETag"]
+        item = Item.objects.create(name="Cement", quantity=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            take_stock(item.pk, 2)      #update(), not save()
+        response = self.client.get(reverse("store:issue_list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        items_etag = self.client.get(reverse("store:item_list"))["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Client.objects.create(name="Site A")      #the item list does not show clients
+        self.assertEqual(self.client.get(reverse("store:item_list"), HTTP_IF_NONE_MATCH=items_etag).status_code, 304)
+
+    def test_bulk_writes_set_updated_at(self):
+        item = Item.objects.create(name="Cement", quantity=5)
+        stamp = item.updated_at
+        take_stock(item.pk, 1)
+        item.refresh_from_db()
+        self.assertGreater(item.updated_at, stamp)
+        stamp = item.updated_at
+        item.quantity = 2
+        item.save(update_fields=["quantity"])      #save() adds status, and with it updated_at
+        item.refresh_from_db()
+        self.assertGreater(item.updated_at, stamp)
+        import_items([{"name": "Cement", "quantity": "9", "unit_price": "1", "reorder_level": "0"}])
+        self.assertGreater(Item.objects.get().updated_at, item.updated_at)
+
+
+class SyntheticDataTests(StoreTestCase):
+    COUNTS = {"suppliers": 5, "clients": 20, "items": 200, "orders": 50, "issues": 3000, "payments": 40}
+
+    def test_chunks_depend_only_on_the_seed(self):
+        plan = {
+            "seed": 7, "zipf": 1.0, "days": 30, "end": date(2025, 6, 30),
+            "counts": self.COUNTS, "bases": dict.fromkeys(synthetic.TABLES, 0),
+        }
+        self.assertEqual(synthetic.build_chunk("issues", 3, 300, 100, plan), synthetic.build_chunk("issues", 3, 300, 100, plan))
+        self.assertNotEqual(synthetic.build_chunk("issues", 3, 300, 100, plan), synthetic.build_chunk("issues", 4, 300, 100, {**plan, "seed": 8}))
+
+    def test_generate_loads_consistent_skewed_data(self):
+        written = synthetic.generate(self.COUNTS, seed=1, chunk_size=700, end=date(2025, 6, 30))
+        self.assertEqual(written, self.COUNTS)
+        self.assertEqual(StockIssue.objects.count(), 3000)
+        self.assertFalse(StockIssue.objects.filter(issue_date__gt=date(2025, 6, 30)).exists())
+
+        per_item = sorted(StockIssue.objects.values("item").annotate(n=Count("pk")).values_list("n", flat=True), reverse=True)
+        self.assertGreater(per_item[0], 10 * per_item[len(per_item) // 2])     #Zipf: the top item dwarfs the median one
+        self.assertFalse(Item.objects.exclude(status=stock_status_expression()).exists())
+        self.assertEqual(
+            StockMovement.objects.filter(kind="OPENING").count(), Item.objects.filter(quantity__gt=0).count()
+        )
+        self.assertEqual(live_counts()["client_count"], 20)
+        self.assertEqual(ItemConsumption.objects.filter(period="DAY").aggregate(n=Sum("issue_count"))["n"], 3000)
+        self.assertIn("issue_item_date_idx", {index for index in connection.introspection.get_constraints(connection.cursor(), "store_stockissue")})
+
+
+@tag("benchmark")
+@override_settings(MPESA_CALLBACK_TOKEN="callback-secret")
+class BenchmarkTests(StoreTestCase):
+    """A tiny run of the load benchmark; manage.py test --exclude-tag benchmark skips it."""
+
+    def test_every_route_is_driven_without_errors(self):
+        sizes = benchmark.seed({"items": 20, "suppliers": 3, "clients": 5, "orders": 10, "issues": 60, "payments": 5})
+        self.assertEqual(sizes["issues"], 60)
+        self.assertTrue(ItemConsumption.objects.exists())      #seeding rebuilds the rollups
+
+        report = benchmark.run(requests=2, concurrency=1, memory_requests=1)
+        json.dumps(report)
+        driven = {route.url_name for route in benchmark.routes(benchmark.sample_ids())}
+        self.assertEqual(driven, {f"store:{pattern.name}" for pattern in store_urls.urlpatterns})
+        for label, result in report["routes"].items():
+            self.assertEqual(result["errors"], 0, f"{label}: {result['statuses']}")
+            self.assertGreaterEqual(result["latency_ms"]["p99"], result["latency_ms"]["p50"])
+            self.assertGreater(result["queries"]["max"], 0)
+        self.assertEqual(report["mpesa_worker"]["left_queued"], 0)
+        self.assertEqual(PaymentRecord.objects.filter(checkout_request_id__startswith="ws_CO_bench_").count(), 4)   #warm-up, 2 timed, 1 traced
+
+    def test_compare_lines_up_shared_routes(self):
+        before = {"routes": {"item_list": {"latency_ms": {"p50": 10, "p95": 20, "p99": 30}, "queries": {"mean": 2}, "peak_memory_kib": None}}}
+        after = {"routes": {
+            "item_list": {"latency_ms": {"p50": 5, "p95": 20, "p99": 40}, "queries": {"mean": 3}, "peak_memory_kib": 100},
+            "dashboard": {"latency_ms": {"p50": 1, "p95": 1, "p99": 1}, "queries": {"mean": 1}, "peak_memory_kib": 1},
+        }}
+        self.assertEqual(
+            benchmark.compare(before, after),
+            [("item_list", "p50 ms", 10, 5), ("item_list", "p95 ms", 20, 20), ("item_list", "p99 ms", 30, 40), ("item_list", "queries", 2, 3)],
+        )
+
+
+@skipIf(connection.vendor != "sqlite", "connection profiles are for SQLite")
+class SQLiteProfileTests(StoreTestCase):
+    def test_production_profile_tunes_each_new_connection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            wrapper = type(connections["default"])(
+                {**connection.settings_dict, "NAME": f"{tmp}/profile.sqlite3", "OPTIONS": settings.SQLITE_PROFILES["production"]},
+                alias="profile",
+            )
+            try:
+                with wrapper.cursor() as cursor:
+                    pragmas = {}
+                    for name in ("journal_mode", "synchronous", "busy_timeout", "mmap_size", "cache_size"):
+                        cursor.execute(f"PRAGMA {name}")
+                        pragmas[name] = cursor.fetchone()[0]
+                self.assertEqual(wrapper.transaction_mode, "IMMEDIATE")
+            finally:
+                wrapper.close()
+        self.assertEqual(pragmas, {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 20000, "mmap_size": 268435456, "cache_size": -65536})
+
+
+@skipIf(connection.vendor != "sqlite", "sync_replica copies SQLite files")
+@override_settings(STORE_REPLICA_ALIAS="test_replica", CACHES=TEST_CACHES)     #not "replica", which may be a TEST MIRROR here
+class ReplicaTests(TransactionTestCase):
+    """
+    A second SQLite file as the replica, filled by sync_replica() from this
+    test's database. Not a TestCase: SQLite cannot back up a database while
+    the test's transaction holds it.
+    """
+
+    databases = "__all__"       #resolved in setUpClass, once "test_replica" is defined
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings["test_replica"] = {**connections.settings["default"], "NAME": f"{cls.replica_dir.name}/replica.sqlite3", "OPTIONS": {}}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["test_replica"].close()
+        del connections["test_replica"]
+        del connections.settings["test_replica"]
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        StoreTestCase.setUp(self)
+
+    def test_lists_read_the_replica_until_the_user_writes(self):
+        Item.objects.create(name="Copied cement", category="Building", quantity=5, unit_price=10, reorder_level=1)
+        self.assertEqual(replicas.sync_replica(), list(replicas.GENERATIONS))     #first copy: every generation
+        Item.objects.create(name="Fresh nails", category="Building", quantity=5, unit_price=10, reorder_level=1)
+
+        response = self.client.get(reverse("store:item_list"))
+        self.assertContains(response, "Copied cement")
+        self.assertNotContains(response, "Fresh nails")
+        self.assertNotContains(self.client.get(reverse("store:item_export")), "Fresh nails")
+
+        response = self.client.post(reverse("store:client_create"), {"name": "Walk-in"})
+        self.assertIn(replicas.STICKY_COOKIE, response.cookies)
+        self.assertContains(self.client.get(reverse("store:item_list")), "Fresh nails")      #not the replica's cached page
+        self.assertContains(self.client.get(reverse("store:item_export")), "Fresh nails")
+
+        self.assertEqual(replicas.sync_replica(), ["item", "client"])
+        self.assertEqual(replicas.sync_replica(), [])
+        self.assertEqual(Item.objects.using("test_replica").count(), 2)
+        self.assertEqual(replicas.ReplicaRouter().db_for_write(Item, instance=Item.objects.using("test_replica").first()), "default")
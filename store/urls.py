@@ -6,40 +6,55 @@ app_name = "store"
 urlpatterns = [
     path("main-menu/", views.main_menu, name="main_menu"),
     path("dashboard/", views.dashboard, name="dashboard"),
+    path("search/", views.search_api, name="search_api"),
+    path("cache/stats/", views.cache_stats_api, name="cache_stats"),
+    path("reports/valuation/", views.valuation_report, name="valuation_report"),
+    path("reports/consumption/", views.consumption_report, name="consumption_report"),
+    path("autocomplete/<str:kind>/", views.autocomplete_api, name="autocomplete"),
 
     # items
     path("items/", views.item_list, name="item_list"),
+    path("items/export/", views.export_list, {"kind": "items"}, name="item_export"),
     path("items/add/", views.item_create, name="item_create"),
+    path("items/import/", views.item_import, name="item_import"),
     path("items/<int:pk>/edit/", views.item_update, name="item_update"),
     path("items/<int:pk>/delete/", views.item_delete, name="item_delete"),
 
     # suppliers
     path("suppliers/", views.supplier_list, name="supplier_list"),
+    path("suppliers/export/", views.export_list, {"kind": "suppliers"}, name="supplier_export"),
     path("suppliers/add/", views.supplier_create, name="supplier_create"),
     path("suppliers/<int:pk>/edit/", views.supplier_update, name="supplier_update"),
     path("suppliers/<int:pk>/delete/", views.supplier_delete, name="supplier_delete"),
 
     # clients
     path("clients/", views.client_list, name="client_list"),
+    path("clients/export/", views.export_list, {"kind": "clients"}, name="client_export"),
     path("clients/add/", views.client_create, name="client_create"),
     path("clients/<int:pk>/edit/", views.client_update, name="client_update"),
     path("clients/<int:pk>/delete/", views.client_delete, name="client_delete"),
 
     # orders
     path("orders/", views.order_list, name="order_list"),
+    path("orders/export/", views.export_list, {"kind": "orders"}, name="order_export"),
     path("orders/add/", views.order_create, name="order_create"),
+    path("orders/receive/", views.order_receive_selected, name="order_receive_selected"),
     path("orders/<int:pk>/edit/", views.order_update, name="order_update"),
     path("orders/<int:pk>/delete/", views.order_delete, name="order_delete"),
+    path("orders/<int:pk>/receive/", views.order_receive, name="order_receive"),
     path("orders/<int:order_id>/pay-mpesa/", views.start_mpesa_payment, name="order_pay_mpesa",
     ),
 
     # issues
     path("issues/", views.issue_list, name="issue_list"),
+    path("issues/export/", views.export_list, {"kind": "issues"}, name="issue_export"),
     path("issues/add/", views.issue_create, name="issue_create"),
     path("issues/<int:pk>/edit/", views.issue_update, name="issue_update"),
     path("issues/<int:pk>/delete/", views.issue_delete, name="issue_delete"),
 
     # payments
     path("payments/", views.payment_list, name="payment_list"),
+    path("payments/export/", views.export_list, {"kind": "payments"}, name="payment_export"),
     path("payments/add/", views.payment_create, name="payment_create"),
+    path("mpesa/callback/", views.mpesa_callback, name="mpesa_callback"),
 ]
@@ -0,0 +1,69 @@
+"""
+Stock and open-order valuation, summed by the database.
+
+The whole summary is one UNION ALL of two GROUP BY queries, each read from
+a covering index, so no row is loaded into Python. The sums spell out the
+expressions behind Item.total_value and SupplierOrder.total_cost instead of
+reading those generated columns: SQLite never treats an index on a generated
+column as covering, so it would visit every table row to read them.
+"""
+
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, IntegerField, Max, Sum, Value
+
+from .models import Item, SupplierOrder
+
+OPEN_ORDER_STATUS = "PENDING"     #ordered but not received yet
+CENTS = Decimal("0.01")
+
+
+def _stock_by_category():
+    return (
+        Item.objects.order_by()
+        .values("category")
+        .annotate(
+            group=Value("category"),
+            key=Value(None, output_field=IntegerField()),
+            label=Max("category"),      #an aggregate, so only the indexed column is grouped on and nothing is sorted
+            value=Sum(F("quantity") * F("unit_price"), output_field=DecimalField(max_digits=22, decimal_places=2)),
+            rows=Count("pk"),
+        )
+        .values_list("group", "key", "label", "value", "rows")
+    )
+
+
+def _open_orders_by_supplier():
+    return (
+        SupplierOrder.objects.filter(status=OPEN_ORDER_STATUS)
+        .order_by()
+        .values("supplier")
+        .annotate(
+            group=Value("supplier"),
+            key=Max("supplier"),
+            label=Max("supplier__name"),
+            value=Sum(F("quantity_ordered") * F("unit_price"), output_field=DecimalField(max_digits=22, decimal_places=2)),
+            rows=Count("pk"),
+        )
+        .values_list("group", "key", "label", "value", "rows")
+    )
+
+
+def valuation_summary():
+    """
+    {"stock_value", "stock_by_category", "open_order_value", "open_orders_by_supplier"}.
+    Each breakdown row is {"id", "name", "value", "rows"}, largest value first;
+    items without a category and orders without a supplier have an empty name.
+    """
+    groups = {"category": [], "supplier": []}
+    for group, key, label, value, rows in _stock_by_category().union(_open_orders_by_supplier(), all=True):
+        value = Decimal(value or 0).quantize(CENTS)     #SQLite hands back SUM() of a union as int or float
+        groups[group].append({"id": key, "name": label or "", "value": value, "rows": rows})
+    for rows in groups.values():
+        rows.sort(key=lambda row: (-row["value"], row["name"]))
+    return {
+        "stock_value": sum((row["value"] for row in groups["category"]), Decimal("0.00")),
+        "stock_by_category": groups["category"],
+        "open_order_value": sum((row["value"] for row in groups["supplier"]), Decimal("0.00")),
+        "open_orders_by_supplier": groups["supplier"],
+    }
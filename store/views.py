@@ -1,20 +1,30 @@
+import json
+from datetime import date
 
-from django_daraja.mpesa.core import MpesaClient
-from django.conf import settings
+from asgiref.sync import sync_to_async
 from django.contrib import messages #to show short messages
 from django.contrib.auth.decorators import login_required   #so user must be logged in before they can view that page.
-from django.db.models import Sum
-from django.shortcuts import get_object_or_404, redirect, render
+from django.db.models import Count, F, Q, Sum
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 
+from .caching import cache_response, cache_stats, cached_fragment, conditional_page
+from .counters import entity_counts
+from .dispatch import queue_mpesa_payment
+from .exports import FORMATS as EXPORT_FORMATS, stream_export
 from .forms import (
     ClientForm,
     ItemForm,
+    ItemImportForm,
     PaymentRecordForm,
     StockIssueForm,
     SupplierForm,
     SupplierOrderForm,
 )
+from .importer import import_items, read_rows
 from .models import (
     Client,
     Item,
@@ -23,10 +33,101 @@ from .models import (
     Supplier,
     SupplierOrder,
 )
+from .mpesa import apply_stk_result, callback_authorized, parse_stk_callback
+from .pagination import akeyset_paginate
+from .replicas import read_replica
+from .search import AUTOCOMPLETE_LIMIT, autocomplete, fts_enabled, matching_ids, search
+from .stock import InsufficientStock, OrderAlreadyReceived, cancel_issue, change_issue, issue_stock, receive_orders, save_order
+from .rollups import consumption
+from .valuation import valuation_summary
 
 
 
 
+# Querysets behind each list page. The exports use the same ones, so an
+# export always has the same rows as the list it was started from.
+
+def filtered_items(request):
+    items_qs = Item.objects.all()
+    status = request.GET.get("status", "")
+    if status in dict(Item.STATUS_CHOICES):     #?status=LOW or ?status=OUT, served from the (status, name) index
+        items_qs = items_qs.filter(status=status)
+    return items_qs
+
+
+def filtered_suppliers(request):
+    return Supplier.objects.all()
+
+
+def filtered_clients(request):
+    return Client.objects.all()
+
+
+def filtered_orders(request):
+    return SupplierOrder.objects.all()
+
+
+def filtered_issues(request):
+    return StockIssue.objects.all()
+
+
+def filtered_payments(request):
+    return PaymentRecord.objects.all()
+
+
+LIST_SOURCES = {     #export kind: (queryset, list ordering)
+    "items": (filtered_items, "name"),
+    "suppliers": (filtered_suppliers, "name"),
+    "clients": (filtered_clients, "name"),
+    "orders": (filtered_orders, "-ordered_at"),
+    "issues": (filtered_issues, "-issue_date"),
+    "payments": (filtered_payments, "-created_at"),
+}
+
+
+# Cached page pieces and responses, with the data they are built from.
+# store.signals bumps a generation whenever its model is written, which
+# retires every entry that lists it (see store.caching).
+CACHED_ENTRIES = {
+    "dashboard_stats": ("item", "supplier", "client", "order", "payment"),
+    "dashboard_items": ("item",),
+    "dashboard_recent": ("item",),
+    "dashboard_valuation": ("item", "order", "supplier"),
+    "item_table": ("item",),
+    "supplier_table": ("supplier",),
+    "client_table": ("client",),
+    "search_api": ("item", "supplier", "client"),
+    "valuation_report": ("item", "order", "supplier"),
+    "consumption_report": ("issue", "item", "client"),     #the rollups change with issues; names come from items and clients
+}
+
+
+# Pages answered with 304 Not Modified while these generations stand still
+# (see caching.conditional_page). Polling displays mostly get those.
+CONDITIONAL_PAGES = {
+    "dashboard": ("item", "supplier", "client", "order", "payment"),
+    "item_list": ("item",),
+    "supplier_list": ("supplier",),
+    "client_list": ("client",),
+    "order_list": ("order", "supplier", "item"),
+    "issue_list": ("issue", "item", "client"),
+    "payment_list": ("payment",),
+}
+
+
+def fragment(name, vary_on, template_name, get_context):
+    return cached_fragment(name, CACHED_ENTRIES[name], vary_on, template_name, get_context)
+
+
+async def arender(request, template_name, context=None):
+    """
+    render() for async views. The user is loaded with the async ORM first,
+    so {{ user }} in the template does not run a query on the event loop.
+    """
+    request.user = await request.auser()
+    return render(request, template_name, context)
+
+
 @login_required
 def main_menu(request):
     return render(request, "store/main_menu.html")
@@ -35,51 +136,155 @@ def main_menu(request):
 
 
 @login_required       #checks "is the user logged in?" If not, they are sent to the login page.
-def dashboard(request):    #request is the object that holds everything about the HTTP request,
+@read_replica
+@conditional_page(CONDITIONAL_PAGES["dashboard"])
+async def dashboard(request):    #request is the object that holds everything about the HTTP request,
     items_qs = Item.objects.all()   #like item list from database
     search_query = request.GET.get("search", "").strip()
+    search_results = []
     if search_query:
-        items_qs = items_qs.filter(name__icontains=search_query)
-
-    total_items = items_qs.count()
-    total_stock = (
-        items_qs.aggregate(total_qty=Sum("quantity"))["total_qty"] or 0
-    )
-    low_stock_count = items_qs.filter(
-        quantity__gt=0, quantity__lte=5
-    ).count()
-    out_of_stock_count = items_qs.filter(quantity=0).count()
-    recent_items = items_qs.order_by("-date_added")[:5]      #.order_by("-date_added") sorts items from newest to oldest.
-
-    supplier_count = Supplier.objects.count()
-    client_count = Client.objects.count()
-    order_count = SupplierOrder.objects.count()
-    pending_payment_count = PaymentRecord.objects.filter(
-        status="PENDING"
-    ).count()
+        if fts_enabled():
+            items_qs = items_qs.filter(pk__in=matching_ids(search_query, "item"))   #uses the FTS5 index instead of scanning names
+        else:
+            items_qs = items_qs.filter(name__icontains=search_query)
+        search_results = await sync_to_async(search)(search_query, kinds=["supplier", "client"], limit=10)
+
+    # The widgets below are cached fragments; each function only runs on a cache miss.
+    async def stats_context():
+        # One query for all the item numbers: each Count(filter=...) becomes a CASE WHEN inside the same SELECT.
+        item_stats = await items_qs.aaggregate(
+            total_items=Count("id"),
+            total_stock=Sum("quantity"),
+            total_value=Sum(F("quantity") * F("unit_price")),    #same as Sum("total_value"), but item_stock_totals_idx covers it
+            low_stock_count=Count("id", filter=Q(status="LOW")),
+            out_of_stock_count=Count("id", filter=Q(status="OUT")),
+        )
+        return {
+            "total_items": item_stats["total_items"],
+            "total_stock": item_stats["total_stock"] or 0,
+            "total_value": item_stats["total_value"] or 0,
+            "low_stock_count": item_stats["low_stock_count"],
+            "out_of_stock_count": item_stats["out_of_stock_count"],
+            **await sync_to_async(entity_counts)(),     #supplier_count, client_count, order_count, pending_payment_count
+        }
+
+    async def items_context():
+        return {"items": await akeyset_paginate(request, items_qs, "-date_added")}
+
+    async def recent_context():
+        return {"recent_items": [item async for item in items_qs.order_by("-date_added")[:5]]}      #.order_by("-date_added") sorts items from newest to oldest.
+
+    async def valuation_context():
+        summary = await sync_to_async(valuation_summary)()
+        return {
+            **summary,
+            "stock_by_category": summary["stock_by_category"][:5],
+            "open_orders_by_supplier": summary["open_orders_by_supplier"][:5],
+        }
 
     context = {
-        "items": items_qs.order_by("-date_added"),
         "search_query": search_query,
-        "total_items": total_items,
-        "total_stock": total_stock,
-        "low_stock_count": low_stock_count,
-        "out_of_stock_count": out_of_stock_count,
-        "recent_items": recent_items,
-        "supplier_count": supplier_count,
-        "client_count": client_count,
-        "order_count": order_count,
-        "pending_payment_count": pending_payment_count,
+        "search_results": search_results,
+        "stats": await fragment("dashboard_stats", search_query, "store/_dashboard_stats.html", stats_context),
+        "item_table": await fragment("dashboard_items", request.get_full_path(), "store/_dashboard_items.html", items_context),
+        "recent": await fragment("dashboard_recent", search_query, "store/_dashboard_recent.html", recent_context),
+        "valuation": await fragment("dashboard_valuation", "", "store/_dashboard_valuation.html", valuation_context),
     }
-    return render(request, "store/dashboard.html", context)
+    return await arender(request, "store/dashboard.html", context)
+
+
+@login_required
+@cache_response("search_api", CACHED_ENTRIES["search_api"])
+def search_api(request):
+    """JSON search over items, suppliers and clients: ?q=cem&kind=item&limit=10"""
+    query = request.GET.get("q", "").strip()
+    kinds = request.GET.getlist("kind") or None
+    try:
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        limit = 20
+    return JsonResponse({"query": query, "results": search(query, kinds=kinds, limit=limit)})
+
+
+@login_required
+@read_replica
+@cache_response("valuation_report", CACHED_ENTRIES["valuation_report"])
+def valuation_report(request):
+    """Stock value by category and open-order value by supplier, as JSON."""
+    return JsonResponse(valuation_summary())
+
+
+@login_required
+@read_replica
+@cache_response("consumption_report", CACHED_ENTRIES["consumption_report"])
+def consumption_report(request):
+    """
+    Units issued per period, as JSON for tables and charts, read from the
+    consumption rollups: ?period=MONTH|WEEK|DAY&start=2025-01-01&end=2025-12-01
+    &by=item|client|category, narrowed by &item=<id>, &client=<id> or &category=.
+    """
+    params = request.GET
+    try:
+        report = consumption(
+            period=params.get("period", "MONTH").upper(),
+            start=date.fromisoformat(params["start"]) if params.get("start") else None,
+            end=date.fromisoformat(params["end"]) if params.get("end") else None,
+            by=params.get("by", "item"),
+            item=int(params["item"]) if params.get("item") else None,
+            client=int(params["client"]) if params.get("client") else None,
+            category=params.get("category"),
+        )
+    except ValueError as e:     #also a malformed date or id
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(report)
+
+
+@login_required
+@read_replica
+def export_list(request, kind):
+    """Stream a list as ?format=csv (default) or ?format=jsonl."""
+    queryset_for, ordering = LIST_SOURCES[kind]
+    fmt = request.GET.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        fmt = "csv"
+    tiebreak = "-pk" if ordering.startswith("-") else "pk"
+    return stream_export(queryset_for(request).order_by(ordering, tiebreak), kind, fmt)
+
+
+@login_required
+def autocomplete_api(request, kind):
+    """Choices for an AutocompleteSelect: ?q=cem&limit=10 -> {"results": [{"id": 1, "text": "Cement"}]}"""
+    if kind not in ("item", "supplier", "client", "order"):
+        raise Http404("Unknown autocomplete list.")
+    try:
+        limit = int(request.GET.get("limit", AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    choices = autocomplete(kind, request.GET.get("q", ""), limit)
+    return JsonResponse({"results": [{"id": pk, "text": label} for pk, label in choices]})
+
+
+@login_required
+def cache_stats_api(request):
+    """Hit and miss counts for every cached page piece and response."""
+    return JsonResponse({"entries": cache_stats(CACHED_ENTRIES)})
 
 
 # Items
 
 @login_required
-def item_list(request):
-    items = Item.objects.all().order_by("name")
-    return render(request, "store/item_list.html", {"items": items})
+@read_replica
+@conditional_page(CONDITIONAL_PAGES["item_list"])
+async def item_list(request):
+    async def table_context():
+        return {"items": await akeyset_paginate(request, filtered_items(request), "name")}
+
+    table = await fragment("item_table", request.get_full_path(), "store/_item_table.html", table_context)
+    return await arender(
+        request,
+        "store/item_list.html",
+        {"table": table, "status": request.GET.get("status", "")},
+    )
 
 
 @login_required
@@ -99,6 +304,32 @@ def item_create(request):
     )
 
 
+@login_required
+def item_import(request):
+    result = None
+    if request.method == "POST":
+        form = ItemImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            try:
+                result = import_items(read_rows(upload.file, upload.name))
+            except (ValueError, UnicodeDecodeError) as e:
+                messages.error(request, f"Could not read the file. Reason: {e}")
+            else:
+                messages.success(
+                    request,
+                    f"Import finished: {result.created} created, {result.updated} updated, "
+                    f"{result.error_count} rows skipped.",
+                )
+    else:
+        form = ItemImportForm()
+    return render(
+        request,
+        "store/item_import.html",
+        {"form": form, "result": result},
+    )
+
+
 @login_required
 def item_update(request, pk):        #primary key (id) of the item from the URL.
     item = get_object_or_404(Item, pk=pk)           #fetch the item if not tgere show 404 page
@@ -134,12 +365,17 @@ def item_delete(request, pk):
 # Suppliers
 
 @login_required
-def supplier_list(request):
-    suppliers = Supplier.objects.all().order_by("name")   #fetsch all list of suppliers ordered by name
-    return render(
+@read_replica
+@conditional_page(CONDITIONAL_PAGES["supplier_list"])
+async def supplier_list(request):
+    async def table_context():
+        return {"suppliers": await akeyset_paginate(request, filtered_suppliers(request), "name")}   #fetsch one page of suppliers ordered by name
+
+    table = await fragment("supplier_table", request.get_full_path(), "store/_supplier_table.html", table_context)
+    return await arender(
         request,
         "store/supplier_list.html",
-        {"suppliers": suppliers},
+        {"table": table},
     )
 
 
@@ -196,12 +432,17 @@ def supplier_delete(request, pk):
 
 
 @login_required
-def client_list(request):
-    clients = Client.objects.all().order_by("name")
-    return render(
+@read_replica
+@conditional_page(CONDITIONAL_PAGES["client_list"])
+async def client_list(request):
+    async def table_context():
+        return {"clients": await akeyset_paginate(request, filtered_clients(request), "name")}
+
+    table = await fragment("client_table", request.get_full_path(), "store/_client_table.html", table_context)
+    return await arender(
         request,
         "store/client_list.html",
-        {"clients": clients},
+        {"table": table},
     )
 
 
@@ -258,11 +499,15 @@ def client_delete(request, pk):
 
 
 @login_required
-def order_list(request):
-    orders = SupplierOrder.objects.select_related("supplier", "item").order_by(
-        "-ordered_at"
+@read_replica
+@conditional_page(CONDITIONAL_PAGES["order_list"])
+async def order_list(request):
+    orders = await akeyset_paginate(
+        request,
+        filtered_orders(request).select_related("supplier", "item"),
+        "-ordered_at",
     )
-    return render(
+    return await arender(
         request,
         "store/order_list.html",
         {"orders": orders},
@@ -274,7 +519,7 @@ def order_create(request):
     if request.method == "POST":
         form = SupplierOrderForm(request.POST)
         if form.is_valid():
-            form.save()
+            save_order(form.save(commit=False))      #an order entered as RECEIVED adds its stock
             messages.success(request, "Supplier order recorded.")
             return redirect("store:order_list")
     else:
@@ -294,9 +539,13 @@ def order_update(request, pk):
     if request.method == "POST":
         form = SupplierOrderForm(request.POST, instance=order)
         if form.is_valid():
-            form.save()
-            messages.success(request, "Order updated successfully.")
-            return redirect("store:order_list")
+            try:
+                save_order(form.save(commit=False))      #PENDING -> RECEIVED adds the stock
+            except OrderAlreadyReceived as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, "Order updated successfully.")
+                return redirect("store:order_list")
     else:
         form = SupplierOrderForm(instance=order)
 
@@ -329,15 +578,44 @@ def order_delete(request, pk):
         },
     )
 
+@login_required
+@require_POST
+def order_receive(request, pk):
+    if receive_orders([pk]):
+        messages.success(request, "Order received and stock updated.")
+    else:
+        messages.warning(request, "That order is not pending, nothing was received.")
+    return redirect("store:order_list")
+
+
+@login_required
+@require_POST
+def order_receive_selected(request):
+    """Receive every order ticked on the list page in one transaction."""
+    ids = [int(pk) for pk in request.POST.getlist("order") if pk.isdigit()]
+    received = receive_orders(ids)
+    skipped = len(ids) - received
+    if received:
+        messages.success(request, f"{received} orders received and stock updated.")
+    if skipped:
+        messages.warning(request, f"{skipped} selected orders were not pending and were skipped.")
+    if not ids:
+        messages.warning(request, "No orders were selected.")
+    return redirect("store:order_list")
+
 # Stock issues
 
 
 @login_required
-def issue_list(request):
-    issues = StockIssue.objects.select_related("item", "client").order_by(
-        "-issue_date"
+@read_replica
+@conditional_page(CONDITIONAL_PAGES["issue_list"])
+async def issue_list(request):
+    issues = await akeyset_paginate(
+        request,
+        filtered_issues(request).select_related("item", "client"),
+        "-issue_date",
     )
-    return render(
+    return await arender(
         request,
         "store/issue_list.html",
         {"issues": issues},
@@ -350,16 +628,11 @@ def issue_create(request):
         form = StockIssueForm(request.POST)
         if form.is_valid():
             issue = form.save(commit=False)  #form.save(commit=False) creates a StockIssue object in memory but does not save it to the database yet.This gives you a chance to adjust stock before saving.
-            item = issue.item
-            if issue.quantity > item.quantity:
-                messages.error(
-                    request,
-                    "Cannot issue more than the current stock quantity.",
-                )
+            try:
+                issue_stock(issue)       #takes the stock and saves the issue in one transaction
+            except InsufficientStock as e:
+                messages.error(request, str(e))
             else:
-                item.quantity -= issue.quantity
-                item.save()
-                issue.save()
                 messages.success(
                     request,
                     "Issue recorded and stock updated.",
@@ -381,9 +654,13 @@ def issue_update(request, pk):
     if request.method == "POST":
         form = StockIssueForm(request.POST, instance=issue)
         if form.is_valid():
-            form.save()
-            messages.success(request, "Issue updated successfully.")
-            return redirect("store:issue_list")
+            try:
+                change_issue(form.save(commit=False))      #the change is worked out from the stored row
+            except InsufficientStock as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, "Issue updated successfully.")
+                return redirect("store:issue_list")
     else:
         form = StockIssueForm(instance=issue)
 
@@ -403,8 +680,10 @@ def issue_delete(request, pk):
     issue = get_object_or_404(StockIssue, pk=pk)
 
     if request.method == "POST":
-        issue.delete()
-        messages.success(request, "Issue deleted.")
+        if cancel_issue(issue):      #deletes the issue and returns its quantity to stock
+            messages.success(request, "Issue deleted and stock returned.")
+        else:
+            messages.error(request, "This issue had already been deleted.")
         return redirect("store:issue_list")
 
     return render(
@@ -423,11 +702,15 @@ def issue_delete(request, pk):
 # Payments
 
 @login_required
-def payment_list(request):
-    payments = PaymentRecord.objects.select_related("order").order_by(
-        "-created_at"
+@read_replica
+@conditional_page(CONDITIONAL_PAGES["payment_list"])
+async def payment_list(request):
+    payments = await akeyset_paginate(
+        request,
+        filtered_payments(request).select_related("order"),
+        "-created_at",
     )
-    return render(
+    return await arender(
         request,
         "store/payment_list.html",
         {"payments": payments},
@@ -454,12 +737,13 @@ def payment_create(request):
 # M-Pesa payment for an order
 
 @login_required
-def start_mpesa_payment(request, order_id):
+async def start_mpesa_payment(request, order_id):
     """
-    Start a real M-Pesa STK push using django_daraja MpesaClient.
+    Record an M-Pesa payment and queue its STK push. The push itself is sent
+    by the run_mpesa_worker command, so a slow Safaricom answer never holds
+    up this request.
     """
-    order = get_object_or_404(SupplierOrder, id=order_id)
-    cl = MpesaClient()
+    order = await aget_object_or_404(SupplierOrder.objects.select_related("supplier"), id=order_id)
 
     if request.method == "POST":
         phone = request.POST.get("phone_number", "").strip()   #get phone number from user request nd if it doesn't exist, return empty string
@@ -468,68 +752,37 @@ def start_mpesa_payment(request, order_id):
             return redirect("store:order_pay_mpesa", order_id=order.id)   #order_id=order.id passes the id into the URL.
 
         amount = order.total_cost or 1  # If total_cost is None or zero, or 1 ensures there is at least 1. Safaricom cannot process 0 shillings.
+        await sync_to_async(queue_mpesa_payment)(order, phone, amount)     #one transaction, so it runs in a worker thread
 
-        # 1. Create a PaymentRecord first
-        payment = PaymentRecord.objects.create(
-            order=order,
-            method="MPESA",
-            amount=amount,
-            status="PENDING",
-            phone_number=phone,
+        messages.success(
+            request,
+            "M-Pesa payment started. An STK push will be sent to the phone shortly; enter your PIN when it arrives."
         )
-
-        # 2. Call Safaricom using MpesaClient
-        account_reference = f"Order-{order.id}"
-        transaction_desc = "ITEMO IMS payment"
-        callback_url = settings.MPESA_CALLBACK_URL
-
-        try:            #Start a block where we will "try" to run some code that might fail.
-            response = cl.stk_push(
-                phone,
-                int(amount),  # amount must be an integer
-                account_reference,
-                transaction_desc,
-                callback_url,
-            )
-            
-            # Print to terminal for debugging
-            print("M-Pesa STK raw response:", response)
-            
-            # Try to extract something readable
-            try:
-                resp_data = response
-            except Exception:
-                resp_data = str(response)
-            
-            # Optional: show part of it in the UI to users
-            messages.info(
-                request,
-                f"M-Pesa response: {resp_data}"
-            )
-            
-            messages.success(
-                request,
-                "STK push sent. Check your phone for the M-Pesa prompt and enter your PIN."
-            )
-            
-            payment.reference = "MPESA_STK_SENT"
-            payment.save()
-        
-        
-        except Exception as e:
-            # If anything fails, mark the payment as FAILED
-            payment.status = "FAILED"
-            payment.reference = "ERROR"
-            payment.save()
-            messages.error(
-                request,
-                f"Could not start M-Pesa payment. Reason: {e}"
-            )
-
         return redirect("store:payment_list")
 
     # GET: show the pay form
-    return render(request, "store/order_pay_mpesa.html", {"order": order})
+    return await arender(request, "store/order_pay_mpesa.html", {"order": order})
+
+
+@csrf_exempt        #Safaricom posts here, it has no CSRF token or session
+@require_POST
+def mpesa_callback(request):
+    """
+    STK push result from Daraja (MPESA_CALLBACK_URL). Anyone can reach this
+    URL, so only a request carrying MPESA_CALLBACK_TOKEN is believed. The
+    payment is found by its CheckoutRequestID and settled in one UPDATE; a
+    repeated delivery changes nothing and is still acknowledged, so Safaricom
+    stops retrying. One that matches no payment yet is kept until it does.
+    """
+    if not callback_authorized(request):
+        return JsonResponse({"ResultCode": 1, "ResultDesc": "Rejected"}, status=403)
+    try:
+        result = parse_stk_callback(json.loads(request.body))
+    except ValueError:      #also covers bad JSON
+        return JsonResponse({"ResultCode": 1, "ResultDesc": "Rejected"}, status=400)
+
+    apply_stk_result(**result)
+    return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
 
 
 